@@ -1,6 +1,15 @@
-from flask import Flask, jsonify, request
+import json
+import math
+import queue
+import threading
+from contextlib import contextmanager
+from flask import Flask, Response, jsonify, request
+from backend import heatmap_codec
 from backend.service import get_outage_heatmap
-from backend.algorithm import dispatch_algorithm
+from backend.algorithm import DispatchAlgorithm
+from backend.session_store import session_store
+from backend.decay_cache import decay_cache
+from backend.metrics import metrics, server_timing
 from backend.gaode_api import get_driving_distance
 from backend.scheduler import run_schedule
 
@@ -9,28 +18,268 @@ app = Flask(__name__)
 # 注意：前端使用 Vite 代理 (proxy) 转发 /api 请求到 5000 端口
 # 因此这里不需要配置 CORS，除非前端和后端部署在不同域名下
 
+# 瞬时指标: 导出 /metrics 时读取
+metrics.add_gauge('dispatch_sessions', 'Active algorithm sessions.', lambda: len(session_store))
+metrics.add_gauge('dispatch_decay_cache_bytes', 'Bytes held by the decay cache.',
+                  lambda: decay_cache.stats()['bytes'])
+metrics.add_gauge('dispatch_decay_cache_hits', 'Decay cache hits since start.',
+                  lambda: decay_cache.stats()['hits'])
+metrics.add_gauge('dispatch_decay_cache_misses', 'Decay cache misses since start.',
+                  lambda: decay_cache.stats()['misses'])
+
+@app.before_request
+def _start_timing():
+    metrics.start_request()
+
+@app.after_request
+def _finish_timing(response):
+    """记录路由延迟，并通过 Server-Timing 响应头返回本次请求各阶段的耗时"""
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    elapsed, phases = metrics.finish_request(route, request.method, response.status_code)
+    response.headers['Server-Timing'] = server_timing(elapsed, phases)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def route_metrics():
+    """Prometheus 文本格式的指标 (路由延迟直方图、各计算阶段耗时直方图、缓存与会话状态)"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def _session_id(data=None):
+    """会话标识: 请求头 X-Session-Id，或查询参数/请求体中的 sessionId"""
+    return (request.headers.get('X-Session-Id')
+            or request.args.get('sessionId')
+            or (data or {}).get('sessionId'))
+
+@contextmanager
+def _algorithm_for(data=None):
+    """
+    获取本次请求使用的调度状态
+    - 请求体携带 outagePoints 时: 使用一次性的请求级状态 (无状态请求，可在任意 worker 上处理)
+    - 否则: 使用会话级状态，并在整个请求期间持有该会话的锁
+    """
+    outage_points = (data or {}).get('outagePoints')
+    if isinstance(outage_points, list):
+        algorithm = DispatchAlgorithm()
+        algorithm.map_outage_to_grid(outage_points)
+        yield algorithm
+        return
+
+    session = session_store.get(_session_id(data))
+    with session.lock:
+        yield session.algorithm
+
+def _truncation_args(data):
+    """
+    读取可选的支援核截断参数:
+    supportEpsilon (丢弃 exp(-dist) < epsilon 的贡献) 或 supportRadiusKm (截断半径)
+    """
+    return {
+        'epsilon': data.get('supportEpsilon'),
+        'radius_km': data.get('supportRadiusKm')
+    }
+
+def _local_search_args(data):
+    """
+    读取可选的局部搜索参数:
+    localSearch: true 使用默认预算，或 {maxIterations, timeLimit} 指定迭代/时间预算
+    """
+    options = data.get('localSearch')
+    if not options:
+        return None
+    if options is True:
+        return {}
+    args = {}
+    if options.get('maxIterations') is not None:
+        args['max_iterations'] = int(options['maxIterations'])
+    if options.get('timeLimit') is not None:
+        args['time_limit'] = float(options['timeLimit'])
+    return args
+
+def _large_fleet_args(data):
+    """
+    读取可选的大车队模式参数:
+    largeFleet: 缺省时按车辆数自动选择，true/false 强制开关，或 {steps} 指定分组贪心的总步数
+    """
+    options = data.get('largeFleet')
+    if options is None or isinstance(options, bool):
+        return options
+    args = {}
+    if options.get('steps') is not None:
+        args['steps'] = int(options['steps'])
+    return args
+
+def _heatmap_options(data=None):
+    """
+    热力图格式协商 (默认仍为 [{lng, lat, count}] JSON 列表):
+    - format=compact (查询参数) 或 heatmapFormat='compact' (请求体): 元数据 + base64 量化数组
+    - Accept: application/octet-stream: 原始二进制，元数据以 JSON 放在 X-Heatmap-Meta 响应头
+    - dtype=uint8|uint16: 量化精度; baseVersion=N: 相对客户端已持有版本的差分
+    Returns: None 表示使用默认 JSON，否则为 {'binary', 'dtype', 'base_version'}
+    """
+    data = data or {}
+    fmt = request.args.get('format') or data.get('heatmapFormat') or 'json'
+    binary = request.accept_mimetypes.best_match(
+        ['application/json', 'application/octet-stream']) == 'application/octet-stream'
+    if fmt != 'compact' and not binary:
+        return None
+    base_version = request.args.get('baseVersion', type=int)
+    if base_version is None and data.get('baseVersion') is not None:
+        base_version = int(data['baseVersion'])
+    return {
+        'binary': binary,
+        'dtype': request.args.get('dtype') or data.get('dtype') or 'uint8',
+        'base_version': base_version
+    }
+
+def _compact_heatmap(algorithm, layer, options):
+    meta, quantized, base = algorithm.encode_heatmap(layer, options['dtype'], options['base_version'])
+    return heatmap_codec.to_json(meta, quantized, base)
+
+def _heatmap_response(algorithm, layer, data=None):
+    """按协商结果返回单个图层的热力图"""
+    try:
+        options = _heatmap_options(data)
+        if options is None:
+            points = (algorithm.get_outage_heat_points() if layer == 'outage'
+                      else algorithm.get_support_heat_points())
+            return jsonify(points)
+        if options['binary']:
+            meta, quantized, base = algorithm.encode_heatmap(layer, options['dtype'], options['base_version'])
+            return Response(heatmap_codec.to_bytes(quantized, base), mimetype='application/octet-stream',
+                            headers={'X-Heatmap-Meta': json.dumps(meta)})
+        return jsonify(_compact_heatmap(algorithm, layer, options))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+# SSE 流在没有新事件时发送注释行保持连接的间隔 (秒)
+SSE_KEEPALIVE_SECONDS = 15.0
+
+def _sse_event(event, payload):
+    return f'event: {event}\ndata: {json.dumps(payload)}\n\n'
+
+def _stream_schedule(data):
+    """
+    anytime 调度: 后台线程求解，每找到更优的解推送一个 incumbent 事件 {objective, elapsed, routes}，
+    结束时推送 result (与非流式响应体相同) 或 error 事件
+    客户端断开时响应生成器被关闭 (GeneratorExit)，通过 cancel 通知求解线程提前结束
+    """
+    events = queue.Queue()
+    cancel = threading.Event()
+
+    def solve():
+        result = run_schedule(data, on_incumbent=lambda event: events.put(('incumbent', event)), cancel=cancel)
+        events.put(('result' if result.get('status') == 'success' else 'error', result))
+
+    threading.Thread(target=solve, daemon=True).start()
+
+    def generate():
+        try:
+            while True:
+                try:
+                    name, payload = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield _sse_event(name, payload)
+                if name != 'incumbent':
+                    return
+        except GeneratorExit:
+            cancel.set()
+            raise
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/schedule-deterministic', methods=['POST'])
 def route_schedule_deterministic():
-    """确定性停电调度"""
+    """
+    确定性停电调度
+    可选 timeLimit (秒) 指定本次求解的时间上限；
+    查询参数 stream=1 或 Accept: text/event-stream 时以 SSE 推送逐步改进的方案 (anytime 模式)
+    """
     data = request.json
-    # data 结构: { tasks: [...], vehicles: [...], depots: [...] }
+    # data 结构: { tasks: [...], vehicles: [...], depots: [...], solver?, workers?, timeLimit?, maxTripTasks? }
     if not data:
         return jsonify({'status': 'error', 'message': 'Empty body'}), 400
-        
+
+    if request.args.get('stream') in ('1', 'true') or 'text/event-stream' in request.headers.get('Accept', ''):
+        return _stream_schedule(data)
+
     result = run_schedule(data)
     if result.get('status') == 'error':
         return jsonify(result), 400
     return jsonify(result)
 
-@app.route('/api/outage-heatmap', methods=['GET'])
+@app.route('/api/outage-heatmap', methods=['GET', 'POST'])
 def route_outage_heatmap():
-    """获取断电概率热力图"""
-    raw_data = get_outage_heatmap()
-    # 1. 将原始数据映射到算法网格
-    dispatch_algorithm.map_outage_to_grid(raw_data)
-    # 2. 返回网格化的数据，确保前端显示的分辨率与算法一致
-    grid_data = dispatch_algorithm.get_outage_heat_points()
-    return jsonify(grid_data)
+    """
+    获取断电概率热力图
+    GET: 模拟数据，可选参数 ?points=N 指定模拟事件数量
+    POST: 上传真实断电事件 [{lng, lat, count}, ...]
+    """
+    if request.method == 'POST':
+        raw_data = request.json
+        if not isinstance(raw_data, list):
+            return jsonify({'error': 'Expected a list of outage points'}), 400
+    else:
+        with metrics.phase('outage_generation'):
+            raw_data = get_outage_heatmap(request.args.get('points', 120, type=int))
+    with _algorithm_for() as algorithm:
+        # 1. 将原始数据映射到算法网格 (大规模事件自动走分箱卷积路径)
+        algorithm.map_outage_to_grid(raw_data)
+        # 2. 返回网格化的数据，确保前端显示的分辨率与算法一致
+        return _heatmap_response(algorithm, 'outage')
+
+def _is_number(value):
+    """有限的 int / float (bool 不算数值)"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+@app.route('/api/outage-events', methods=['POST'])
+def route_outage_events():
+    """
+    增量更新当前会话的断电事件 (实时事件流)
+    body: { add: [{lng, lat, count}, ...], remove: [{lng, lat, count}, ...] }
+    只修补受影响的网格，返回更新摘要与新的 outage 状态版本 (可配合 baseVersion / 瓦片接口拉取变化)
+    """
+    data = request.json or {}
+    added = data.get('add') or []
+    removed = data.get('remove') or []
+    events = added + removed if isinstance(added, list) and isinstance(removed, list) else None
+    if events is None or not all(
+            isinstance(p, dict) and all(_is_number(p.get(k)) for k in ('lng', 'lat', 'count')) for p in events):
+        return jsonify({'error': 'Expected add/remove lists of {lng, lat, count}'}), 400
+
+    with _algorithm_for(data) as algorithm:
+        return jsonify(algorithm.update_outage_events(added, removed))
+
+@app.route('/api/support-heatmap', methods=['GET'])
+def route_support_heatmap():
+    """获取当前会话的支援热力图 (支持紧凑格式与差分)"""
+    with _algorithm_for() as algorithm:
+        return _heatmap_response(algorithm, 'support')
+
+@app.route('/api/heatmap-tile', methods=['GET'])
+def route_heatmap_tile():
+    """
+    视口瓦片热力图 (按地图视口与缩放级别返回，适合大网格)
+    参数: layer=outage|support, bbox=minLng,minLat,maxLng,maxLat, zoom=地图缩放级别 (可以是小数，如 11.5，向下取整)
+    低缩放级别返回池化后的网格；瓦片按会话状态版本缓存，状态未变化时平移/缩放直接命中缓存
+    """
+    layer = request.args.get('layer', 'outage')
+    zoom = request.args.get('zoom', type=float)
+    try:
+        bbox = [float(v) for v in request.args.get('bbox', '').split(',')]
+    except ValueError:
+        bbox = []
+    if len(bbox) != 4 or zoom is None or not math.isfinite(zoom):
+        return jsonify({'error': 'Expected bbox=minLng,minLat,maxLng,maxLat and zoom'}), 400
+    zoom = int(math.floor(zoom))
+
+    with _algorithm_for() as algorithm:
+        try:
+            return jsonify(algorithm.get_heatmap_tiles(layer, bbox, zoom))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
 @app.route('/api/optimize', methods=['POST'])
 def route_optimize():
@@ -42,13 +291,52 @@ def route_optimize():
     if not vehicles or not parking_spots:
         return jsonify({'error': 'Missing vehicles or parking spots'}), 400
 
-    optimized_vehicles, loss, support_heatmap = dispatch_algorithm.find_best_spots(vehicles, parking_spots)
-    
-    return jsonify({
-        'vehicles': optimized_vehicles,
-        'loss': loss,
-        'supportHeatmap': support_heatmap
-    })
+    # 可选的多分辨率参数: resolution / range / pyramidLevels / refineTopK
+    # 可选的 workers: 候选停车点试算分片到多进程 (大规模停车点集合)
+    multires = any(data.get(k) is not None for k in ('resolution', 'range', 'pyramidLevels'))
+    pyramid = None
+    with _algorithm_for(data) as algorithm:
+        try:
+            compact = _heatmap_options(data)
+            result_grid = algorithm
+            if multires:
+                optimized_vehicles, loss, support_heatmap, pyramid, result_grid = algorithm.find_best_spots_multires(
+                    vehicles, parking_spots,
+                    resolution=data.get('resolution'),
+                    range_val=data.get('range'),
+                    levels=data.get('pyramidLevels') or 1,
+                    top_k=data.get('refineTopK'),
+                    local_search=_local_search_args(data),
+                    with_heatmap=compact is None,
+                    large_fleet=_large_fleet_args(data),
+                    workers=data.get('workers'),
+                    **_truncation_args(data))
+            else:
+                optimized_vehicles, loss, support_heatmap = algorithm.find_best_spots(
+                    vehicles, parking_spots, local_search=_local_search_args(data),
+                    with_heatmap=compact is None, large_fleet=_large_fleet_args(data),
+                    workers=data.get('workers'), **_truncation_args(data))
+            if compact is not None:
+                support_heatmap = _compact_heatmap(result_grid, 'support', compact)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        result = {
+            'vehicles': optimized_vehicles,
+            'loss': loss,
+            'supportHeatmap': support_heatmap
+        }
+        if pyramid:
+            result['pyramid'] = pyramid
+        if algorithm.fleet_report:
+            result['largeFleet'] = algorithm.fleet_report
+        if algorithm.local_search_report:
+            result['localSearch'] = algorithm.local_search_report
+        if algorithm.support_error_bound:
+            result['supportErrorBound'] = algorithm.support_error_bound
+        if algorithm.distance_report:
+            result['distanceAccuracy'] = algorithm.distance_report
+    return jsonify(result)
 
 @app.route('/api/calculate-loss', methods=['POST'])
 def route_calculate_loss():
@@ -56,13 +344,52 @@ def route_calculate_loss():
     data = request.json
     vehicles = data.get('vehicles', [])
     
-    dispatch_algorithm.calculate_total_support(vehicles)
-    loss = dispatch_algorithm.calculate_loss()
-    support_heatmap = dispatch_algorithm.get_support_heat_points()
-    
+    with _algorithm_for(data) as algorithm:
+        try:
+            compact = _heatmap_options(data)
+            algorithm.calculate_total_support(vehicles, **_truncation_args(data))
+            loss = algorithm.calculate_loss()
+            if compact is not None:
+                support_heatmap = _compact_heatmap(algorithm, 'support', compact)
+            else:
+                support_heatmap = algorithm.get_support_heat_points()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        result = {
+            'loss': loss,
+            'supportHeatmap': support_heatmap
+        }
+        if algorithm.support_error_bound:
+            result['supportErrorBound'] = algorithm.support_error_bound
+        if algorithm.distance_report:
+            result['distanceAccuracy'] = algorithm.distance_report
+    return jsonify(result)
+
+@app.route('/api/calculate-loss-batch', methods=['POST'])
+def route_calculate_loss_batch():
+    """
+    批量 what-if 评估多个车辆配置的 Loss (不修改当前支援状态)
+    body: { configurations: [[vehicle, ...], ...] 或 [{vehicles: [...]}, ...],
+            includeHeatmaps: bool }
+    """
+    data = request.json or {}
+    configurations = data.get('configurations')
+    if not isinstance(configurations, list) or not configurations:
+        return jsonify({'error': 'Missing configurations'}), 400
+    configurations = [c.get('vehicles', []) if isinstance(c, dict) else c for c in configurations]
+
+    with _algorithm_for(data) as algorithm:
+        try:
+            results = algorithm.evaluate_configurations(
+                configurations, include_heatmaps=bool(data.get('includeHeatmaps')), **_truncation_args(data))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    losses = [r['loss'] for r in results]
     return jsonify({
-        'loss': loss,
-        'supportHeatmap': support_heatmap
+        'results': results,
+        'bestIndex': losses.index(min(losses))
     })
 
 @app.route('/api/test-distance', methods=['POST'])
@@ -82,4 +409,5 @@ def route_test_distance():
     return jsonify({'distance_meters': dist, 'distance_km': dist / 1000.0})
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # 调度状态按会话隔离，可以使用多线程处理并发请求
+    app.run(debug=True, port=5000, threaded=True)
\ No newline at end of file
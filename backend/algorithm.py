@@ -1,224 +1,1208 @@
+import itertools
 import math
 import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
 from backend.gaode_api import get_driving_distance
+from backend.decay_cache import decay_cache, point_key
+from backend import sparse_support
+from backend import heatmap_codec
+from backend import parallel
+from backend.metrics import metrics
+from backend.tiles import TileCache
 
 # 配置常量 (需与前端保持一致或由前端传入，这里先硬编码)
 CITY_CENTER = [114.5149, 38.0428]
 GRID_RESOLUTION = 50  # 提高网格分辨率以获得更细腻的热力图
+GRID_RANGE = 0.15     # 网格覆盖范围: 中心点 ± 0.15 度
+# 多分辨率金字塔中允许的最小/最大分辨率与最大层数 (2000 逐层减半到 8 只需 9 层)
+MIN_PYRAMID_RESOLUTION = 8
+MAX_GRID_RESOLUTION = 2000
+MAX_PYRAMID_LEVELS = 9
+# 进程内共享的网格几何数量上限
+MAX_SHARED_GEOMETRIES = 16
+# 每个图层保留的已下发量化热力图版本数 (用于差分编码)
+HEATMAP_HISTORY = 4
+
+EARTH_RADIUS_KM = 6371
+# 分块计算时单块矩阵的最大元素数，避免高分辨率网格下一次性申请过大的临时内存
+CHUNK_ELEMENTS = 4_000_000
+# 稠密模型中常驻的 (停车点/位置数 x 网格数) 衰减矩阵的元素数上限 (float64 约 160 MB)，
+# 超过时要求改用截断模型 (epsilon / radiusKm)
+MAX_DENSE_DECAY_ELEMENTS = 20_000_000
+
+# 断电核函数: 热力点对半径 0.05 度内的网格贡献 count * exp(-d * 100)
+OUTAGE_KERNEL_RADIUS = 0.05
+OUTAGE_KERNEL_SCALE = 100
+# 精确路径需要计算的 (热力点, 网格) 对数超过该值时改用分箱卷积
+EXACT_PAIR_BUDGET = 20_000_000
+# 分箱路径的最大箱宽 (度)，热力点吸附误差不超过半个箱宽
+BIN_SIZE = 0.0005
+# 增量删除事件后，绝对值小于 OUTAGE_RESIDUE_EPS * max(1, 最大累积值) 的网格视为抵消干净 (浮点残差)
+OUTAGE_RESIDUE_EPS = 1e-9
+
+# 大车队模式: 车辆数达到该值时自动按载荷等级分组放置，分组贪心的默认总步数
+LARGE_FLEET_THRESHOLD = 1000
+DEFAULT_LARGE_FLEET_STEPS = 256
+
+# 局部搜索默认预算与最小改进量
+DEFAULT_LS_ITERATIONS = 10000
+DEFAULT_LS_TIME_LIMIT = 2.0
+LS_MIN_IMPROVEMENT = 1e-9
+
+
+def haversine_km(lng1, lat1, lng2, lat2):
+    """
+    向量化的 Haversine 距离 (km)，参数可以是标量或可广播的 numpy 数组
+    """
+    lat1_rad = np.radians(lat1)
+    lat2_rad = np.radians(lat2)
+    d_lat = lat2_rad - lat1_rad
+    d_lng = np.radians(np.subtract(lng2, lng1))
+
+    a = (np.sin(d_lat / 2) ** 2 +
+         np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(d_lng / 2) ** 2)
+
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS_KM * c
+
+
+def planar_km(x1, y1, x2, y2):
+    """投影平面上的欧氏距离 (km)，参数可以是标量或可广播的 numpy 数组"""
+    return np.hypot(np.subtract(x2, x1), np.subtract(y2, y1))
+
+
+def _points_to_arrays(heat_points):
+    """将 [{'lng','lat','count'}] 形式的热力点转换为三段 numpy 数组"""
+    n = len(heat_points)
+    p_lng = np.fromiter((p['lng'] for p in heat_points), dtype=float, count=n)
+    p_lat = np.fromiter((p['lat'] for p in heat_points), dtype=float, count=n)
+    p_count = np.fromiter((p['count'] for p in heat_points), dtype=float, count=n)
+    return p_lng, p_lat, p_count
+
+
+def _row_chunk(n_cols):
+    """按列数计算每块可处理的行数"""
+    return max(1, CHUNK_ELEMENTS // max(1, n_cols))
+
+
+def dense_candidate_losses(outage, base_support, decay, load):
+    """
+    稠密模型的批量试算 (见 DispatchAlgorithm._candidate_losses)
+    模块级函数，便于进程池中的分片评估复用 (backend/parallel.py)
+    """
+    losses = np.empty(decay.shape[0])
+    chunk = _row_chunk(decay.shape[1])
+    for start in range(0, decay.shape[0], chunk):
+        stop = start + chunk
+        # New = Current + Vehicle_Contribution，每一行对应一个候选点
+        trial = base_support + load * decay[start:stop]
+
+        # 逐行临时归一化 (与 _normalize 一致)
+        min_val = trial.min(axis=1, keepdims=True)
+        max_val = trial.max(axis=1, keepdims=True)
+        val_range = np.where(max_val != min_val, max_val - min_val, 1)
+        trial -= min_val
+        trial /= val_range
+
+        # 网格本身的 outage 已经是归一化过的 (在 map_outage_to_grid 中)
+        np.subtract(outage, trial, out=trial)
+        losses[start:stop] = np.einsum('ij,ij->i', trial, trial)
+    return losses
+
+
+class GridGeometry:
+    """
+    不可变的网格几何 (中心点, 分辨率, 范围 -> 网格经纬度)
+    同一几何在进程内只构建一次，被所有会话/请求共享，数组均为只读
+    """
+
+    def __init__(self, center, resolution, range_val):
+        self.center = (float(center[0]), float(center[1]))
+        self.resolution = resolution
+        self.range_val = range_val
+        self.step = (2 * range_val) / resolution
+        index = np.arange(resolution)
+
+        self.lng_axis = center[0] - range_val + self.step * index
+        self.lat_axis = center[1] - range_val + self.step * index
+        # 网格以 struct-of-arrays 形式存储: 每个字段是一段连续的 float64 数组
+        # 第 k 个网格 (k = i * resolution + j) 对应经度索引 i、纬度索引 j
+        self.lng = np.repeat(self.lng_axis, resolution)
+        self.lat = np.tile(self.lat_axis, resolution)
+
+        # 以城市中心为原点的等距圆柱投影 (km): x 沿经度方向按中心纬度的余弦缩放，y 沿纬度方向
+        # 网格仅覆盖中心点 ± range 度，平面距离与 Haversine 的偏差很小 (见 distance_accuracy)
+        self.km_per_deg_lat = math.radians(1) * EARTH_RADIUS_KM
+        self.km_per_deg_lng = self.km_per_deg_lat * math.cos(math.radians(self.center[1]))
+        self.x_axis, self.y_axis = self.project(self.lng_axis, self.lat_axis)
+        self.x = np.repeat(self.x_axis, resolution)
+        self.y = np.tile(self.y_axis, resolution)
+        for arr in (self.lng_axis, self.lat_axis, self.lng, self.lat,
+                    self.x_axis, self.y_axis, self.x, self.y):
+            arr.setflags(write=False)
+
+        # 网格几何键，决定了衰减向量对应的网格
+        self.key = (point_key(*self.center), resolution, range_val)
+
+    def project(self, lng, lat):
+        """经纬度 -> 投影平面坐标 (km)，参数可以是标量或 numpy 数组"""
+        x = (np.asarray(lng, dtype=float) - self.center[0]) * self.km_per_deg_lng
+        y = (np.asarray(lat, dtype=float) - self.center[1]) * self.km_per_deg_lat
+        return x, y
+
+    def scale_error(self):
+        """网格纬度范围内投影的局部尺度误差上界 max|cos(lat) / cos(lat0) - 1|"""
+        cos0 = math.cos(math.radians(self.center[1]))
+        lats = (self.lat_axis[0], self.lat_axis[-1])
+        return max(abs(math.cos(math.radians(lat)) / cos0 - 1) for lat in lats)
+
+
+_geometry_lock = threading.Lock()
+_geometries = OrderedDict()
+
+
+def get_geometry(center=CITY_CENTER, resolution=GRID_RESOLUTION, range_val=GRID_RANGE):
+    """获取 (进程内共享的) 网格几何，最近使用的 MAX_SHARED_GEOMETRIES 个保留在内存中"""
+    key = (point_key(*center), resolution, range_val)
+    with _geometry_lock:
+        geometry = _geometries.get(key)
+        if geometry is not None:
+            _geometries.move_to_end(key)
+            return geometry
+    geometry = GridGeometry(center, resolution, range_val)
+    with _geometry_lock:
+        geometry = _geometries.setdefault(key, geometry)
+        _geometries.move_to_end(key)
+        while len(_geometries) > MAX_SHARED_GEOMETRIES:
+            _geometries.popitem(last=False)
+    return geometry
+
 
 class DispatchAlgorithm:
-    def __init__(self):
-        self.grid = []
-        self.resolution = GRID_RESOLUTION
+    """
+    一个会话 (或一次请求) 的调度状态：断电/支援网格数值 + 最近一次计算的附加报告
+    网格几何与衰减缓存是进程级共享的只读预计算，本对象只持有可变的逐网格数值，
+    且只通过整体替换 (而非原地修改) 更新 outage / support
+    """
+
+    def __init__(self, resolution=GRID_RESOLUTION, range_val=GRID_RANGE, center=CITY_CENTER):
+        self.resolution = resolution
+        self.range_val = range_val
+        self.geometry = None
+        # 状态版本号: outage / support 每次被替换时递增，用于差分编码与缓存失效
+        self.outage_version = 0
+        self.support_version = 0
+        self._outage = np.zeros(0)
+        self._support = np.zeros(0)
+        # 未归一化的断电累积值 (增量更新只修补它)，_outage_stale 为 True 时 outage 需要重新归一化
+        self._outage_raw = np.zeros(0)
+        self._outage_stale = False
+        # 已下发的量化热力图: (图层, 量化类型) -> {版本: 量化数组}
+        self._heatmap_history = {}
+        # 视口瓦片缓存 (按状态版本失效)
+        self.tile_cache = TileCache()
+        # 最近一次支援计算的截断误差上界 (稠密模型时为 None)
+        self.support_error_bound = None
+        # 最近一次支援计算中投影距离相对 Haversine 的偏差报告
+        self.distance_report = None
+        # 最近一次优化的大车队分组报告 (未启用时为 None)
+        self.fleet_report = None
+        # 最近一次优化的局部搜索报告 (未启用时为 None)
+        self.local_search_report = None
+        # 优化期间的进程池分片评估器 (未启用时为 None)
+        self._sharded = None
+        # 最近一次映射的原始热力点 (lng, lat, count)，用于在其他分辨率上重新映射
+        self.heat_points = None
         # 初始化网格
-        self.init_grid(CITY_CENTER)
+        self.init_grid(center)
+
+    @property
+    def lng(self):
+        return self.geometry.lng
+
+    @property
+    def lat(self):
+        return self.geometry.lat
+
+    @property
+    def step(self):
+        return self.geometry.step
+
+    @property
+    def center(self):
+        return list(self.geometry.center)
+
+    @property
+    def cell_count(self):
+        return self.geometry.lng.size
+
+    @property
+    def outage(self):
+        # 增量更新后延迟到第一次读取时再归一化
+        if self._outage_stale:
+            self._outage = self._normalize(self._outage_raw)
+            self._outage_stale = False
+        return self._outage
+
+    @outage.setter
+    def outage(self, values):
+        self._outage = values
+        self._outage_stale = False
+        self.outage_version += 1
+
+    @property
+    def support(self):
+        return self._support
+
+    @support.setter
+    def support(self, values):
+        self._support = values
+        self.support_version += 1
 
     def init_grid(self, center):
-        self.grid = []
-        range_val = 0.15
-        step = (2 * range_val) / self.resolution
-        
-        for i in range(self.resolution):
-            for j in range(self.resolution):
-                self.grid.append({
-                    'lng': center[0] - range_val + step * i,
-                    'lat': center[1] - range_val + step * j,
-                    'outageProb': 0,
-                    'supportValue': 0
-                })
+        self.geometry = get_geometry(center, self.resolution, self.range_val)
+        self._heatmap_history = {}
+        self._outage_raw = np.zeros(self.cell_count)
+        self.outage = np.zeros(self.cell_count)
+        self.support = np.zeros(self.cell_count)
 
     def calculate_distance(self, p1, p2):
         """
-        计算两点间距离 (Haversine formula)
-        p1, p2: {'lat': float, 'lng': float}
-        """
-        R = 6371
-        d_lat = (p2['lat'] - p1['lat']) * math.pi / 180
-        d_lng = (p2['lng'] - p1['lng']) * math.pi / 180
-        
-        a = (math.sin(d_lat / 2) * math.sin(d_lat / 2) +
-             math.cos(p1['lat'] * math.pi / 180) * 
-             math.cos(p2['lat'] * math.pi / 180) * 
-             math.sin(d_lng / 2) * math.sin(d_lng / 2))
-        
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        return R * c
-
-    def map_outage_to_grid(self, heat_points):
-        """将热力点映射到网格上的断电概率"""
-        for cell in self.grid:
-            prob = 0
-            for p in heat_points:
-                # 计算网格中心到热力点的距离
-                d = math.sqrt((cell['lng'] - p['lng'])**2 + (cell['lat'] - p['lat'])**2)
-                
-                # 距离衰减
-                if d < 0.05:
-                    prob += p['count'] * math.exp(-d * 100)
-            
-            cell['outageProb'] = prob
-            
-        self._normalize('outageProb')
-
-    def calculate_total_support(self, vehicles):
-        """计算所有车辆对网格的支援力度"""
-        for cell in self.grid:
-            support = 0
+        计算两点间距离 (Haversine formula)，用于单点查询与精度校验
+        网格批量计算使用投影平面距离 (见 _decay_matrix)
+        p1, p2: {'lat': float, 'lng': float}，字段也可以是 numpy 数组
+        """
+        return haversine_km(p1['lng'], p1['lat'], p2['lng'], p2['lat'])
+
+    def _decay_matrix(self, points_lng, points_lat):
+        """
+        计算若干点到所有网格的距离衰减系数 exp(-dist)
+        距离在投影平面上批量计算，避免逐对的三角函数运算
+        Returns: shape = (点数, 网格数)
+        """
+        px, py = self.geometry.project(points_lng, points_lat)
+        dist = planar_km(px[:, None], py[:, None], self.geometry.x[None, :], self.geometry.y[None, :])
+        return np.exp(-dist, out=dist)
+
+    @property
+    def grid_key(self):
+        """网格几何键 (中心点, 分辨率, 范围)，决定了衰减向量对应的网格"""
+        return self.geometry.key
+
+    def _cached_decay_rows(self, keys):
+        """
+        获取若干取整坐标 (point_key) 的衰减向量，优先读取进程级缓存，
+        未命中的坐标按 _row_chunk 分块批量计算后写回缓存
+        Returns: shape = (坐标数, 网格数)
+        """
+        grid_key = self.grid_key
+        out = np.empty((len(keys), self.cell_count))
+        missing = {}  # 坐标 -> 在 out 中的行号
+        for i, key in enumerate(keys):
+            if key in missing:
+                continue
+            vec = decay_cache.get((grid_key, key))
+            if vec is None:
+                missing[key] = i
+            else:
+                out[i] = vec
+
+        if missing:
+            with metrics.phase('decay_precompute'):
+                pending = list(missing)
+                chunk = _row_chunk(self.cell_count)
+                for start in range(0, len(pending), chunk):
+                    block = pending[start:start + chunk]
+                    decay = self._decay_matrix([k[0] for k in block], [k[1] for k in block])
+                    for key, vec in zip(block, decay):
+                        out[missing[key]] = vec
+                        # 拷贝出独立的行，避免缓存条目引用整块矩阵
+                        decay_cache.put((grid_key, key), vec.copy())
+
+        # 重复出现的坐标从首次出现的行复制
+        for i, key in enumerate(keys):
+            first = missing.get(key)
+            if first is not None and first != i:
+                out[i] = out[first]
+        return out
+
+    def _check_dense_budget(self, n_rows):
+        """稠密衰减矩阵 (n_rows x 网格数) 超过 MAX_DENSE_DECAY_ELEMENTS 时拒绝计算"""
+        if n_rows * self.cell_count > MAX_DENSE_DECAY_ELEMENTS:
+            raise ValueError(
+                f'dense model too large: {n_rows} positions x {self.cell_count} cells exceeds '
+                f'{MAX_DENSE_DECAY_ELEMENTS} elements, pass epsilon or radiusKm to use the truncated model')
+
+    def _sparse_footprint(self, lng, lat, radius_km):
+        """
+        计算单个点在截断半径内的稀疏足迹，只在包围该半径的网格窗口内计算距离
+        Returns: (网格下标 int32, exp(-dist) float32)
+        """
+        res = self.resolution
+        geometry = self.geometry
+        x_axis, y_axis = geometry.x_axis, geometry.y_axis
+        px, py = geometry.project(lng, lat)
+
+        # 投影平面上网格是等间距的，半径窗口直接按 km 步长换算成下标范围
+        step_x = self.step * geometry.km_per_deg_lng
+        step_y = self.step * geometry.km_per_deg_lat
+        i_lo = max(0, int(math.floor((px - radius_km - x_axis[0]) / step_x)))
+        i_hi = min(res - 1, int(math.ceil((px + radius_km - x_axis[0]) / step_x)))
+        j_lo = max(0, int(math.floor((py - radius_km - y_axis[0]) / step_y)))
+        j_hi = min(res - 1, int(math.ceil((py + radius_km - y_axis[0]) / step_y)))
+        if i_lo > i_hi or j_lo > j_hi:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+
+        ii = np.arange(i_lo, i_hi + 1)
+        jj = np.arange(j_lo, j_hi + 1)
+        dist = planar_km(px, py, x_axis[ii][:, None], y_axis[jj][None, :])
+        keep = dist <= radius_km
+        cells = (ii[:, None] * res + jj[None, :])[keep]
+        return cells.astype(np.int32), np.exp(-dist[keep]).astype(np.float32)
+
+    def _cached_sparse_rows(self, keys, radius_km):
+        """获取若干取整坐标的稀疏足迹 (同样走进程级缓存)，组装为 CSR 矩阵"""
+        grid_key = self.grid_key
+        rows = {}
+        for key in dict.fromkeys(keys):
+            cache_key = (grid_key, key, radius_km)
+            footprint = decay_cache.get(cache_key)
+            if footprint is None:
+                with metrics.phase('decay_precompute'):
+                    footprint = self._sparse_footprint(key[0], key[1], radius_km)
+                decay_cache.put(cache_key, footprint)
+            rows[key] = footprint
+        return sparse_support.SparseDecay([rows[k] for k in keys], self.cell_count)
+
+    def distance_accuracy(self, keys):
+        """
+        投影平面距离相对 Haversine 的偏差报告
+        在给定坐标到网格边界网格的点对上抽样比较 (最远的点对偏差最大)，
+        并给出网格纬度范围内的局部尺度误差上界与对应的衰减系数误差上界
+        """
+        geometry = self.geometry
+        res = self.resolution
+        edge = np.unique(np.concatenate([
+            np.arange(res), (res - 1) * res + np.arange(res),
+            np.arange(res) * res, np.arange(res) * res + res - 1]))
+        e_lng, e_lat = geometry.lng[edge], geometry.lat[edge]
+        e_x, e_y = geometry.x[edge], geometry.y[edge]
+
+        keys = list(dict.fromkeys(keys))
+        max_abs = 0.0
+        max_rel = 0.0
+        chunk = _row_chunk(edge.size)
+        for start in range(0, len(keys), chunk):
+            block = keys[start:start + chunk]
+            p_lng = np.array([k[0] for k in block])
+            p_lat = np.array([k[1] for k in block])
+            px, py = geometry.project(p_lng, p_lat)
+            exact = haversine_km(p_lng[:, None], p_lat[:, None], e_lng[None, :], e_lat[None, :])
+            err = np.abs(planar_km(px[:, None], py[:, None], e_x[None, :], e_y[None, :]) - exact)
+            max_abs = max(max_abs, float(err.max()))
+            max_rel = max(max_rel, float((err / np.maximum(exact, 1e-9)).max()))
+
+        scale_error = geometry.scale_error()
+        rel = max(max_rel, scale_error)
+        return {
+            'model': 'equirectangular',
+            'referenceLat': geometry.center[1],
+            'sampledPairs': len(keys) * int(edge.size),
+            'maxAbsErrorKm': max_abs,
+            'maxRelativeError': max_rel,
+            'scaleErrorBound': scale_error,
+            # |exp(-a) - exp(-b)| <= |a - b| * exp(-min(a, b))，对 d * rel * exp(-d (1 - rel)) 取最大值
+            'decayErrorBound': rel / (math.e * (1 - rel)) if rel < 1 else 1.0
+        }
+
+    def map_outage_to_grid(self, heat_points, method='auto'):
+        """
+        将热力点映射到网格上的断电概率
+        method: 'exact'  - 空间索引: 只计算核半径内的 (热力点, 网格) 对
+                'binned' - 分箱 + FFT 卷积: 适合数十万级别的热力点
+                'auto'   - 按需要计算的点对数自动选择
+        """
+        self.heat_points = _points_to_arrays(heat_points)
+        self._map_outage_arrays(*self.heat_points, method=method)
+
+    @metrics.timed('grid_mapping')
+    def _map_outage_arrays(self, p_lng, p_lat, p_count, method='auto'):
+        """map_outage_to_grid 的数组版本"""
+        if method == 'auto':
+            pairs = p_lng.size * len(self._kernel_offsets())
+            method = 'binned' if pairs > EXACT_PAIR_BUDGET else 'exact'
+
+        if method == 'binned':
+            prob = self._outage_binned(p_lng, p_lat, p_count)
+        else:
+            prob = self._outage_exact(p_lng, p_lat, p_count)
+
+        self._outage_raw = prob
+        self.outage = self._normalize(prob)
+
+    @metrics.timed('outage_patch')
+    def update_outage_events(self, added=(), removed=()):
+        """
+        增量更新断电事件 (实时事件流)，不重新映射全部热力点:
+        只修补每个事件核半径 (OUTAGE_KERNEL_RADIUS) 内网格的未归一化累积值，
+        归一化推迟到下一次读取 outage 时进行
+        removed 中的事件按 (取整坐标, count) 与已映射的热力点匹配，未匹配的事件被忽略
+        Returns: {'added', 'removed', 'unmatched', 'patchedCells', 'version'}
+        """
+        if self.heat_points is None:
+            self.heat_points = (np.zeros(0), np.zeros(0), np.zeros(0))
+        p_lng, p_lat, p_count = self.heat_points
+        add = _points_to_arrays(added)
+
+        # 1. 匹配要删除的事件 (同一事件出现多次时逐个抵消)
+        drop = []
+        if removed:
+            index = {}
+            for k, (lng, lat, count) in enumerate(zip(p_lng.tolist(), p_lat.tolist(), p_count.tolist())):
+                index.setdefault((point_key(lng, lat), count), []).append(k)
+            for p in removed:
+                hits = index.get((point_key(p['lng'], p['lat']), float(p['count'])))
+                if hits:
+                    drop.append(hits.pop())
+        drop = np.array(drop, dtype=np.int64)
+        report = {
+            'added': int(add[0].size),
+            'removed': int(drop.size),
+            'unmatched': len(removed) - int(drop.size),
+            'patchedCells': 0,
+            'version': self.outage_version
+        }
+        if add[0].size == 0 and drop.size == 0:
+            return report
+
+        # 2. 只修补核半径内的网格: 新增事件加上贡献，删除事件减去 (按原始坐标) 的贡献
+        patches = []
+        for sign, (lng, lat, count) in ((1.0, add), (-1.0, (p_lng[drop], p_lat[drop], p_count[drop]))):
+            for cells, weight in self._outage_pairs(lng, lat, count):
+                patches.append((cells, sign * weight))
+        if patches:
+            cells = np.concatenate([c for c, _ in patches])
+            weight = np.concatenate([w for _, w in patches])
+            touched, inverse = np.unique(cells, return_inverse=True)
+            self._outage_raw[touched] += np.bincount(inverse, weights=weight)
+            report['patchedCells'] = int(touched.size)
+
+        # 3. 维护原始热力点，保证在其他分辨率上重新映射时与增量结果一致
+        keep = np.ones(p_lng.size, dtype=bool)
+        keep[drop] = False
+        self.heat_points = tuple(np.concatenate([arr[keep], extra]) for arr, extra in zip(self.heat_points, add))
+
+        # 4. 抵消后的舍入残差 (可能为极小的正/负值) 清零，否则 min-max 归一化会把它们放大成满强度的热点
+        if self.heat_points[0].size == 0:
+            self._outage_raw = np.zeros(self.cell_count)
+        elif patches:
+            raw = self._outage_raw[touched]
+            residue = np.abs(raw) < OUTAGE_RESIDUE_EPS * max(1.0, float(self._outage_raw.max()))
+            self._outage_raw[touched] = np.where(residue, 0.0, np.maximum(raw, 0.0))
+
+        self._outage_stale = True
+        self.outage_version += 1
+        report['version'] = self.outage_version
+        return report
+
+    def _kernel_offsets(self):
+        """
+        热力点所在网格 (最近网格) 周围可能落入核半径的网格偏移量
+        热力点与最近网格中心在每个轴上相差不超过半个步长，据此排除必然超出半径的偏移
+        """
+        k = int(math.ceil(OUTAGE_KERNEL_RADIUS / self.step)) + 1
+        di, dj = np.meshgrid(np.arange(-k, k + 1), np.arange(-k, k + 1), indexing='ij')
+        gap_i = np.maximum(np.abs(di) - 0.5, 0) * self.step
+        gap_j = np.maximum(np.abs(dj) - 0.5, 0) * self.step
+        keep = gap_i ** 2 + gap_j ** 2 < OUTAGE_KERNEL_RADIUS ** 2
+        return np.stack([di[keep], dj[keep]], axis=1)
+
+    def _outage_pairs(self, p_lng, p_lat, p_count):
+        """
+        空间索引：规则网格本身就是均匀分桶，
+        先把每个热力点放入最近的网格桶，再只与桶周围核半径内的网格配对
+        分块产出 (网格下标, 贡献值)
+        """
+        res = self.resolution
+        lng_axis = self.geometry.lng_axis
+        lat_axis = self.geometry.lat_axis
+        origin_lng, origin_lat = lng_axis[0], lat_axis[0]
+
+        offsets = self._kernel_offsets()
+        chunk = _row_chunk(len(offsets))
+        for start in range(0, p_lng.size, chunk):
+            stop = start + chunk
+            lng, lat, count = p_lng[start:stop, None], p_lat[start:stop, None], p_count[start:stop, None]
+            ni = np.rint((lng - origin_lng) / self.step).astype(np.int64)
+            nj = np.rint((lat - origin_lat) / self.step).astype(np.int64)
+
+            ci = ni + offsets[None, :, 0]
+            cj = nj + offsets[None, :, 1]
+            valid = (ci >= 0) & (ci < res) & (cj >= 0) & (cj < res)
+            ci, cj = ci[valid], cj[valid]
+
+            # 计算网格中心到热力点的距离
+            d = np.sqrt((lng_axis[ci] - np.broadcast_to(lng, valid.shape)[valid]) ** 2 +
+                        (lat_axis[cj] - np.broadcast_to(lat, valid.shape)[valid]) ** 2)
+            # 距离衰减
+            near = d < OUTAGE_KERNEL_RADIUS
+            weight = np.broadcast_to(count, valid.shape)[valid][near] * np.exp(-d[near] * OUTAGE_KERNEL_SCALE)
+            yield ci[near] * res + cj[near], weight
+
+    def _outage_exact(self, p_lng, p_lat, p_count):
+        """精确路径：累加所有 (热力点, 核半径内网格) 对的贡献"""
+        prob = np.zeros(self.cell_count)
+        for cells, weight in self._outage_pairs(p_lng, p_lat, p_count):
+            prob += np.bincount(cells, weights=weight, minlength=self.cell_count)
+        return prob
+
+    def _outage_binned(self, p_lng, p_lat, p_count):
+        """
+        分箱路径：把热力点累加到比网格更细的格点上，再与截断核做一次 FFT 卷积，
+        最后在网格中心处采样。误差来自热力点被吸附到最近格点 (不超过半个箱宽)
+        """
+        res = self.resolution
+        if p_lng.size == 0:
+            return np.zeros(self.cell_count)
+
+        # 细分倍数: 保证箱宽不超过 BIN_SIZE，且网格中心恰好落在格点上
+        factor = max(1, int(math.ceil(self.step / BIN_SIZE)))
+        bin_size = self.step / factor
+        pad = int(math.ceil(OUTAGE_KERNEL_RADIUS / bin_size))
+        size = (res - 1) * factor + 1 + 2 * pad
+
+        origin_lng = self.lng[0] - pad * bin_size
+        origin_lat = self.lat[0] - pad * bin_size
+        u = np.rint((p_lng - origin_lng) / bin_size).astype(np.int64)
+        v = np.rint((p_lat - origin_lat) / bin_size).astype(np.int64)
+        inside = (u >= 0) & (u < size) & (v >= 0) & (v < size)
+        hist = np.bincount(u[inside] * size + v[inside], weights=p_count[inside],
+                           minlength=size * size).reshape(size, size)
+
+        offset = np.arange(-pad, pad + 1) * bin_size
+        dist = np.sqrt(offset[:, None] ** 2 + offset[None, :] ** 2)
+        kernel = np.where(dist < OUTAGE_KERNEL_RADIUS, np.exp(-dist * OUTAGE_KERNEL_SCALE), 0.0)
+
+        # 线性卷积需要补零到 size + 2 * pad，避免循环卷积的回绕
+        n = size + 2 * pad
+        conv = np.fft.irfft2(np.fft.rfft2(hist, (n, n)) * np.fft.rfft2(kernel, (n, n)), (n, n))
+        # conv[a, b] 对应格点 (a - pad, b - pad)，网格 (i, j) 位于格点 (pad + i * factor, ...)
+        sample = 2 * pad + np.arange(res) * factor
+        prob = conv[np.ix_(sample, sample)].ravel()
+        # 去掉 FFT 的舍入噪声
+        return np.maximum(prob, 0.0)
+
+    @metrics.timed('support_calculation')
+    def calculate_total_support(self, vehicles, epsilon=None, radius_km=None):
+        """
+        计算所有车辆对网格的支援力度
+        epsilon / radius_km: 可选截断参数，给出时只累加 exp(-dist) >= epsilon 的稀疏足迹，
+        并在 self.support_error_bound 中记录误差上界
+        """
+        truncation = sparse_support.truncation_radius(epsilon, radius_km)
+
+        # 停在同一位置的车辆衰减向量相同，按位置合并载荷
+        loads_by_point = {}
+        for v in vehicles:
+            if v.get('lng') is None or v.get('lat') is None:
+                continue
+            key = point_key(v['lng'], v['lat'])
+            loads_by_point[key] = loads_by_point.get(key, 0) + v['load']
+
+        support = np.zeros(self.cell_count)
+        keys = list(loads_by_point)
+        loads = np.array([loads_by_point[k] for k in keys], dtype=float)
+
+        # 载荷越大，支援半径和强度越大
+        # 负指数衰减: load * exp(-dist * k)
+        # 系数 k=1，衰减非常慢，使热力图呈现连片效果
+        if truncation:
+            footprints = self._cached_sparse_rows(keys, truncation[1])
+            for k, load in enumerate(loads):
+                idx, val = footprints.row(k)
+                support[idx] += load * val
+        else:
+            chunk = _row_chunk(self.cell_count)
+            for start in range(0, len(keys), chunk):
+                stop = start + chunk
+                support += loads[start:stop] @ self._cached_decay_rows(keys[start:stop])
+
+        self.support_error_bound = (
+            sparse_support.error_bound(loads.sum(), truncation[0], support) if truncation else None
+        )
+        self.distance_report = self.distance_accuracy(keys) if keys else None
+        self.support = self._normalize(support)
+
+    @metrics.timed('batch_evaluation')
+    def evaluate_configurations(self, configurations, include_heatmaps=False, epsilon=None, radius_km=None):
+        """
+        批量 what-if 评估：在当前断电网格上同时评估多个车辆配置，不修改 self.support
+        configurations: [[vehicle, ...], ...]，车辆格式同 calculate_total_support
+        所有配置共享同一组 (去重后的) 位置衰减向量，支援值由 (配置 x 位置) 载荷矩阵一次乘出
+        Returns: [{'loss': float, 'supportHeatmap'?: [...], 'supportErrorBound'?: {...}}, ...]
+        """
+        truncation = sparse_support.truncation_radius(epsilon, radius_km)
+
+        # 1. 收集所有配置中出现的位置，构建 (配置数, 位置数) 的载荷矩阵
+        position_index = {}
+        entries = []  # (配置下标, 位置下标, 载荷)
+        for c, vehicles in enumerate(configurations):
             for v in vehicles:
                 if v.get('lng') is None or v.get('lat') is None:
                     continue
-                
-                dist = self.calculate_distance(
-                    {'lng': v['lng'], 'lat': v['lat']},
-                    {'lng': cell['lng'], 'lat': cell['lat']}
-                )
-                
-                # 载荷越大，支援半径和强度越大
-                # 修改为负指数衰减: load * exp(-dist * k)
-                # 系数 k=1，衰减非常慢，使热力图呈现连片效果
-                support += v['load'] * math.exp(-dist)
-            
-            cell['supportValue'] = support
-        
-        self._normalize('supportValue')
-
-    def _normalize(self, field):
-        """归一化网格字段"""
-        values = [c[field] for c in self.grid]
-        max_val = max(values) if values else 1
-        min_val = min(values) if values else 0
-        
+                key = point_key(v['lng'], v['lat'])
+                col = position_index.setdefault(key, len(position_index))
+                entries.append((c, col, v['load']))
+
+        n_configs = len(configurations)
+        weights = np.zeros((n_configs, len(position_index)))
+        if entries:
+            rows, cols, loads = (np.array(x) for x in zip(*entries))
+            np.add.at(weights, (rows, cols), loads.astype(float))
+
+        keys = list(position_index)
+        if truncation:
+            decay = self._cached_sparse_rows(keys, truncation[1])
+        else:
+            self._check_dense_budget(len(keys))
+            decay = self._cached_decay_rows(keys)
+
+        # 2. 分块计算支援值矩阵、逐行归一化并求损失
+        results = []
+        chunk = _row_chunk(self.cell_count)
+        for start in range(0, n_configs, chunk):
+            block = weights[start:start + chunk]
+            if truncation:
+                support = np.zeros((block.shape[0], self.cell_count))
+                for col in range(decay.n_rows):
+                    idx, val = decay.row(col)
+                    active = np.nonzero(block[:, col])[0]
+                    if active.size and idx.size:
+                        support[np.ix_(active, idx)] += block[active, col][:, None] * val
+            else:
+                support = block @ decay
+
+            min_val = support.min(axis=1, keepdims=True)
+            max_val = support.max(axis=1, keepdims=True)
+            val_range = np.where(max_val != min_val, max_val - min_val, 1)
+            normalized = (support - min_val) / val_range
+            diff = self.outage - normalized
+            losses = np.einsum('ij,ij->i', diff, diff)
+
+            for k in range(block.shape[0]):
+                item = {'loss': float(losses[k])}
+                if include_heatmaps:
+                    item['supportHeatmap'] = self._heat_points(normalized[k])
+                if truncation:
+                    item['supportErrorBound'] = sparse_support.error_bound(
+                        block[k].sum(), truncation[0], support[k])
+                results.append(item)
+        return results
+
+    @staticmethod
+    def _normalize(values):
+        """归一化网格字段 (min-max)，返回新数组"""
+        if values.size == 0:
+            return values
+        max_val = values.max()
+        min_val = values.min()
+
         # 避免除以零
         val_range = max_val - min_val if max_val != min_val else 1
-        
-        for c in self.grid:
-            c[field] = (c[field] - min_val) / val_range
+
+        return (values - min_val) / val_range
 
     def calculate_loss(self):
         """计算损失函数"""
-        loss = 0
-        for cell in self.grid:
-            diff = cell['outageProb'] - cell['supportValue']
-            loss += diff**2
-        return loss
+        diff = self.outage - self.support
+        return float(np.dot(diff, diff))
+
+    @metrics.timed('heat_point_export')
+    def _heat_points(self, values):
+        # 过滤掉太小的值，减少传输量
+        mask = values > 0.001
+        return [
+            {'lng': lng, 'lat': lat, 'count': count}
+            for lng, lat, count in zip(self.lng[mask].tolist(),
+                                       self.lat[mask].tolist(),
+                                       (values[mask] * 100).tolist())
+        ]
+
+    def _layer(self, layer):
+        """图层名 -> (网格数值, 状态版本)"""
+        if layer == 'outage':
+            return self.outage, self.outage_version
+        if layer == 'support':
+            return self.support, self.support_version
+        raise ValueError(f'Unknown heatmap layer: {layer}')
+
+    @metrics.timed('heatmap_encode')
+    def encode_heatmap(self, layer, dtype='uint8', base_version=None):
+        """
+        紧凑热力图: 网格元数据 + 量化数组，可选相对 base_version 的差分
+        Returns: (元数据字典, 量化数组, 差分基准数组或 None)
+        """
+        values, version = self._layer(layer)
+        quantized = heatmap_codec.quantize(values, dtype)
+        history = self._heatmap_history.setdefault((layer, dtype), OrderedDict())
+        history[version] = quantized
+        history.move_to_end(version)
+        while len(history) > HEATMAP_HISTORY:
+            history.popitem(last=False)
+
+        # 客户端持有的版本已不在历史中 (或几何已变化) 时退回完整数组
+        base = history.get(base_version) if base_version is not None else None
+        if base is not None and base.shape != quantized.shape:
+            base = None
+        meta = heatmap_codec.metadata(self.geometry, layer, version, dtype,
+                                      base_version if base is not None else None)
+        return meta, quantized, base
+
+    @metrics.timed('tile_query')
+    def get_heatmap_tiles(self, layer, bbox, zoom):
+        """
+        视口瓦片热力图: 只返回 bbox 覆盖的瓦片，低缩放级别返回池化后的网格
+        bbox: (min_lng, min_lat, max_lng, max_lat)
+        """
+        values, version = self._layer(layer)
+        return self.tile_cache.query(layer, version, values, self.geometry, bbox, zoom)
 
     def get_support_heat_points(self):
         """获取前端渲染用的支援热力点"""
-        points = []
-        for cell in self.grid:
-            # 过滤掉太小的值，减少传输量
-            if cell['supportValue'] > 0.001:
-                points.append({
-                    'lng': cell['lng'],
-                    'lat': cell['lat'],
-                    'count': cell['supportValue'] * 100
-                })
-        return points
+        return self._heat_points(self.support)
 
     def get_outage_heat_points(self):
         """获取前端渲染用的断电概率热力点 (基于网格)"""
-        points = []
-        for cell in self.grid:
-            if cell['outageProb'] > 0.001:
-                points.append({
-                    'lng': cell['lng'],
-                    'lat': cell['lat'],
-                    'count': cell['outageProb'] * 100
-                })
-        return points
-
-    def find_best_spots(self, vehicles, parking_spots):
+        return self._heat_points(self.outage)
+
+    def _candidate_losses(self, base_support, decay, load):
+        """
+        批量评估候选位置：假设把载荷为 load 的车辆停在每个候选点，
+        返回每个候选点对应的总损失 (候选点数,)
+        base_support: 当前累积支援值 (未归一化)
+        decay: 候选点到网格的衰减系数矩阵 (候选点数, 网格数)
+        """
+        return dense_candidate_losses(self.outage, base_support, decay, load)
+
+    def _spot_decay(self, parking_spots, truncation):
+        """
+        预计算：所有停车点到所有网格的距离衰减系数
+        稠密模型: shape = (停车点数, 网格数) 的矩阵; 截断模型: SparseDecay (CSR)
+        衰减向量在进程级缓存中按 (网格几何, 停车点坐标) 复用，重复优化时直接命中
+        这里使用直线距离以保证计算速度
+        如果必须用 API 驾车距离，那 网格数 * 停车点数 会导致 API 请求爆炸
+        建议：网格计算维持直线距离，仅在最终确认停车点可行性时考虑 API
+        """
+        spot_keys = [point_key(s['lng'], s['lat']) for s in parking_spots]
+        if truncation:
+            decay = self._cached_sparse_rows(spot_keys, truncation[1])
+            # 同一次优化中 outage 不变，足迹与 outage 的点积只算一次
+            decay.outage_dot = decay.row_dot(self.outage)
+            return decay
+        self._check_dense_budget(len(spot_keys))
+        return self._cached_decay_rows(spot_keys)
+
+    @contextmanager
+    def _sharded_evaluation(self, decay, workers):
+        """
+        在该上下文内，对 decay 的批量试算分片到 workers 个进程 (见 backend/parallel.py)
+        只支持稠密衰减矩阵；workers 不大于 1 或候选点太少时保持单进程
+        """
+        workers = min(int(workers or 1), parallel.max_workers())
+        if (workers <= 1 or isinstance(decay, sparse_support.SparseDecay)
+                or decay.shape[0] < 2 * parallel.MIN_ROWS_PER_WORKER):
+            yield
+            return
+        with parallel.ShardedEvaluator(decay, self.outage, workers, dense_candidate_losses) as evaluator:
+            self._sharded = evaluator
+            try:
+                yield
+            finally:
+                self._sharded = None
+
+    def _evaluate(self, base_support, decay, load):
+        """批量试算: 在 base_support 上叠加 load * decay 的每一行后的总损失"""
+        if self._sharded is not None and self._sharded.decay is decay:
+            return self._sharded.candidate_losses(base_support, load)
+        if isinstance(decay, sparse_support.SparseDecay):
+            return sparse_support.candidate_losses(
+                self.outage, base_support, decay, load, decay.outage_dot)
+        return self._candidate_losses(base_support, decay, load)
+
+    @staticmethod
+    def _add_row(support, decay, k, load):
+        """原地叠加第 k 个停车点的贡献 load * decay[k]"""
+        if isinstance(decay, sparse_support.SparseDecay):
+            idx, val = decay.row(k)
+            support[idx] += load * val
+        else:
+            support += load * decay[k]
+
+    def _swap_losses(self, support, decay, spot, others, coefs):
+        """
+        交换试算: 第 k 个候选在 support 上叠加 coefs[k] * (decay[others[k]] - decay[spot]) 后的总损失
+        稀疏模型只触及两个足迹的并集 (见 sparse_support.swap_losses)；稠密模型按 _row_chunk 分块
+        """
+        if isinstance(decay, sparse_support.SparseDecay):
+            return sparse_support.swap_losses(
+                self.outage, support, decay, spot, others, coefs, decay.outage_dot)
+        others = np.asarray(others, dtype=np.int64)
+        coefs = np.asarray(coefs, dtype=float)
+        losses = np.empty(others.size)
+        chunk = _row_chunk(self.cell_count)
+        for start in range(0, others.size, chunk):
+            stop = start + chunk
+            delta = decay[others[start:stop]] - decay[spot]
+            delta *= coefs[start:stop, None]
+            losses[start:stop] = self._candidate_losses(support, delta, 1.0)
+        return losses
+
+    def _greedy_assign(self, loads, decay):
+        """
+        贪心核心：按给定顺序逐个为载荷选择使当前总损失最小的停车点
+        loads: 已排序的载荷序列
+        Returns: (每个载荷选中的停车点下标, 第一个载荷在各停车点上的试算损失, 累积支援值)
+        """
+        # 维护一个 accumulation grid，每确定一辆车就叠加它的贡献
+        current_support_grid = np.zeros(self.cell_count)
+
+        chosen = []
+        first_losses = None
+        for load in loads:
+            # 一次批量计算该车停在每一个停车点时的总损失 (停车点 x 网格)
+            trial_losses = self._evaluate(current_support_grid, decay, load)
+            if first_losses is None:
+                first_losses = trial_losses
+            # argmin 取第一个最小值，与逐个比较 "trial_loss < min_loss" 的选择一致
+            best_idx = int(np.argmin(trial_losses))
+            chosen.append(best_idx)
+
+            # 更新累积网格状态
+            self._add_row(current_support_grid, decay, best_idx, load)
+
+        return chosen, first_losses, current_support_grid
+
+    def _dense_loss_stats(self, decay):
+        """稠密衰减矩阵的逐行统计量 (行和, 行平方和, 与 outage 的点积)，供 _stats_candidate_losses 复用"""
+        return decay.sum(axis=1), np.einsum('ij,ij->i', decay, decay), decay @ self.outage
+
+    def _stats_candidate_losses(self, base_support, decay, load, stats):
+        """
+        与 _candidate_losses 结果相同的稠密批量试算，但损失由充分统计量得到
+        (见 sparse_support._loss_from_stats)，每个候选点只需要一次求 min/max 的遍历
+        """
+        row_sum, row_sq_sum, outage_dot = stats
+        base_dot = decay @ base_support
+        mn = np.empty(decay.shape[0])
+        mx = np.empty(decay.shape[0])
+        chunk = _row_chunk(decay.shape[1])
+        for start in range(0, decay.shape[0], chunk):
+            stop = start + chunk
+            trial = load * decay[start:stop]
+            trial += base_support
+            mn[start:stop] = trial.min(axis=1)
+            mx[start:stop] = trial.max(axis=1)
+
+        o = self.outage
+        s1 = base_support.sum() + load * row_sum
+        s2 = float(np.dot(base_support, base_support)) + 2 * load * base_dot + load ** 2 * row_sq_sum
+        so = float(np.dot(o, base_support)) + load * outage_dot
+        return sparse_support._loss_from_stats(
+            float(np.dot(o, o)), o.sum(), o.size, s1, s2, so, mn, mx)
+
+    def _grouped_greedy_assign(self, loads, decay, steps=DEFAULT_LARGE_FLEET_STEPS):
+        """
+        大车队模式的贪心：按载荷等级分组，以数量而不是单辆车为单位放置
+        总步数约为 steps，按各等级车辆数成比例分配；每一步把同一等级中的一批 (数量相同的)
+        车辆整体停到使总损失最小的停车点。试算次数与车队规模无关
+        loads: 已排序的载荷序列 (同一等级的载荷连续)
+        Returns: 与 _greedy_assign 相同 (按车辆展开的停车点下标)
+        """
+        if steps < 1:
+            raise ValueError('large fleet steps must be >= 1')
+        # 进程池分片评估时直接使用分片结果，不需要单进程的统计量
+        dense = not isinstance(decay, sparse_support.SparseDecay) and self._sharded is None
+        stats = self._dense_loss_stats(decay) if dense else None
+        current_support_grid = np.zeros(self.cell_count)
+
+        chosen = []
+        first_losses = None
+        n_steps = 0
+        for load, group in itertools.groupby(loads):
+            count = sum(1 for _ in group)
+            # 该等级分成 batches 批，前 extra 批各多一辆
+            batches = min(count, max(1, int(round(steps * count / len(loads)))))
+            size, extra = divmod(count, batches)
+            for b in range(batches):
+                n = size + (1 if b < extra else 0)
+                if dense:
+                    trial_losses = self._stats_candidate_losses(current_support_grid, decay, n * load, stats)
+                else:
+                    trial_losses = self._evaluate(current_support_grid, decay, n * load)
+                if first_losses is None:
+                    first_losses = trial_losses
+                best_idx = int(np.argmin(trial_losses))
+                chosen.extend([best_idx] * n)
+                self._add_row(current_support_grid, decay, best_idx, n * load)
+                n_steps += 1
+
+        self.fleet_report = {
+            'vehicles': len(loads),
+            'loadClasses': len(set(loads)),
+            'greedySteps': n_steps,
+            'spotsUsed': len(set(chosen))
+        }
+        return chosen, first_losses, current_support_grid
+
+    @metrics.timed('greedy_search')
+    def _assign(self, loads, decay, large_fleet=None):
+        """
+        按车队规模选择逐辆贪心或分组贪心
+        large_fleet: None 自动 (车辆数达到 LARGE_FLEET_THRESHOLD 时分组)，False 逐辆，
+        或分组参数 {'steps': int} (True 等价于 {})
+        """
+        if large_fleet is None:
+            large_fleet = len(loads) >= LARGE_FLEET_THRESHOLD
+        if large_fleet is True:
+            large_fleet = {}
+        if large_fleet is False:
+            return self._greedy_assign(loads, decay)
+        return self._grouped_greedy_assign(loads, decay, **large_fleet)
+
+    @metrics.timed('local_search')
+    def _local_search(self, loads, chosen, decay, support, max_iterations=DEFAULT_LS_ITERATIONS,
+                      time_limit=DEFAULT_LS_TIME_LIMIT):
+        """
+        贪心之后的局部搜索改进阶段 (原地修改 chosen)
+        - relocate: 把一辆车挪到另一个停车点
+        - swap: 交换两辆载荷不同、停车点不同的车辆的位置
+        每一轮依次扫描每辆车，批量试算它的全部 relocate / swap 邻域，采用其中最好的改进移动
+        试算只在累积支援值上叠加增量 (稀疏模型下只触及足迹内网格)，不重新计算整体
+        达到迭代次数/时间预算，或一整轮没有改进时停止
+        Returns: 搜索过程报告 (含损失轨迹)
+        """
+        start_time = time.time()
+        loads = np.asarray(loads, dtype=float)
+        n_spots = decay.shape[0] if isinstance(decay, np.ndarray) else decay.n_rows
+        current_loss = float(self._evaluate(support, decay, 0.0)[0]) if n_spots else 0.0
+
+        # (停车点, 载荷) -> 该类中的车辆 (有序)，同一类车辆的交换效果相同，只试算一个代表
+        classes = {}
+        for u, (u_spot, u_load) in enumerate(zip(chosen, loads)):
+            classes.setdefault((u_spot, u_load), {})[u] = None
+
+        def move_class(u, new_spot):
+            key = (chosen[u], loads[u])
+            del classes[key][u]
+            if not classes[key]:
+                del classes[key]
+            classes.setdefault((new_spot, loads[u]), {})[u] = None
+            chosen[u] = new_spot
+
+        trajectory = [current_loss]
+        iterations = 0
+        evaluated = 0
+        applied = 0
+        stop_reason = None
+
+        while stop_reason is None:
+            improved = False
+            for v in range(len(loads)):
+                if iterations >= max_iterations:
+                    stop_reason = 'iterations'
+                    break
+                if time.time() - start_time > time_limit:
+                    stop_reason = 'time'
+                    break
+                iterations += 1
+                load, spot = loads[v], chosen[v]
+
+                # relocate: 先移除该车的贡献，再批量试算放到每一个停车点
+                base = support.copy()
+                self._add_row(base, decay, spot, -load)
+                relocate_losses = self._evaluate(base, decay, load)
+                evaluated += n_spots
+                best_spot = int(np.argmin(relocate_losses))
+                best_loss = float(relocate_losses[best_spot])
+                best_move = ('relocate', best_spot) if best_spot != spot else None
+
+                # swap: 与每一类 (停车点, 载荷) 不同的车辆交换位置，增量为 (L1 - L2) * (D[b] - D[a])
+                combos = [(key, next(iter(members))) for key, members in classes.items()
+                          if key[0] != spot and key[1] != load]
+                if combos:
+                    swap_losses = self._swap_losses(
+                        support, decay, spot, [key[0] for key, _ in combos],
+                        [load - key[1] for key, _ in combos])
+                    evaluated += len(combos)
+                    k = int(np.argmin(swap_losses))
+                    if swap_losses[k] < best_loss:
+                        best_loss = float(swap_losses[k])
+                        best_move = ('swap', combos[k][1])
+
+                if best_move is None or best_loss >= current_loss - LS_MIN_IMPROVEMENT:
+                    continue
+
+                # 应用移动并更新累积支援值
+                kind, target = best_move
+                if kind == 'relocate':
+                    self._add_row(support, decay, spot, -load)
+                    self._add_row(support, decay, target, load)
+                    move_class(v, target)
+                else:
+                    other_spot = chosen[target]
+                    for k_row, l_add in ((spot, loads[target] - load), (other_spot, load - loads[target])):
+                        self._add_row(support, decay, k_row, l_add)
+                    move_class(v, other_spot)
+                    move_class(target, spot)
+                current_loss = best_loss
+                trajectory.append(current_loss)
+                applied += 1
+                improved = True
+
+            if stop_reason is None and not improved:
+                stop_reason = 'converged'
+
+        elapsed = time.time() - start_time
+        return {
+            'iterations': iterations,
+            'movesEvaluated': evaluated,
+            'movesApplied': applied,
+            'movesPerSecond': evaluated / elapsed if elapsed > 0 else None,
+            'elapsed': elapsed,
+            'stopReason': stop_reason,
+            'lossTrajectory': trajectory
+        }
+
+    def find_best_spots(self, vehicles, parking_spots, epsilon=None, radius_km=None, local_search=None,
+                        with_heatmap=True, large_fleet=None, workers=None):
         """
         寻找最优停车点 - 迭代贪心策略
         每一辆车选择能使当前总损失函数最小的停车点
+        epsilon / radius_km: 可选截断参数，给出时停车点足迹以稀疏 (CSR) 形式存储，
+        候选评估只触及足迹内的网格，适用于高分辨率网格
+        local_search: 可选的局部搜索参数 {'max_iterations': int, 'time_limit': 秒}，
+        给出时在贪心之后运行 relocate/swap 改进阶段，报告记录在 self.local_search_report
+        with_heatmap: 为 False 时不导出支援热力点 (调用方改用紧凑格式时)
+        large_fleet: 是否按载荷等级分组放置 (见 _assign / _grouped_greedy_assign)，
+        None 表示车辆数达到 LARGE_FLEET_THRESHOLD 时自动启用，报告记录在 self.fleet_report
+        workers: 可选的进程数，大于 1 时候选停车点的批量试算分片到共享内存进程池 (仅稠密模型)
         """
+        truncation = sparse_support.truncation_radius(epsilon, radius_km)
+        self.local_search_report = None
+        self.fleet_report = None
         if not parking_spots:
             return vehicles, 0, []
 
         # 1. 按载荷从大到小排序，优先安排大车
         sorted_vehicles = sorted(vehicles, key=lambda v: v['load'], reverse=True)
-        
+        loads = [v['load'] for v in sorted_vehicles]
+
+        # 2. 逐个分配车辆
+        decay = self._spot_decay(parking_spots, truncation)
+        with self._sharded_evaluation(decay, workers):
+            chosen, _, support = self._assign(loads, decay, large_fleet)
+
+            # 3. 可选的局部搜索改进
+            if local_search is not None:
+                self.local_search_report = self._local_search(loads, chosen, decay, support, **local_search)
+
         # 用于存储已分配好位置的车辆
         placed_vehicles = []
-        
-        # 当前最佳状态的网格缓存 (初始状态为0)
-        # 为了优化性能，我们不每次都重新计算所有已分配车辆的支援值
-        # 而是维护一个 accumulation grid，每确定一辆车就叠加它的贡献
-        current_support_grid = [0] * len(self.grid)
-
-        # 预计算：所有停车点到所有网格的距离衰减系数
-        # 格式: { spot_index: [ factor_for_cell_0, factor_for_cell_1, ... ] }
-        # 这样在循环中就不必重复计算距离了
-        spot_decay_factors = {}
-        for idx, spot in enumerate(parking_spots):
-            factors = []
-            for cell in self.grid:
-                # 这里暂时使用直线距离以保证计算速度
-                # 如果必须用 API 驾车距离，那2500个网格点 * 停车点数会导致 API 请求爆炸
-                # 建议：网格计算维持直线距离，仅在最终确认停车点可行性时考虑 API
-                dist = self.calculate_distance(spot, {'lng': cell['lng'], 'lat': cell['lat']})
-                # 支援模型: load * exp(-dist)
-                # 保持与 calculate_total_support 一致
-                factor = math.exp(-dist)
-                factors.append(factor)
-            spot_decay_factors[idx] = factors
-
-        # 开始逐个分配车辆
-        for vehicle in sorted_vehicles:
-            best_spot = None
-            min_loss = float('inf')
-            best_support_contribution = [] # 暂存该车在最佳点的贡献值数组
-
-            # 尝试每一个停车点
-            for spot_idx, spot in enumerate(parking_spots):
-                # 计算假设把车停在这里，产生的总支援分布
-                # New = Current + Vehicle_Contribution
-                trial_support_values = []
-                contribution = []
-                load = vehicle['load']
-                
-                for i in range(len(self.grid)):
-                    val = load * spot_decay_factors[spot_idx][i]
-                    contribution.append(val)
-                    trial_support_values.append(current_support_grid[i] + val)
-                
-                # 计算 Loss
-                # 注意：需要先归一化 trial_support_values
-                # 为了性能，我们只针对 trial_support_values 做临时归一化
-                max_val = max(trial_support_values) if trial_support_values else 1
-                min_val = min(trial_support_values) if trial_support_values else 0
-                rng = max_val - min_val if max_val != min_val else 1
-                
-                trial_loss = 0
-                for i in range(len(self.grid)):
-                    norm_support = (trial_support_values[i] - min_val) / rng
-                    # 网格本身的 outageProb 已经是归一化过的 (在 map_outage_to_grid 中)
-                    diff = self.grid[i]['outageProb'] - norm_support
-                    trial_loss += diff**2
-                
-                if trial_loss < min_loss:
-                    min_loss = trial_loss
-                    best_spot = spot
-                    best_support_contribution = contribution
-
-            # 找到该车的最佳位置后，确定分配
-            if best_spot:
-                new_v = vehicle.copy()
-                new_v['lat'] = best_spot['lat']
-                new_v['lng'] = best_spot['lng']
-                new_v['status'] = 'busy'
-                placed_vehicles.append(new_v)
-                
-                # 更新累积网格状态
-                for i in range(len(current_support_grid)):
-                    current_support_grid[i] += best_support_contribution[i]
+        for vehicle, spot_idx in zip(sorted_vehicles, chosen):
+            best_spot = parking_spots[spot_idx]
+            new_v = vehicle.copy()
+            new_v['lat'] = best_spot['lat']
+            new_v['lng'] = best_spot['lng']
+            new_v['status'] = 'busy'
+            placed_vehicles.append(new_v)
 
         # 所有车辆分配完毕，重新计算一次最终状态以更新 algorithm 内部的 grid
-        self.calculate_total_support(placed_vehicles)
+        self.calculate_total_support(placed_vehicles, epsilon=epsilon, radius_km=radius_km)
         final_loss = self.calculate_loss()
-        support_heatmap = self.get_support_heat_points()
-        
+        support_heatmap = self.get_support_heat_points() if with_heatmap else None
+
         return placed_vehicles, final_loss, support_heatmap
 
-# 全局单例实例
-dispatch_algorithm = DispatchAlgorithm()
+    def pyramid_level(self, resolution, range_val=None):
+        """
+        构建与当前网格同中心、指定分辨率/范围的网格，
+        断电概率由最近一次映射的原始热力点重新映射得到
+        """
+        range_val = self.range_val if range_val is None else range_val
+        if resolution == self.resolution and range_val == self.range_val:
+            return self
+        level = DispatchAlgorithm(resolution, range_val, center=self.center)
+        if self.heat_points is not None:
+            level._map_outage_arrays(*self.heat_points)
+        return level
+
+    def find_best_spots_multires(self, vehicles, parking_spots, resolution=None, range_val=None,
+                                 levels=1, top_k=None, epsilon=None, radius_km=None, local_search=None,
+                                 with_heatmap=True, large_fleet=None, workers=None):
+        """
+        由粗到细的多分辨率优化:
+        1. 在金字塔的粗层级上对全部候选停车点运行贪心
+        2. 只把粗层级选中的停车点以及首轮试算损失最低的 top_k 个停车点带入下一层
+        3. 在最细层级 (resolution) 上对剩余候选点运行完整贪心
+        levels 不超过 MAX_PYRAMID_LEVELS，被 MIN_PYRAMID_RESOLUTION 截到同一分辨率的层级只保留一个；
+        top_k 不超过停车点数
+        最细层级与当前网格不同时，当前网格的支援值按最终放置的车辆重新计算 (网格几何不变)，
+        返回的 loss / 热力图与误差报告来自最细层级
+        Returns: (vehicles, loss, support_heatmap, pyramid_info, 最细层级的调度状态)
+        """
+        resolution = self.resolution if resolution is None else int(resolution)
+        range_val = self.range_val if range_val is None else float(range_val)
+        levels = int(levels)
+        if resolution < MIN_PYRAMID_RESOLUTION or resolution > MAX_GRID_RESOLUTION:
+            raise ValueError(f'resolution must be in [{MIN_PYRAMID_RESOLUTION}, {MAX_GRID_RESOLUTION}]')
+        if range_val <= 0:
+            raise ValueError('range must be positive')
+        if not 1 <= levels <= MAX_PYRAMID_LEVELS:
+            raise ValueError(f'levels must be in [1, {MAX_PYRAMID_LEVELS}]')
+        if top_k is not None:
+            top_k = int(top_k)
+            if not 1 <= top_k <= max(1, len(parking_spots)):
+                raise ValueError(f'top_k must be in [1, {max(1, len(parking_spots))}]')
+        truncation = sparse_support.truncation_radius(epsilon, radius_km)
+
+        # 金字塔分辨率: 每上一层分辨率减半，截到最小分辨率后重复的层级去掉
+        pyramid = list(dict.fromkeys(
+            max(MIN_PYRAMID_RESOLUTION, resolution >> (levels - 1 - l)) for l in range(levels)))
+        pyramid_info = []
+
+        candidates = list(range(len(parking_spots)))
+        loads = sorted((v['load'] for v in vehicles), reverse=True)
+        for res in pyramid[:-1]:
+            if not candidates or not loads:
+                break
+            level = self.pyramid_level(res, range_val)
+            spots = [parking_spots[i] for i in candidates]
+            decay = level._spot_decay(spots, truncation)
+            with level._sharded_evaluation(decay, workers):
+                chosen, first_losses, _ = level._assign(loads, decay, large_fleet)
+
+            keep = top_k or int(math.ceil(len(candidates) / 2))
+            ranked = np.argsort(first_losses, kind='stable')[:keep]
+            selected = sorted(set(chosen) | set(ranked.tolist()))
+            pyramid_info.append({'resolution': res, 'candidates': len(candidates), 'kept': len(selected)})
+            candidates = [candidates[i] for i in selected]
+
+        final = self.pyramid_level(pyramid[-1], range_val)
+        placed, loss, heatmap = final.find_best_spots(
+            vehicles, [parking_spots[i] for i in candidates], epsilon=epsilon, radius_km=radius_km,
+            local_search=local_search, with_heatmap=with_heatmap, large_fleet=large_fleet, workers=workers)
+        pyramid_info.append({'resolution': pyramid[-1], 'candidates': len(candidates), 'kept': len(candidates)})
+        if final is not self:
+            # 会话网格的支援状态与最终放置保持一致，报告仍取最细层级的 (与返回的 loss 对应)
+            self.calculate_total_support(placed, epsilon=epsilon, radius_km=radius_km)
+            self.support_error_bound = final.support_error_bound
+            self.distance_report = final.distance_report
+            self.local_search_report = final.local_search_report
+            self.fleet_report = final.fleet_report
+
+        return placed, loss, heatmap, pyramid_info, final
+
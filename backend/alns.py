@@ -0,0 +1,489 @@
+import math
+import random
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+# 默认迭代上限 (与时间上限先到者为准)
+DEFAULT_ITERATIONS = 20000
+# 未分配任务的惩罚 (小时/个)，搜索中允许暂时存在无法插入的任务
+UNASSIGNED_PENALTY = 1000.0
+# 每次破坏移除的任务数: [MIN_REMOVE, min(MAX_REMOVE, 任务数 * MAX_REMOVE_RATIO)]
+MIN_REMOVE = 2
+MAX_REMOVE = 30
+MAX_REMOVE_RATIO = 0.2
+# 随机化选择的偏向程度 (worst / related 移除: 按排序取 rank = floor(len * u^DETERMINISM))
+DETERMINISM = 4
+# 自适应权重: 每 SEGMENT_LENGTH 次迭代按得分更新，REACTION 为新得分的比重
+SEGMENT_LENGTH = 100
+REACTION = 0.2
+# 得分: 新的全局最优 / 优于当前解 / 接受了更差的解
+SCORE_BEST, SCORE_BETTER, SCORE_ACCEPTED = 33, 9, 13
+# 模拟退火: 初始温度使比当前解差 START_WORSE 的解以 50% 概率被接受，结束时降到初始的 END_RATIO
+START_WORSE = 0.01
+END_RATIO = 0.001
+# 插入试算用的序列 DP 表 (SequenceProfile) 的缓存条目上限
+PROFILE_CACHE_SIZE = 20000
+
+
+class SequenceProfile:
+    """
+    某车辆能力 (P, E) 下一个可行序列的区间 DP 表 (与 Scheduler._evaluate_sequence 相同的模型)，
+    用于试算插入一个任务后的最优成本: 只枚举包含新任务的那一趟的起止位置，
+    趟外的前缀/后缀直接查表，不对新序列重新做整段 DP
+    每个车库: f[i] 为覆盖 seq[:i + 1] 且在 i 处结束一趟的最小成本，
+    h[i] 为从 i 出发覆盖 seq[i:] 的 min_j (end_ret[j] + best[j + 1]) (与 i 之前的任务无关)
+    """
+
+    def __init__(self, scheduler, seq, power, energy):
+        dag = scheduler._dag()
+        self.s = scheduler
+        self.chain_succ = dag['chain_succ']
+        self.power, self.energy = power, energy
+        self.seq = seq
+        # 调用方的试算缓存: 任务 -> (插入下标, 成本) (插入下标由任务顺序唯一确定)
+        self.memo = {}
+        m = len(seq)
+        tasks = [scheduler.tasks[t] for t in seq]
+        self.r_start = [t['r_start'] for t in tasks]
+        self.work = [t['p'] * t['duration'] for t in tasks]
+        # reach[i]: 从 i 开始的一趟最多能延伸到的下标 (序列可行，因此 reach[i] >= i)
+        self.reach = []
+        for i in range(m):
+            trip_energy, j = 0.0, i
+            while j < m:
+                if j > i and seq[j] not in self.chain_succ[seq[j - 1]]:
+                    break
+                trip_energy += self.work[j]
+                if trip_energy > energy + 1e-5:
+                    break
+                j += 1
+            self.reach.append(j - 1)
+
+        inf = math.inf
+        self.depots = []
+        for d_id, (out_legs, back_legs) in dag['legs'].items():
+            lead = [out_legs[t] for t in seq]
+            dep = [max(0.0, self.r_start[i] - lead[i]) for i in range(m)]
+            end_ret = [tasks[j]['r_end'] + back_legs[seq[j]] for j in range(m)]
+
+            # start[i]: 第 i 个任务开始一趟 (上一趟以 i - 1 结束) 时的出发时间，时间窗不满足时为 None
+            start = []
+            for i in range(m):
+                d = dep[i] if i == 0 else max(dep[i], end_ret[i - 1])
+                start.append(d if d + lead[i] - self.r_start[i] <= 1e-5 else None)
+
+            best = [inf] * (m + 1)
+            best[m] = 0.0
+            h = [inf] * m
+            for i in range(m - 1, -1, -1):
+                h[i] = min(end_ret[j] + best[j + 1] for j in range(i, self.reach[i] + 1))
+                if start[i] is not None:
+                    best[i] = h[i] - start[i]
+            # 能以 j 结束的趟的起点是连续的一段 (更早的起点电量更大、chain 更长)
+            f = [inf] * m
+            for j in range(m):
+                for i in range(j, -1, -1):
+                    if self.reach[i] < j:
+                        break
+                    prefix = 0.0 if i == 0 else f[i - 1]
+                    if start[i] is not None and prefix < inf:
+                        f[j] = min(f[j], prefix + end_ret[j] - start[i])
+            # 插入任务所在的一趟以原任务 i 开始 / 以原任务 j 结束时，趟外部分与插入的任务无关:
+            # head[i] = 前缀成本 - 出发时间，tail[j] = 返回时间 + 后缀成本
+            head = [inf] * m
+            for i in range(m):
+                prefix = 0.0 if i == 0 else f[i - 1]
+                if start[i] is not None and prefix < inf:
+                    head[i] = prefix - start[i]
+            tail = [end_ret[j] + best[j + 1] for j in range(m)]
+            self.depots.append((out_legs, back_legs, lead, dep, end_ret, h, f, head, tail))
+
+    def insertion_cost(self, k, t):
+        """把任务 t 插入到下标 k 之前 (调用方保证与相邻任务满足 DAG 边) 后的最优成本，不可行时为 inf"""
+        s = self.s
+        task = s.tasks[t]
+        inf = math.inf
+        e_t = task['p'] * task['duration']
+        if task['p'] > self.power + 1e-5 or e_t > self.energy + 1e-5:
+            return inf
+        seq, m = self.seq, len(self.seq)
+        chain_in = k > 0 and t in self.chain_succ[seq[k - 1]]
+        chain_out = k < m and seq[k] in self.chain_succ[t]
+
+        # 包含 t 的一趟除 t 以外的起点 / 终点 (原序列下标，由近到远)，以及 t 之前 / 之后部分的累计电量
+        starts, before = [], []
+        if chain_in:
+            energy = 0.0
+            for i in range(k - 1, -1, -1):
+                if self.reach[i] < k - 1:
+                    break
+                energy += self.work[i]
+                if energy + e_t > self.energy + 1e-5:
+                    break
+                starts.append(i)
+                before.append(energy)
+        ends, after = [], []
+        if chain_out:
+            energy = 0.0
+            for j in range(k, self.reach[k] + 1):
+                energy += self.work[j]
+                ends.append(j)
+                after.append(energy)
+
+        # 电量只耦合起点与终点: 起点可搭配的终点是 (t 本身 + ends) 的一个前缀，长度为 limits[x]
+        # limits[0] 对应起点为 t 本身，limits[x] 对应起点 starts[x - 1]
+        budget = self.energy + 1e-5 - e_t
+        limits = []
+        n = len(ends)
+        for e_before in [0.0] + before:
+            while n and e_before + after[n - 1] > budget:
+                n -= 1
+            limits.append(n + 1)
+
+        best = inf
+        for out_legs, back_legs, lead, dep, end_ret, h, f, head, tail in self.depots:
+            # 成本 = head[起点] + tail[终点]；终点部分按 limits 取前缀最小值
+            end_t = task['r_end'] + back_legs[t]
+            low = end_t
+            if k < m:
+                n_depart = max(dep[k], end_t)
+                low = end_t + h[k] - n_depart if n_depart + lead[k] - self.r_start[k] <= 1e-5 else inf
+            lows = [low]
+            for j in ends:
+                if tail[j] < low:
+                    low = tail[j]
+                lows.append(low)
+
+            # 起点为 t 本身: 出发时间受上一趟 (以 k - 1 结束) 的返回时间约束
+            lead_t = out_legs[t]
+            depart = max(0.0, task['r_start'] - lead_t)
+            prefix = 0.0
+            if k > 0:
+                depart = max(depart, end_ret[k - 1])
+                prefix = f[k - 1]
+            if depart + lead_t - task['r_start'] <= 1e-5:
+                cost = prefix - depart + lows[limits[0] - 1]
+                if cost < best:
+                    best = cost
+            for i, limit in zip(starts, limits[1:]):
+                cost = head[i] + lows[limit - 1]
+                if cost < best:
+                    best = cost
+        return best
+
+
+class ALNS:
+    """
+    自适应大邻域搜索 (Adaptive Large Neighborhood Search)，用于任务数较多、精确搜索不可行的实例
+    - 解: 每辆车的任务序列 (按 Scheduler._task_order 排列)，加上暂时未分配的任务集合
+    - 成本/可行性: Scheduler.sequence_cost (带缓存的序列评估，与 Branch & Bound 相同的模型)
+    - 破坏: 随机移除 / 最差移除 / 相关移除 (时间窗与距离相近) / 整车移除
+    - 修复: 贪心插入 / regret-2 插入；任务在序列中的位置由任务顺序唯一确定，只需选择车辆
+    - 接受准则: 模拟退火；算子按得分自适应调整被选中的概率
+    给定 seed 且在时间上限前达到迭代上限时，结果可复现
+    """
+
+    def __init__(self, scheduler, seed=0, max_iterations=DEFAULT_ITERATIONS, deadline=None, on_incumbent=None):
+        self.s = scheduler
+        self.rng = random.Random(seed)
+        self.max_iterations = int(max_iterations)
+        self.deadline = deadline
+        self.on_incumbent = on_incumbent
+
+        self.order = scheduler._task_order()
+        self.pos = {t: k for k, t in enumerate(self.order)}
+        self.succ = scheduler._dag()['succ']
+        self.vehicle_ids = list(scheduler.vehicles)
+        self.vehicle_index = {v: k for k, v in enumerate(self.vehicle_ids)}
+        self.capability = {v: (c['P'], c['E']) for v, c in scheduler.vehicles.items()}
+
+        self.destroy_ops = [('random', self._random_removal), ('worst', self._worst_removal),
+                            ('related', self._related_removal), ('route', self._route_removal)]
+        self.repair_ops = [('greedy', self._greedy_insertion), ('regret', self._regret_insertion)]
+        # (P, E, 序列) -> SequenceProfile，未变化的车辆序列在多次修复之间复用
+        self._profiles = OrderedDict()
+
+    # ---- 解的表示 ----
+
+    def _evaluate(self, seq, v):
+        """(ok, depot, time, energy, max_p, trips)，空序列成本为 0"""
+        return self.s.sequence_cost(seq, v)
+
+    def _objective(self, costs, unassigned):
+        return sum(costs.values()) + UNASSIGNED_PENALTY * len(unassigned)
+
+    def _position(self, seq, t):
+        """任务 t 在按任务顺序排列的序列中的插入下标，与 DAG 不兼容时返回 None"""
+        k = bisect_left([self.pos[x] for x in seq], self.pos[t])
+        if k > 0 and t not in self.succ[seq[k - 1]]:
+            return None
+        if k < len(seq) and seq[k] not in self.succ[t]:
+            return None
+        return k
+
+    def _profile(self, seq, v):
+        key = self.capability[v] + (seq,)
+        profile = self._profiles.get(key)
+        if profile is None:
+            profile = SequenceProfile(self.s, seq, *self.capability[v])
+            self._profiles[key] = profile
+            if len(self._profiles) > PROFILE_CACHE_SIZE:
+                self._profiles.popitem(last=False)
+        else:
+            self._profiles.move_to_end(key)
+        return profile
+
+    # ---- 修复 ----
+
+    def _option(self, t, v, seqs, costs):
+        """任务 t 插入车辆 v 的 (成本增量, 车辆序号, 车辆, 插入下标)，不可行时为 None"""
+        profile = self._profile(seqs[v], v)
+        entry = profile.memo.get(t)
+        if entry is None:
+            k = self._position(seqs[v], t)
+            entry = profile.memo[t] = (k, math.inf if k is None else profile.insertion_cost(k, t))
+        k, cost = entry
+        if cost == math.inf:
+            return None
+        return cost - costs[v], self.vehicle_index[v], v, k
+
+    def _insertion_options(self, t, seqs, costs):
+        """任务 t 插入各车辆的选项 (见 _option)，按 (增量, 车辆序号) 排序；能力相同的空车只评估一辆"""
+        options = []
+        tried_empty = set()
+        for v in self.vehicle_ids:
+            if not seqs[v]:
+                if self.capability[v] in tried_empty:
+                    continue
+                tried_empty.add(self.capability[v])
+            option = self._option(t, v, seqs, costs)
+            if option is not None:
+                options.append(option)
+        options.sort()
+        return options
+
+    def _repair(self, pending, seqs, costs, results, regret):
+        """
+        逐个插入待分配任务: 每轮对所有待分配任务计算最优插入，
+        贪心选增量最小的任务，regret 选 (次优 - 最优) 最大的任务 (只有一个可行位置时最优先)
+        插入增量由车辆当前序列的 SequenceProfile 试算，只有选中的插入用 sequence_cost 精确评估；
+        只有被修改的车辆需要重新试算；无法插入的任务保留在返回的未分配集合中
+        """
+        options = {t: self._insertion_options(t, seqs, costs) for t in pending}
+        unassigned = set()
+        while options:
+            best_key, best_task = None, None
+            for t in sorted(options, key=self.pos.get):
+                opts = options[t]
+                if not opts:
+                    continue
+                if regret:
+                    second = opts[1][0] if len(opts) > 1 else math.inf
+                    key = (-(second - opts[0][0]), opts[0][0])
+                else:
+                    key = (opts[0][0],)
+                if best_key is None or key < best_key:
+                    best_key, best_task = key, t
+            if best_task is None:
+                unassigned.update(options)
+                break
+
+            _, _, v, k = options.pop(best_task)[0]
+            was_empty = not seqs[v]
+            seq = seqs[v][:k] + (best_task,) + seqs[v][k:]
+            res = self._evaluate(seq, v)
+            seqs[v], costs[v], results[v] = seq, res[2], res
+            # v 原本是空车时，同能力的下一辆空车成为代表，继承 v 原来的 (空车) 插入选项
+            heir = None
+            if was_empty:
+                heir = next((u for u in self.vehicle_ids
+                             if not seqs[u] and self.capability[u] == self.capability[v]), None)
+            # 车辆 v 的序列变化后，只需更新其他待分配任务在 v 上的插入选项
+            for t, opts in options.items():
+                inherited = [o for o in opts if o[2] == v] if heir is not None else ()
+                opts[:] = [o for o in opts if o[2] != v]
+                for delta, _, _, pos in inherited:
+                    insort(opts, (delta, self.vehicle_index[heir], heir, pos))
+                option = self._option(t, v, seqs, costs)
+                if option is not None:
+                    insort(opts, option)
+        return unassigned
+
+    def _greedy_insertion(self, pending, seqs, costs, results):
+        return self._repair(pending, seqs, costs, results, regret=False)
+
+    def _regret_insertion(self, pending, seqs, costs, results):
+        return self._repair(pending, seqs, costs, results, regret=True)
+
+    # ---- 破坏 ----
+
+    def _assigned(self, seqs):
+        return [t for v in self.vehicle_ids for t in seqs[v]]
+
+    def _biased_pick(self, ranked, q):
+        """从排好序的候选中按偏向前部的随机顺序取 q 个"""
+        ranked = list(ranked)
+        picked = []
+        while ranked and len(picked) < q:
+            picked.append(ranked.pop(int(len(ranked) * self.rng.random() ** DETERMINISM)))
+        return picked
+
+    def _random_removal(self, seqs, costs, q):
+        assigned = self._assigned(seqs)
+        return self.rng.sample(assigned, min(q, len(assigned)))
+
+    def _worst_removal(self, seqs, costs, q):
+        """按移除后节省的成本从大到小 (有偏随机) 选择"""
+        savings = []
+        for v in self.vehicle_ids:
+            seq = seqs[v]
+            for k, t in enumerate(seq):
+                rest = self._evaluate(seq[:k] + seq[k + 1:], v)
+                saving = costs[v] - rest[2] if rest[0] else -math.inf
+                savings.append((-saving, self.pos[t], t))
+        savings.sort()
+        return self._biased_pick([t for _, _, t in savings], q)
+
+    def _related_removal(self, seqs, costs, q):
+        """以随机任务为种子，移除开始时间与行驶距离上最相近的任务"""
+        assigned = self._assigned(seqs)
+        if not assigned:
+            return []
+        seed = self.rng.choice(assigned)
+        start = self.s.tasks[seed]['r_start']
+        relatedness = sorted(
+            (abs(self.s.tasks[t]['r_start'] - start)
+             + min(self.s._get_travel_time(seed, t), self.s._get_travel_time(t, seed)), self.pos[t], t)
+            for t in assigned if t != seed)
+        return [seed] + self._biased_pick([t for _, _, t in relatedness], q - 1)
+
+    def _route_removal(self, seqs, costs, q):
+        """移除一辆 (任务数不超过 q 的) 车辆的全部任务，让其任务重新分配"""
+        candidates = [v for v in self.vehicle_ids if seqs[v] and len(seqs[v]) <= q]
+        if not candidates:
+            return self._random_removal(seqs, costs, q)
+        return list(seqs[self.rng.choice(candidates)])
+
+    def _destroy(self, op, seqs, costs, results, q):
+        """移除任务；剩余序列不可行的车辆 (行驶时间不满足三角不等式时可能发生) 整车移除"""
+        removed = set(op(seqs, costs, q))
+        for v in self.vehicle_ids:
+            if not removed.intersection(seqs[v]):
+                continue
+            seq = tuple(t for t in seqs[v] if t not in removed)
+            res = self._evaluate(seq, v)
+            if not res[0]:
+                removed.update(seq)
+                seq, res = (), self._evaluate((), v)
+            seqs[v], costs[v], results[v] = seq, res[2], res
+        return removed
+
+    # ---- 主循环 ----
+
+    def _select(self, weights):
+        r = self.rng.random() * sum(weights)
+        for k, weight in enumerate(weights):
+            r -= weight
+            if r <= 0:
+                return k
+        return len(weights) - 1
+
+    def run(self):
+        """
+        Returns: (best_total_time, best_solution 或 None (存在无法分配的任务), stats)
+        best_solution 格式与 Scheduler 其他求解方式相同 (seq, depot, time, energy, trips)
+        """
+        start_time = time.time()
+        empty = {v: self._evaluate((), v) for v in self.vehicle_ids}
+        seqs = {v: () for v in self.vehicle_ids}
+        costs = {v: 0.0 for v in self.vehicle_ids}
+        results = dict(empty)
+        unassigned = self._greedy_insertion(list(self.order), seqs, costs, results)
+
+        current = (dict(seqs), dict(costs), dict(results), set(unassigned))
+        current_obj = self._objective(costs, unassigned)
+        best, best_obj = current, current_obj
+        if not unassigned:
+            self._emit(best)
+
+        n_tasks = len(self.order)
+        max_remove = max(MIN_REMOVE, min(MAX_REMOVE, int(n_tasks * MAX_REMOVE_RATIO)))
+        temperature = START_WORSE * max(sum(costs.values()), 1.0) / math.log(2)
+        t0 = temperature
+        d_weights = [1.0] * len(self.destroy_ops)
+        r_weights = [1.0] * len(self.repair_ops)
+        d_scores = [[0.0, 0] for _ in self.destroy_ops]
+        r_scores = [[0.0, 0] for _ in self.repair_ops]
+        stats = {'iterations': 0, 'accepted': 0, 'improvements': 0}
+
+        iteration = 0
+        while n_tasks and iteration < self.max_iterations:
+            if self.s.expired(self.deadline):
+                break
+            iteration += 1
+            d = self._select(d_weights)
+            r = self._select(r_weights)
+            q = self.rng.randint(MIN_REMOVE, max_remove)
+
+            seqs, costs, results, unassigned = (dict(current[0]), dict(current[1]), dict(current[2]),
+                                                set(current[3]))
+            removed = self._destroy(self.destroy_ops[d][1], seqs, costs, results, q)
+            pending = sorted(removed | unassigned, key=self.pos.get)
+            unassigned = self.repair_ops[r][1](pending, seqs, costs, results)
+            obj = self._objective(costs, unassigned)
+
+            score = 0
+            if obj < best_obj - 1e-9:
+                best, best_obj = (seqs, costs, results, unassigned), obj
+                current, current_obj = best, obj
+                score = SCORE_BEST
+                stats['improvements'] += 1
+                if not unassigned:
+                    self._emit(best)
+            elif obj < current_obj - 1e-9:
+                current, current_obj = (seqs, costs, results, unassigned), obj
+                score = SCORE_BETTER
+            elif self.rng.random() < math.exp(-(obj - current_obj) / max(temperature, 1e-12)):
+                current, current_obj = (seqs, costs, results, unassigned), obj
+                score = SCORE_ACCEPTED
+            if score:
+                stats['accepted'] += 1
+            for scores, k in ((d_scores, d), (r_scores, r)):
+                scores[k][0] += score
+                scores[k][1] += 1
+
+            if iteration % SEGMENT_LENGTH == 0:
+                for weights, scores in ((d_weights, d_scores), (r_weights, r_scores)):
+                    for k, (total, used) in enumerate(scores):
+                        if used:
+                            weights[k] = (1 - REACTION) * weights[k] + REACTION * total / used
+                        weights[k] = max(weights[k], 0.1)
+                        scores[k] = [0.0, 0]
+
+            # 温度按迭代与时间两者中进度较快者指数下降
+            progress = iteration / self.max_iterations
+            if self.deadline is not None:
+                progress = max(progress, (time.time() - start_time) / max(self.deadline - start_time, 1e-9))
+            temperature = t0 * END_RATIO ** min(progress, 1.0)
+
+        seqs, costs, results, unassigned = best
+        stats.update(
+            iterations=iteration, unassigned=len(unassigned),
+            destroyWeights={name: round(w, 3) for (name, _), w in zip(self.destroy_ops, d_weights)},
+            repairWeights={name: round(w, 3) for (name, _), w in zip(self.repair_ops, r_weights)})
+        if unassigned:
+            return math.inf, None, stats
+        return sum(costs.values()), self._solution(best), stats
+
+    def _solution(self, state):
+        seqs, costs, results, _ = state
+        return {
+            v: {"seq": seqs[v], "depot": results[v][1], "time": results[v][2],
+                "energy": results[v][3], "trips": results[v][5]}
+            for v in self.vehicle_ids
+        }
+
+    def _emit(self, state):
+        if self.on_incumbent:
+            self.on_incumbent(sum(state[1].values()), self._solution(state))
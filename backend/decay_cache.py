@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+
+# 衰减向量缓存的默认内存上限 (字节)
+DECAY_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# 坐标取整的小数位数 (1e-6 度约 0.1 米)
+COORD_DECIMALS = 6
+
+
+def _arrays(value):
+    """缓存值可以是单个数组，也可以是数组元组 (稀疏足迹: indices, data)"""
+    return value if isinstance(value, tuple) else (value,)
+
+
+def point_key(lng, lat):
+    """停车点/车辆坐标取整后的缓存键"""
+    return (round(float(lng), COORD_DECIMALS), round(float(lat), COORD_DECIMALS))
+
+
+class DecayCache:
+    """
+    进程级的衰减向量缓存 (LRU + 内存上限)
+    键: (网格几何键, 取整后的坐标[, 截断半径])
+    值: 该点到所有网格的衰减系数 exp(-dist)，或截断后的稀疏足迹 (indices, data)
+    规划人员在多次优化之间反复使用相同的候选停车点，命中后可跳过预计算
+    """
+
+    def __init__(self, max_bytes=DECAY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            vec = self._entries.get(key)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    @staticmethod
+    def _nbytes(value):
+        return sum(arr.nbytes for arr in _arrays(value))
+
+    def put(self, key, value):
+        # 缓存中的向量被多个请求共享，设为只读防止被原地修改
+        for arr in _arrays(value):
+            arr.setflags(write=False)
+        size = self._nbytes(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= self._nbytes(old)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = value
+            self._bytes += size
+            # 超出内存上限时淘汰最久未使用的条目
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= self._nbytes(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'maxBytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+# 全局共享实例 (进程级)
+decay_cache = DecayCache()
@@ -0,0 +1,66 @@
+import base64
+import numpy as np
+
+# 支持的量化类型: 名称 -> (numpy 类型, 最大量化值)
+QUANT_DTYPES = {
+    'uint8': (np.uint8, 255),
+    'uint16': (np.uint16, 65535)
+}
+# 与 JSON 格式一致: count = 归一化值 * 100
+COUNT_SCALE = 100
+
+
+def quantize(values, dtype='uint8'):
+    """将 [0, 1] 的归一化网格值量化为 uint8 / uint16"""
+    if dtype not in QUANT_DTYPES:
+        raise ValueError(f'Unsupported dtype: {dtype}')
+    np_type, max_q = QUANT_DTYPES[dtype]
+    return np.rint(np.clip(values, 0.0, 1.0) * max_q).astype(np_type)
+
+
+def delta(current, base):
+    """
+    相对于客户端已持有的量化数组的差分，按量化类型的位宽取模 (回绕)，
+    客户端还原: current = (base + delta) mod 2^bits
+    """
+    return current - base
+
+
+def metadata(geometry, layer, version, dtype='uint8', base_version=None):
+    """
+    紧凑热力图的元数据: 网格原点/步长/形状 + 量化参数
+    数组按 k = i * resolution + j 排列 (i 为经度索引, j 为纬度索引)，
+    网格 k 的坐标: lng = origin[0] + i * step, lat = origin[1] + j * step
+    count = q * scale，与 JSON 格式中的 count 对应
+    """
+    _, max_q = QUANT_DTYPES[dtype]
+    meta = {
+        'format': 'grid',
+        'layer': layer,
+        'version': version,
+        'dtype': dtype,
+        'byteOrder': 'little',
+        'origin': [float(geometry.lng_axis[0]), float(geometry.lat_axis[0])],
+        'step': float(geometry.step),
+        'shape': [geometry.resolution, geometry.resolution],
+        'order': 'lng-major',
+        'scale': COUNT_SCALE / max_q,
+        'delta': base_version is not None
+    }
+    if base_version is not None:
+        meta['baseVersion'] = base_version
+    return meta
+
+
+def to_bytes(quantized, base=None):
+    """原始二进制负载 (小端)，有 base 时为差分"""
+    payload = delta(quantized, base) if base is not None else quantized
+    return payload.astype(payload.dtype.newbyteorder('<'), copy=False).tobytes()
+
+
+def to_json(meta, quantized, base=None):
+    """JSON 紧凑格式: 元数据 + base64 编码的量化数组"""
+    payload = dict(meta)
+    payload['encoding'] = 'base64'
+    payload['data'] = base64.b64encode(to_bytes(quantized, base)).decode('ascii')
+    return payload
@@ -0,0 +1,180 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# 延迟直方图的桶上界 (秒)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    body = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                    for k, v in labels)
+    return '{' + body + '}'
+
+
+class Histogram:
+    """累积直方图 (Prometheus 语义: 每个桶计数所有 <= 上界的观测值)，按标签组合分别统计"""
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # 标签值元组 -> [各桶计数 (非累积), 总和, 总数]
+        self._series = {}
+
+    def observe(self, label_values, value):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        # 桶数量很少，线性查找比二分更快
+        for k, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            k = len(self.buckets)
+        series[0][k] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for label_values, (counts, total, count) in sorted(self._series.items()):
+            labels = list(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                cumulative += n
+                le = bound if bound == '+Inf' else repr(float(bound))
+                lines.append(f'{self.name}_bucket{_format_labels(labels + [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {total!r}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {count}')
+        return lines
+
+
+class Counter:
+    """单调递增计数器，按标签组合分别统计"""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._series = {}
+
+    def inc(self, label_values, amount=1):
+        self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(self._series.items()):
+            lines.append(f'{self.name}{_format_labels(list(zip(self.label_names, label_values)))} {value}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    轻量的进程内指标注册表 (无外部依赖)
+    - 路由级: 请求延迟直方图 + 按状态码的请求计数
+    - 阶段级: 各计算阶段 (断电映射 / 衰减预计算 / 贪心搜索 / 热力点导出 ...) 的耗时直方图
+    - 请求内: 当前线程正在处理的请求的阶段耗时汇总，用于 Server-Timing 响应头
+    每次记录只有一次 perf_counter 与一次加锁的字典更新，可以在生产环境中常开
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.request_latency = Histogram(
+            'dispatch_http_request_duration_seconds', 'HTTP request latency by route.', ('route', 'method'))
+        self.requests = Counter(
+            'dispatch_http_requests_total', 'HTTP requests by route and status.', ('route', 'method', 'status'))
+        self.phase_latency = Histogram(
+            'dispatch_phase_duration_seconds', 'Time spent in each computation phase.', ('phase',))
+        self.phase_calls = Counter(
+            'dispatch_phase_calls_total', 'Number of times each computation phase ran.', ('phase',))
+        self._gauges = []
+
+    # ---- 请求级 ----
+
+    def start_request(self):
+        """开始记录当前线程的请求 (Flask before_request)"""
+        self._local.phases = {}
+        self._local.start = time.perf_counter()
+
+    def finish_request(self, route, method, status):
+        """
+        结束当前请求并记录路由级指标 (Flask after_request)
+        Returns: (总耗时秒, {阶段: [耗时秒, 次数]})
+        """
+        start = getattr(self._local, 'start', None)
+        phases = getattr(self._local, 'phases', None) or {}
+        self._local.start = None
+        self._local.phases = None
+        if start is None:
+            return None, phases
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.request_latency.observe((route, method), elapsed)
+            self.requests.inc((route, method, str(status)))
+        return elapsed, phases
+
+    # ---- 阶段级 ----
+
+    @contextmanager
+    def phase(self, name):
+        """计时一个计算阶段，同时累加到当前请求 (如果有) 的阶段汇总中"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phase_latency.observe((name,), seconds)
+            self.phase_calls.inc((name,))
+        phases = getattr(self._local, 'phases', None)
+        if phases is not None:
+            entry = phases.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def timed(self, name):
+        """阶段计时装饰器"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # ---- 导出 ----
+
+    def add_gauge(self, name, help_text, fn):
+        """注册一个在导出时才读取的瞬时值 (fn 返回数值)"""
+        self._gauges.append((name, help_text, fn))
+
+    def render(self):
+        """Prometheus 文本格式 (text/plain; version=0.0.4)"""
+        with self._lock:
+            lines = []
+            for metric in (self.request_latency, self.requests, self.phase_latency, self.phase_calls):
+                lines.extend(metric.render())
+        for name, help_text, fn in self._gauges:
+            lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {fn()!r}'])
+        return '\n'.join(lines) + '\n'
+
+
+def server_timing(elapsed, phases):
+    """生成 Server-Timing 响应头: 各阶段耗时 (毫秒，同名阶段累加) + 请求总耗时"""
+    parts = [f'{name};dur={seconds * 1000:.2f};desc="x{count}"' if count > 1 else f'{name};dur={seconds * 1000:.2f}'
+             for name, (seconds, count) in phases.items()]
+    if elapsed is not None:
+        parts.append(f'total;dur={elapsed * 1000:.2f}')
+    return ', '.join(parts)
+
+
+# 全局注册表 (进程级)
+metrics = MetricsRegistry()
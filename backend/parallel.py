@@ -0,0 +1,188 @@
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+
+# 每个工作进程至少分到的候选点数，候选点太少时分片开销大于收益
+MIN_ROWS_PER_WORKER = 64
+# 工作进程内保持挂载的共享内存段数 (一次分片评估的 decay / outage / base)，更早的段被卸载
+MAX_ATTACHED_SEGMENTS = 3
+
+# 工作进程内挂载的共享数组: 共享内存段名 -> (SharedMemory, ndarray 视图)，按最近使用排序
+_attached = OrderedDict()
+
+# 进程级共享的分片评估进程池 (见 _shared_pool)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def max_workers():
+    """本机可用的工作进程数上限"""
+    return os.cpu_count() or 1
+
+
+def _shared_pool():
+    """
+    进程级共享的分片评估进程池，第一次使用时创建，之后的请求复用，不重复启动工作进程
+    Flask 以多线程处理请求，直接 fork 会把其他线程持有的锁复制到子进程中，
+    因此工作进程用 forkserver (不可用时 spawn) 方式启动
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool = ProcessPoolExecutor(max_workers=max_workers(), mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def _discard_pool(pool):
+    """进程池损坏 (工作进程异常退出) 后丢弃，下一次使用时重新创建"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _view(spec):
+    """工作进程内按段名挂载 (或复用已挂载的) 共享数组"""
+    shm_name, shape, dtype = spec
+    entry = _attached.get(shm_name)
+    if entry is not None:
+        _attached.move_to_end(shm_name)
+        return entry[1]
+    shm = shared_memory.SharedMemory(name=shm_name)
+    view = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _attached[shm_name] = (shm, view)
+    while len(_attached) > MAX_ATTACHED_SEGMENTS:
+        old_shm, old_view = _attached.popitem(last=False)[1]
+        del old_view
+        old_shm.close()
+    return view
+
+
+def _shard_losses(specs, loss_fn, start, stop, load):
+    """在工作进程中评估候选点 [start, stop) 的试算损失，specs 为共享数组的 (段名, 形状, 类型)"""
+    decay = _view(specs['decay'])
+    return loss_fn(_view(specs['outage']), _view(specs['base']), decay[start:stop], load)
+
+
+class ShardedEvaluator:
+    """
+    把稠密衰减矩阵上的候选点批量试算分片到进程池
+    - 衰减矩阵、outage 网格和当前累积支援值放在共享内存中，任务只传递 (段名, 分片范围, 载荷)，不序列化数组
+    - 每次试算前主进程把累积支援值写入共享缓冲区，各分片的结果按分片顺序拼接，
+      逐行的计算与单进程完全相同，因此结果 (包括 argmin 的并列处理) 与进程数无关
+    - 工作进程来自进程级共享的进程池 (_shared_pool)，退出上下文时只释放共享内存
+    用法: with ShardedEvaluator(decay, outage, workers, loss_fn) as evaluator: evaluator.candidate_losses(base, load)
+    """
+
+    def __init__(self, decay, outage, workers, loss_fn):
+        self.decay = decay
+        self.outage = outage
+        self.loss_fn = loss_fn
+        self.workers = max(1, min(int(workers), decay.shape[0] // MIN_ROWS_PER_WORKER or 1))
+        bounds = np.linspace(0, decay.shape[0], self.workers + 1).astype(int)
+        self.shards = [(int(lo), int(hi)) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+        self._segments = []
+        self._arrays = {}
+        self._specs = None
+        self._pool = None
+
+    def _share(self, name, array):
+        shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+        view[...] = array
+        self._segments.append(shm)
+        self._arrays[name] = view
+        return shm.name, array.shape, array.dtype.str
+
+    def __enter__(self):
+        try:
+            self._specs = {
+                'decay': self._share('decay', np.ascontiguousarray(self.decay, dtype=float)),
+                'outage': self._share('outage', np.asarray(self.outage, dtype=float)),
+                'base': self._share('base', np.zeros(self.decay.shape[1]))
+            }
+            self._pool = _shared_pool()
+        except Exception:
+            self.close()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self._pool = None
+        self._specs = None
+        self._arrays.clear()
+        for shm in self._segments:
+            shm.close()
+            shm.unlink()
+        self._segments = []
+
+    def candidate_losses(self, base_support, load):
+        """与 loss_fn(outage, base_support, decay, load) 相同的结果，按分片并行计算"""
+        self._arrays['base'][...] = base_support
+        try:
+            futures = [self._pool.submit(_shard_losses, self._specs, self.loss_fn, lo, hi, float(load))
+                       for lo, hi in self.shards]
+            return np.concatenate([f.result() for f in futures])
+        except BrokenProcessPool:
+            _discard_pool(self._pool)
+            raise
+
+
+class SharedBound:
+    """
+    进程间共享的单调递减上界 (一个 float64 放在共享内存中)
+    - get() 无锁读取，offer(value) 加锁后只在 value 更小时写入
+    - 通过进程池的 initargs 传给工作进程 (Lock 只能在创建进程时继承)，工作进程中按名称挂载
+    用法: with SharedBound(initial) as bound: ...
+    """
+
+    def __init__(self, value):
+        self._shm = shared_memory.SharedMemory(create=True, size=8)
+        self._lock = multiprocessing.Lock()
+        self._owner = True
+        self._value = np.ndarray((1,), dtype=float, buffer=self._shm.buf)
+        self._value[0] = value
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'lock': self._lock}
+
+    def __setstate__(self, state):
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._lock = state['lock']
+        self._owner = False
+        self._value = np.ndarray((1,), dtype=float, buffer=self._shm.buf)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def get(self):
+        return float(self._value[0])
+
+    def offer(self, value):
+        """value 小于当前值时更新，返回更新后的值"""
+        with self._lock:
+            if value < self._value[0]:
+                self._value[0] = value
+            return float(self._value[0])
+
+    def close(self):
+        if self._shm is None:
+            return
+        self._value = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+        self._shm = None
@@ -1,7 +1,40 @@
-import itertools
 import logging
 import time
-from . import gaode_api
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from . import gaode_api, parallel
+from .alns import ALNS, DEFAULT_ITERATIONS
+from .metrics import metrics
+from .trip_pool import MAX_TRIP_TASKS, TripPool, pack, set_partition_search
+
+# 序列评估缓存的条目上限 (每个 Scheduler 实例)
+SEQUENCE_CACHE_SIZE = 200000
+# 默认求解时间上限 (秒)，超时返回当前最优解；单次请求可在 MAX_SOLVE_LIMIT_SECONDS 内自行指定
+SOLVE_LIMIT_SECONDS = 8.0
+MAX_SOLVE_LIMIT_SECONDS = 300.0
+# 'columns' 求解时列池生成最多占用的时间比例，其余时间留给集合划分局部搜索
+POOL_TIME_SHARE = 0.5
+# 可选的求解方式: 'bnb' 精确分支定界 / 'columns' 趟次列池 + 集合划分局部搜索 / 'alns' 自适应大邻域搜索
+SOLVERS = ('bnb', 'columns', 'alns')
+# 并行 Branch & Bound 时每个工作进程平均分到的子树数 (子树大小差异很大，多划分一些便于负载均衡)
+SUBTREES_PER_WORKER = 4
+# 并行 Branch & Bound 时主进程检查取消标志的间隔 (秒)
+CANCEL_POLL_SECONDS = 0.2
+
+# 并行搜索工作进程内的调度器副本与共享上界 (见 _init_search_worker)
+_worker_scheduler = None
+_worker_bound = None
+
+
+def _init_search_worker(scheduler, bound):
+    """工作进程初始化: 保存调度器副本 (含路网矩阵与 DAG) 与共享上界，之后的任务只传递子树前缀"""
+    global _worker_scheduler, _worker_bound
+    _worker_scheduler = scheduler
+    _worker_bound = bound
+
+
+def _search_subtree(prefix, upper_bound, deadline):
+    return _worker_scheduler._branch_and_bound(prefix, upper_bound, deadline, _worker_bound)
 
 # ---------------------------
 # Core Scheduling Logic (Ported & Adapted from v9)
@@ -28,6 +61,19 @@ class Scheduler:
         
         self.vehicles = {v['id']: {'P': float(v['power']), 'E': float(v['energy'])} for v in vehicles_data}
         
+        # 最近一次求解的搜索统计
+        self.search_stats = None
+        # 可选的取消标志 (threading.Event)，被设置后各求解器在下一次检查截止时间时提前返回当前最优解
+        self.cancel = None
+
+        # 序列评估缓存: (P, E, 任务序列) -> ('exact', 结果) 或 ('bound', upper_bound)
+        # 'bound' 表示在该 upper_bound 下不可行 (真实成本 > upper_bound 或根本不可行)
+        self._sequence_cache = OrderedDict()
+        self.sequence_cache_stats = {'hits': 0, 'boundHits': 0, 'misses': 0, 'evictions': 0}
+
+        # 任务兼容 DAG (由 tau 构建，见 build_precedence_dag)，tau 变化时重置
+        self._precedence = None
+
         # 矩阵缓存
         self.tau = {} # (from_id, to_id) -> hours
         self.polylines = {} # (from_id, to_id) -> polyline string
@@ -39,6 +85,7 @@ class Scheduler:
         for t in tasks_data:
             self.all_locations.append({'id': t['id'], 'lat': t['lat'], 'lng': t['lng']})
 
+    @metrics.timed('travel_matrix')
     def build_travel_matrix(self):
         """调用高德 API 构建 N x N 的通行时间矩阵"""
         # 并发获取所有点对的路径数据
@@ -53,306 +100,728 @@ class Scheduler:
         # 自环设为 0
         for loc in self.all_locations:
             self.tau[(loc['id'], loc['id'])] = 0.0
+        # DAG 与序列评估结果都由 tau 决定，矩阵重建后一并失效
+        self._precedence = None
+        self._sequence_cache.clear()
+        self.sequence_cache_stats = {'hits': 0, 'boundHits': 0, 'misses': 0, 'evictions': 0}
 
     def _get_travel_time(self, u, v):
         """获取两点间行驶时间 (小时)，如果 API 失败则返回无穷大"""
         return self.tau.get((u, v), 999.0)
 
+    def build_precedence_dag(self):
+        """
+        基于 tau 构建任务兼容 DAG (时间窗固定，只需构建一次):
+        - chain 边 i -> j: i 结束后直接前往 j 能按时到达，即 i、j 可以是同一趟内相邻的任务
+        - 边 i -> j: chain 边，或 i 结束后经某个车库返回再出发仍能按时到达 j，
+          即 j 可以紧接 i 由同一辆车执行 (可分属两趟)
+        只连接 _task_order 中靠前的任务到靠后的任务，因此无环；同一车辆的可行序列必然是该 DAG 中的路径
+        Returns: {'succ': {i: set(j)}, 'chain_succ': {i: set(j)}, 'chain_pred': {j: set(i)}, 'edges': 边数, 'legs': ...}
+        """
+        order = self._task_order()
+        succ = {t: set() for t in order}
+        chain_succ = {t: set() for t in order}
+        chain_pred = {t: set() for t in order}
+        # 经车库中转的最短时间: i 结束 -> 返回车库 -> 出发到 j
+        for a, i in enumerate(order):
+            r_end = self.tasks[i]['r_end']
+            back = {d: self._get_travel_time(i, d) for d in self.depots}
+            for j in order[a + 1:]:
+                r_start = self.tasks[j]['r_start']
+                if r_end + self._get_travel_time(i, j) - r_start <= 1e-5:
+                    chain_succ[i].add(j)
+                    chain_pred[j].add(i)
+                    succ[i].add(j)
+                elif any(r_end + back[d] + self._get_travel_time(d, j) - r_start <= 1e-5 for d in self.depots):
+                    succ[i].add(j)
+        self._precedence = {
+            'succ': succ, 'chain_succ': chain_succ, 'chain_pred': chain_pred,
+            'edges': sum(len(v) for v in succ.values()),
+            # 车库 <-> 任务的行驶时间 (序列评估的热点查询): {车库: ({任务: 出车}, {任务: 返回})}
+            'legs': {d: ({t: self._get_travel_time(d, t) for t in order},
+                         {t: self._get_travel_time(t, d) for t in order})
+                     for d in self.depots}
+        }
+        return self._precedence
+
+    def _dag(self):
+        if self._precedence is None:
+            self.build_precedence_dag()
+        return self._precedence
+
     def compute_sequence_metrics(self, seq, v_id, upper_bound=float('inf')):
         """
         评估某辆车执行某个任务序列的可行性和成本
         Args:
             seq: 任务ID列表
             v_id: 车辆ID
-            upper_bound: 当前已知的全局最优总时间（用于剪枝）
+            upper_bound: 该车辆允许的最大总耗时（用于剪枝，超过时视为不可行）
         Returns: (feasible, depot_used, total_time, energy_sum, max_power, timeline)
+        搜索过程应使用只计算数值的 sequence_cost，这里在其结果上构建完整 timeline
         """
-        if not seq:
-            return True, None, 0.0, 0.0, 0.0, []
-
-        m = len(seq)
-        best_overall = None 
+        ok, depot, total_time, energy_sum, max_power, trips = self.sequence_cost(seq, v_id, upper_bound)
+        if not ok:
+            return False, None, None, None, None, None
+        return True, depot, total_time, energy_sum, max_power, self.build_timeline(seq, depot, trips)
 
-        # 尝试从每一个车库出发
-        for d_id in self.depots:
-            
-            # 内部递归函数：将序列切分为多次往返 (Trip)
-            def try_from(i, current_time, current_energy, current_max_p, current_timeline):
-                # 剪枝 1: 如果当前单一车辆的累积时间已经超过了全局(所有车辆)的最优解，
-                # 虽然这里不仅是单一车辆比较，但如果单车耗时过长通常也意味着总解不好。
-                # 更严格的剪枝应该在外部循环做，这里只能做局部剪枝。
-                # 不过，如果 current_time 已经甚至超过了 upper_bound，那肯定没戏了。
-                if current_time > upper_bound:
+    def sequence_cost(self, seq, v_id, upper_bound=float('inf')):
+        """
+        compute_sequence_metrics 的数值版本 (带缓存)，不构建 timeline
+        Returns: (feasible, depot_used, total_time, energy_sum, max_power, trips)
+        trips: 每趟包含的任务区间 ((i, j), ...)，含两端，用于 build_timeline 还原
+        结果只依赖车辆能力 (P, E) 与任务序列，能力相同的车辆共享缓存 (包括不可行结论)
+        - 可行结果总是精确的 (最优成本不超过 upper_bound)
+        - upper_bound 有限时的 "不可行" 只说明成本 > upper_bound，缓存为下界，
+          之后只对不超过该值的 upper_bound 直接复用，更宽松的查询重新计算
+        """
+        veh = self.vehicles[v_id]
+        key = (veh['P'], veh['E'], tuple(seq))
+        cache = self._sequence_cache
+        stats = self.sequence_cache_stats
+        entry = cache.get(key)
+        if entry is not None:
+            kind, value = entry
+            if kind == 'exact':
+                cache.move_to_end(key)
+                stats['hits'] += 1
+                if value[0] and value[2] > upper_bound:
                     return False, None, None, None, None, None
+                return value
+            if upper_bound <= value:
+                cache.move_to_end(key)
+                stats['boundHits'] += 1
+                return False, None, None, None, None, None
+
+        stats['misses'] += 1
+        result = self._evaluate_sequence(tuple(seq), veh['P'], veh['E'], upper_bound)
+        if result[0] or upper_bound == float('inf'):
+            cache[key] = ('exact', result)
+        else:
+            cache[key] = ('bound', upper_bound)
+        cache.move_to_end(key)
+        while len(cache) > SEQUENCE_CACHE_SIZE:
+            cache.popitem(last=False)
+            stats['evictions'] += 1
+        return result
+
+    def _evaluate_sequence(self, seq, power, energy, upper_bound=float('inf')):
+        """
+        把序列切分为多次往返 (Trip: 车库 -> 连续若干任务 -> 车库) 的最优方案，只计算数值
+        每趟准时出发 (到达第一个任务时恰好开始)，因此一趟的耗时只取决于它覆盖的任务区间，
+        出发前车辆必须已经回到车库 (上一趟的返回时间只取决于上一趟的最后一个任务)。
+        于是对每个车库做区间 DP: best[i] = min_j (趟 i..j 的耗时 + best[j+1])，
+        用后继指针记录切分位置，最后由 build_timeline 还原事件
+        """
+        m = len(seq)
+        if not m:
+            return True, None, 0.0, 0.0, 0.0, ()
 
-                if i >= m:
-                    return True, current_time, current_energy, current_max_p, current_timeline, current_time
-
-                best_local = None
-
-                # 尝试构建一个 Trip，包含 seq[i] 到 seq[j]
-                for j in range(i, m):
-                    subseq = seq[i:j+1]
-                    first = subseq[0]
-                    last = subseq[-1]
-
-                    # 1. 从车库/上一次位置出发去第一个任务
-                    # 注意：如果是第一趟Trip，从 d_id 出发；
-                    # 如果是后续Trip，current_time 已经是 "返回d_id并准备好出发" 的时间了吗？
-                    # 递归设计是：try_from(..., return_time)
-                    # 所以 current_time 是上一趟回到车库的时间点。
-                    # 这一趟从 d_id 出发去 first
-                    
-                    travel_time_d_1 = self._get_travel_time(d_id, first)
-                    
-                    # 最早出发时间 & 实际出发时间
-                    earliest_depart = max(0.0, self.tasks[first]['r_start'] - travel_time_d_1)
-                    depart_time = max(current_time, earliest_depart)
-                    arrival_first = depart_time + travel_time_d_1
-                    
-                    if arrival_first - self.tasks[first]['r_start'] > 1e-5:
-                        continue 
-
-                    # 构建 Timeline 事件
-                    timeline_trip = []
-                    # ... (timeline构建逻辑同前，略微精简) ...
-                    timeline_trip.append({
-                        "type": "travel", "from": d_id, "to": first, 
-                        "start": depart_time, "end": arrival_first,
-                        "polyline": self.polylines.get((d_id, first), "")
-                    })
-
-                    if arrival_first < self.tasks[first]['r_start'] - 1e-5:
-                        timeline_trip.append({"type": "idle_task", "at": first, "start": arrival_first, "end": self.tasks[first]['r_start']})
-
-                    timeline_trip.append({"type": "work", "task": first, "start": self.tasks[first]['r_start'], "end": self.tasks[first]['r_end']})
-
-                    cur_time = self.tasks[first]['r_end']
-                    prev = first
-                    feasible_trip = True
-
-                    # 2. Trip 内部：任务间移动
-                    for nxt in subseq[1:]:
-                        travel_t = self._get_travel_time(prev, nxt)
-                        arrive = cur_time + travel_t
-                        
-                        if arrive - self.tasks[nxt]['r_start'] > 1e-5:
-                            feasible_trip = False; break
-                        
-                        timeline_trip.append({
-                            "type": "travel", "from": prev, "to": nxt, 
-                            "start": cur_time, "end": arrive,
-                            "polyline": self.polylines.get((prev, nxt), "")
-                        })
-                        
-                        if arrive < self.tasks[nxt]['r_start'] - 1e-5:
-                            timeline_trip.append({"type": "idle_task", "at": nxt, "start": arrive, "end": self.tasks[nxt]['r_start']})
-                        
-                        timeline_trip.append({"type": "work", "task": nxt, "start": self.tasks[nxt]['r_start'], "end": self.tasks[nxt]['r_end']})
-                        
-                        cur_time = self.tasks[nxt]['r_end']
-                        prev = nxt
-
-                    if not feasible_trip:
-                        continue
-
-                    # 3. 返回车库
-                    return_travel = self._get_travel_time(last, d_id)
-                    return_time = cur_time + return_travel
-                    timeline_trip.append({
-                        "type": "travel", "from": last, "to": d_id, 
-                        "start": cur_time, "end": return_time,
-                        "polyline": self.polylines.get((last, d_id), "")
-                    })
-                    
-                    # 4. 车辆能力约束校验
-                    trip_energy = sum(self.tasks[t]['p'] * self.tasks[t]['duration'] for t in subseq)
-                    trip_max_power = max(self.tasks[t]['p'] for t in subseq)
-                    veh = self.vehicles[v_id]
-                    if trip_max_power > veh['P'] + 1e-5 or trip_energy > veh['E'] + 1e-5:
-                        continue
-
-                    # 剪枝 2: 如果当前部分解已经比局部最优差，直接跳过 (假设目标是最小化单车时间)
-                    # if best_local and return_time + ... > best_local[0]: continue
-
-                    # 5. 递归
-                    # 下一趟出发前，如果在车库有等待时间，将在 merged_timeline 里处理
-                    # 递归传入新的累积值
-                    new_timeline = current_timeline + timeline_trip
-                    
-                    # 处理中间等待 (idle_depot) 会在合并时处理，这里简化逻辑：
-                    # 递归函数本身只负责计算“从 return_time 开始的后续部分”
-                    # 我们需要把 timeline 传递下去或者在回溯时合并。
-                    # 为了保持原逻辑结构，这里不传递完整 timeline，只传递时间。
-                    
-                    ok_next, tot_next, energy_next, maxp_next, timeline_next, final_return = try_from(
-                        j+1, return_time, 
-                        current_energy + trip_energy, 
-                        max(current_max_p, trip_max_power),
-                        [] # 这里的 timeline 仅仅是后续的
-                    )
-                    
-                    if not ok_next:
-                        continue
-
-                    # 合并
-                    merged = list(timeline_trip)
-                    if timeline_next:
-                        first_next = timeline_next[0]
-                        next_depart = first_next.get("start", None)
-                        if next_depart is not None and next_depart - return_time > 1e-5:
-                            merged.append({"type": "idle_depot", "at": d_id, "start": return_time, "end": next_depart})
-                    merged.extend(timeline_next)
-
-                    # 计算该方案的总时间 (last_return - initial_depart)
-                    # 注意：try_from 的 current_time 参数实际上是 "Available time at Depot"
-                    # 最外层调用时是 0.0。
-                    # 该方案的结束时间是 final_return。
-                    # 总耗时 = final_return - (timeline_trip[0]['start']) ? 
-                    # 原逻辑是 sum(trip_duration)，即累加每一趟的 (return - depart)。
-                    # 这里保持原逻辑： tot_next 已经是后续所有trip的耗时和。
-                    
-                    trip_dur = return_time - depart_time
-                    total_time_candidate = trip_dur + tot_next
-                    
-                    energy_sum_candidate = trip_energy + energy_next
-                    max_power_candidate = max(trip_max_power, maxp_next)
-
-                    if best_local is None or total_time_candidate < best_local[0]:
-                        best_local = (total_time_candidate, energy_sum_candidate, max_power_candidate, merged, final_return)
-
-                if best_local is None:
-                    return False, None, None, None, None, None
-                # 返回 cost (duration), energy, power, timeline, final_time
-                return True, best_local[0], best_local[1], best_local[2], best_local[3], best_local[4]
+        dag = self._dag()
+        # 相邻任务必须是 DAG 中的边，否则任何切分都不可行
+        if any(seq[k + 1] not in dag['succ'][seq[k]] for k in range(m - 1)):
+            return False, None, None, None, None, None
 
-            # 启动递归
-            ok, tot_time, energy_sum, max_power, timeline_list, final_return_time = try_from(0, 0.0, 0.0, 0.0, [])
-            if not ok:
+        tasks = [self.tasks[t] for t in seq]
+        r_start = [t['r_start'] for t in tasks]
+        r_end = [t['r_end'] for t in tasks]
+        chain_succ = dag['chain_succ']
+        # 电量与最大功率与切分方式无关 (每个任务恰好属于一趟)
+        work_energy = [t['p'] * t['duration'] for t in tasks]
+        # reach[i]: 从任务 i 开始的一趟最多能延伸到的下标 (趟内相邻任务是 chain 边，且功率/电量不超限)，
+        # 与车库无关；i 自身就超限时为 i - 1
+        reach = []
+        for i in range(m):
+            trip_energy = 0.0
+            j = i
+            while j < m:
+                if j > i and seq[j] not in chain_succ[seq[j - 1]]:
+                    break
+                trip_energy += work_energy[j]
+                # 功率/电量只会随趟内任务增加而增大
+                if tasks[j]['p'] > power + 1e-5 or trip_energy > energy + 1e-5:
+                    break
+                j += 1
+            if j == i:
+                return False, None, None, None, None, None
+            reach.append(j - 1)
+
+        inf = float('inf')
+        best_overall = None
+        for d_id, (out_legs, back_legs) in dag['legs'].items():
+            to_task = [out_legs[t] for t in seq]
+            # end_ret[j]: 以任务 j 结束的一趟返回车库的时间
+            end_ret = [r_end[j] + back_legs[seq[j]] for j in range(m)]
+
+            # best[i]: 从任务 i 开始 (i 之前的任务已完成并回到车库) 的最小耗时，next_end[i]: 对应的本趟结束下标
+            best = [inf] * (m + 1)
+            best[m] = 0.0
+            next_end = [0] * m
+            for i in range(m - 1, -1, -1):
+                # 出发时间: 上一趟回到车库 (第一趟为 0) 与准时出发时间中的较晚者
+                current_time = 0.0 if i == 0 else end_ret[i - 1]
+                depart_time = r_start[i] - to_task[i]
+                if depart_time < 0.0:
+                    depart_time = 0.0
+                if current_time > depart_time:
+                    depart_time = current_time
+                if depart_time + to_task[i] - r_start[i] > 1e-5:
+                    continue
+                # 趟 i..j 的耗时 = end_ret[j] - depart_time，只有 end_ret[j] + best[j+1] 随 j 变化
+                cost = inf
+                for j in range(i, reach[i] + 1):
+                    c = end_ret[j] + best[j + 1]
+                    if c < cost:
+                        cost = c
+                        next_end[i] = j
+                best[i] = cost - depart_time
+
+            if best[0] == inf:
                 continue
-            
-            # 记录对于这辆车，从哪个Depot出发最好
-            if best_overall is None or tot_time < best_overall[0]:
-                best_overall = (tot_time, energy_sum, max_power, timeline_list, d_id)
-
-        if best_overall is None:
+            if best_overall is None or best[0] < best_overall[0]:
+                trips = []
+                i = 0
+                while i < m:
+                    trips.append((i, next_end[i]))
+                    i = next_end[i] + 1
+                best_overall = (best[0], tuple(trips), d_id)
+
+        if best_overall is None or best_overall[0] > upper_bound:
             return False, None, None, None, None, None
 
-        total_time, energy_sum, max_power, timeline, depot_used = best_overall
-        return True, depot_used, total_time, energy_sum, max_power, timeline
+        total_time, trips, depot_used = best_overall
+        return True, depot_used, total_time, sum(work_energy), max(t['p'] for t in tasks), trips
+
+    def build_timeline(self, seq, depot, trips):
+        """由切分结果还原完整的 travel / idle_task / work / idle_depot 事件 (含 polyline)"""
+        timeline = []
+        current_time = 0.0
+        for i, j in trips:
+            first = seq[i]
+            travel_time_d_1 = self._get_travel_time(depot, first)
+            depart_time = max(current_time, max(0.0, self.tasks[first]['r_start'] - travel_time_d_1))
+            if timeline and depart_time - current_time > 1e-5:
+                timeline.append({"type": "idle_depot", "at": depot, "start": current_time, "end": depart_time})
+
+            prev, cur_time = depot, depart_time
+            for t in seq[i:j + 1]:
+                arrive = cur_time + self._get_travel_time(prev, t)
+                timeline.append({
+                    "type": "travel", "from": prev, "to": t,
+                    "start": cur_time, "end": arrive,
+                    "polyline": self.polylines.get((prev, t), "")
+                })
+                if arrive < self.tasks[t]['r_start'] - 1e-5:
+                    timeline.append({"type": "idle_task", "at": t, "start": arrive, "end": self.tasks[t]['r_start']})
+                timeline.append({"type": "work", "task": t, "start": self.tasks[t]['r_start'], "end": self.tasks[t]['r_end']})
+                prev, cur_time = t, self.tasks[t]['r_end']
+
+            return_time = cur_time + self._get_travel_time(prev, depot)
+            timeline.append({
+                "type": "travel", "from": prev, "to": depot,
+                "start": cur_time, "end": return_time,
+                "polyline": self.polylines.get((prev, depot), "")
+            })
+            current_time = return_time
+        return timeline
 
     def _greedy_solve(self):
         """
         贪心算法求初值：
-        1. 简单的最近邻策略或直接按顺序分配
-        2. 返回一个可行解的总时间，作为 Branch & Bound 的上限
+        1. 按时间窗开始顺序逐个插入任务，只沿 DAG 边追加到车辆序列末尾 (或分给空闲车辆)，
+           选择成本增量最小的车辆
+        2. 返回一个可行解的总时间及该解，作为 Branch & Bound 的初始上限
         """
-        task_ids = list(self.tasks.keys())
+        succ = self._dag()['succ']
         vehicle_ids = list(self.vehicles.keys())
-        
-        # 简单策略：将所有任务平均分配给车辆
-        # 仅为了快速获取一个 Upper Bound
-        import math
-        chunk_size = math.ceil(len(task_ids) / len(vehicle_ids))
-        
-        total_time = 0.0
-        feasible = True
-        
-        for i, v_id in enumerate(vehicle_ids):
-            chunk = task_ids[i*chunk_size : (i+1)*chunk_size]
-            if not chunk: continue
-            
-            # 简单的序列：按时间窗开始时间排序
-            chunk.sort(key=lambda t: self.tasks[t]['r_start'])
-            
-            ok, _, ttime, _, _, _ = self.compute_sequence_metrics(chunk, v_id)
-            if ok:
-                total_time += ttime
-            else:
-                feasible = False; break
-        
-        if feasible:
-            return total_time
-        return float('inf')
+        seqs = {v: () for v in vehicle_ids}
+        results = {v: (True, None, 0.0, 0.0, 0.0, ()) for v in vehicle_ids}
 
-    def solve(self):
+        for t in self._task_order():
+            best = None
+            for v in vehicle_ids:
+                if seqs[v] and t not in succ[seqs[v][-1]]:
+                    continue
+                res = self.sequence_cost(seqs[v] + (t,), v)
+                if res[0] and (best is None or res[2] - results[v][2] < best[0]):
+                    best = (res[2] - results[v][2], v, res)
+            if best is None:
+                return float('inf'), None
+            _, v, res = best
+            seqs[v] = seqs[v] + (t,)
+            results[v] = res
+
+        solution = {
+            v: {"seq": seqs[v], "depot": results[v][1], "time": results[v][2],
+                "energy": results[v][3], "trips": results[v][5]}
+            for v in vehicle_ids
+        }
+        return sum(results[v][2] for v in vehicle_ids), solution
+
+    def _task_order(self):
+        """任务分配顺序: 按时间窗开始 (再按结束、ID) 排序，同一车辆的任务只能按该顺序执行"""
+        return sorted(self.tasks, key=lambda t: (self.tasks[t]['r_start'], self.tasks[t]['r_end'], t))
+
+    def _task_cost_shares(self):
         """
-        主求解逻辑 (Branch & Bound 优化版)
+        把任意方案的成本分摊到任务上: 趟次准时出发，成本 = 出车 + 各任务作业 + 趟内相邻任务之间的间隔 + 返回，
+        均非负，其中相邻任务的间隔 (车辆在外行驶并等待) 是两任务时间窗之差，不少于行驶时间
+        出车/返回全部记给趟的首/末任务，间隔平均记给两端的任务，每个任务至少分到
+        arrive[t] = min(最短出车, 最短 chain 前驱间隔 / 2)，leave[t] = min(最短返回, 最短 chain 后继间隔 / 2)
+        Returns: (arrive, leave)
         """
-        task_ids = list(self.tasks.keys())
-        vehicle_ids = list(self.vehicles.keys())
-        
-        best_solution = None
-        
-        # 1. 获取初始上限 (Greedy)
-        best_total_time = self._greedy_solve()
-        logging.info(f"Greedy Initial Upper Bound: {best_total_time}")
-        
-        start_time = time.time()
-        LIMIT_SECONDS = 8.0 
-        
-        # 2. 任务分配循环
-        assignment_iter = itertools.product(range(len(vehicle_ids)), repeat=len(task_ids))
-        
-        for assign in assignment_iter:
-            if time.time() - start_time > LIMIT_SECONDS:
-                logging.warning("Scheduling timeout reached, returning best found.")
-                break
-                
-            groups = {v: [] for v in vehicle_ids}
-            for t_id, v_idx in zip(task_ids, assign):
-                groups[vehicle_ids[v_idx]].append(t_id)
+        dag = self._dag()
+        arrive, leave = {}, {}
+        for t, task in self.tasks.items():
+            arrive[t] = min([self._get_travel_time(d, t) for d in self.depots]
+                            + [(task['r_start'] - self.tasks[u]['r_end']) / 2 for u in dag['chain_pred'][t]],
+                            default=0.0)
+            leave[t] = min([self._get_travel_time(t, d) for d in self.depots]
+                           + [(self.tasks[u]['r_start'] - task['r_end']) / 2 for u in dag['chain_succ'][t]],
+                           default=0.0)
+        return arrive, leave
+
+    def _min_task_costs(self):
+        """
+        每个任务在任何方案中至少带来的成本 w_t = 作业时长 + arrive[t] + leave[t] (见 _task_cost_shares)
+        各任务的 w 之和是任意方案总成本的下界
+        """
+        arrive, leave = self._task_cost_shares()
+        return {t: self.tasks[t]['duration'] + arrive[t] + leave[t] for t in self.tasks}
 
-            perm_lists = []
-            for v in vehicle_ids:
-                if not groups[v]:
-                    perm_lists.append([()])
-                else:
-                    # 优化：如果任务数 > 5，全排列太慢，这里可以进一步限制
-                    # 比如只取按时间窗排序后的几个邻域变种
-                    perm_lists.append(list(itertools.permutations(groups[v])))
-            
-            for prod in itertools.product(*perm_lists):
-                current_total_time = 0.0
-                feasible = True
-                current_sol = {}
-                
-                # 逐个车辆计算
-                for v_id, seq in zip(vehicle_ids, prod):
-                    # 剪枝：如果当前累积时间已经超过最优解，停止计算剩余车辆
-                    if current_total_time >= best_total_time:
-                        feasible = False; break
-                    
-                    # 将剩余的时间配额传给 compute_sequence_metrics 进行内部剪枝
-                    time_budget = best_total_time - current_total_time
-                    ok, depot, ttime, energy, max_p, timeline = self.compute_sequence_metrics(seq, v_id, upper_bound=time_budget)
-                    
-                    if not ok:
-                        feasible = False; break
-                    
-                    current_total_time += ttime
-                    current_sol[v_id] = {
-                        "seq": seq, "depot": depot, "time": ttime, 
-                        "energy": energy, "timeline": timeline
-                    }
-                
-                if feasible:
-                    if current_total_time < best_total_time:
-                        best_total_time = current_total_time
-                        best_solution = current_sol
-                        logging.info(f"New Best Solution found: {best_total_time:.2f}h")
+    def _return_slack(self):
+        """
+        车辆追加后续任务时，相对当前成本 c_v 最多能省下的时间 (discount 的上限):
+        新任务另开一趟时 c_v 原样保留；接在末任务 t 所在的趟上时省去返程 (最多 max_d tau(t, d))，
+        但多出到 chain 后继 f 的间隔，其中只有 arrive[f] 已计入 f 的 w
+        slack[t] = max(0, max_d tau(t, d) - min_f (间隔(t, f) - arrive[f]))，没有 chain 后继时为 0
+        """
+        chain_succ = self._dag()['chain_succ']
+        arrive, _ = self._task_cost_shares()
+        slack = {}
+        for t, task in self.tasks.items():
+            extra = min((self.tasks[f]['r_start'] - task['r_end'] - arrive[f] for f in chain_succ[t]),
+                        default=None)
+            back = max((self._get_travel_time(t, d) for d in self.depots), default=0.0)
+            slack[t] = 0.0 if extra is None else max(0.0, back - extra)
+        return slack
+
+    def __getstate__(self):
+        # 取消标志 (线程事件) 不能传给工作进程，工作进程经由共享上界得知取消 (见 _parallel_branch_and_bound)
+        state = dict(self.__dict__)
+        state['cancel'] = None
+        return state
+
+    def expired(self, deadline=None):
+        """超过截止时间 (time.time()，None 表示不限) 或求解已被取消"""
+        return ((deadline is not None and time.time() > deadline)
+                or (self.cancel is not None and self.cancel.is_set()))
+
+    @metrics.timed('schedule_solve')
+    def solve(self, method='bnb', workers=None, time_limit=None, on_incumbent=None, iterations=None, seed=None,
+              max_trip_tasks=None):
+        """
+        主求解逻辑 (默认深度优先 Branch & Bound，method='columns' / 'alns' 时见 _solve_columns / _solve_alns)
+        - 任务按时间窗开始时间逐个分配给车辆：时间窗固定，同一车辆的任务只能按开始时间顺序执行，
+          因此每辆车的序列就是排序后的子序列，且必须是任务兼容 DAG (build_precedence_dag) 中的路径，
+          子节点只沿 DAG 边扩展，不需要枚举排列
+        - 每分配一个任务就重新评估该车辆的序列，不可行 (时间窗/功率/电量) 立即剪枝
+        - 可采纳下界: 见 _lower_bound；子节点按下界从小到大扩展 (best-first)
+        - 在时间限制内搜索完成时，结果被证明最优 (self.search_stats['optimal'])
+        - workers > 1 时子树分配到多进程并行搜索 (见 _parallel_branch_and_bound)，结果与单进程同样确定
+        - time_limit: 求解时间上限 (秒)，默认 SOLVE_LIMIT_SECONDS
+        - on_incumbent(total_time, solution): 每找到更优的解时回调 (anytime 模式)，
+          solution 不含 timeline，可用 materialize 构建；回调在求解线程中执行
+        - iterations / seed: 仅 'alns' 使用，迭代上限 (默认 DEFAULT_ITERATIONS) 与随机种子 (默认 0)
+        - max_trip_tasks: 仅 'columns' 使用，列池中单趟最多包含的任务数 (默认 MAX_TRIP_TASKS)
+        - 设置 self.cancel 后，三种求解器都在下一次检查截止时间时停止并返回当前最优解
+        """
+        if method not in SOLVERS:
+            raise ValueError(f"Unknown solver: {method}")
+        time_limit = SOLVE_LIMIT_SECONDS if time_limit is None else float(time_limit)
+        if method == 'columns':
+            return self._solve_columns(time_limit, on_incumbent, max_trip_tasks)
+        if method == 'alns':
+            return self._solve_alns(time_limit, on_incumbent, iterations, seed)
 
-        return best_solution
+        dag = self.build_precedence_dag()
 
+        # 1. 获取初始上限 (Greedy)
+        start_time = time.time()
+        best_total_time, best_solution = self._greedy_solve()
+        logging.info(f"Greedy Initial Upper Bound: {best_total_time}")
+        if best_solution and on_incumbent:
+            on_incumbent(best_total_time, best_solution)
+
+        # 2. 分支定界 (workers > 1 时按前几个任务的分配划分子树，多进程并行)
+        deadline = start_time + time_limit
+        workers = min(int(workers or 1), parallel.max_workers())
+        if workers > 1:
+            total, solution, stats = self._parallel_branch_and_bound(best_total_time, deadline, workers,
+                                                                     on_incumbent)
+        else:
+            total, solution, stats = self._branch_and_bound((), best_total_time, deadline,
+                                                            on_incumbent=on_incumbent)
+        if solution is not None:
+            best_total_time, best_solution = total, solution
+
+        if stats['optimal'] is False:
+            logging.warning("Scheduling timeout reached, returning best found.")
+        stats.update(method='bnb', dagEdges=dag['edges'])
+        stats['elapsed'] = time.time() - start_time
+        stats['bestTotalTime'] = best_total_time if best_solution else None
+        stats['sequenceCache'] = dict(self.sequence_cache_stats, entries=len(self._sequence_cache))
+        self.search_stats = stats
+        return self.materialize(best_solution)
+
+    def _branch_and_bound(self, prefix, upper_bound, deadline, bound=None, frontier_depth=None,
+                          on_incumbent=None):
+        """
+        深度优先 Branch & Bound，从前缀 prefix (前 len(prefix) 个任务依次分配给的车辆) 开始搜索
+        - upper_bound: 初始上限 (贪心解)，只记录严格更优的解
+        - bound: 可选的进程间共享上界 (parallel.SharedBound)，下界严格大于它的节点被剪枝，
+          找到更优解时写回。严格大于保证与共享上界等值的最优解不会被剪掉，
+          因此子树的结果不受其他进程的进度影响
+        - frontier_depth: 不为 None 时不求解，返回恰好分配完前 frontier_depth 个任务的全部前缀 (用于划分子树)
+        - on_incumbent: 找到更优解时的回调 (见 solve)
+        Returns: (best_total_time, best_solution 或 None, stats)；frontier_depth 模式下返回前缀列表
+        """
+        succ = self._dag()['succ']
+        order = self._task_order()
+        vehicle_ids = list(self.vehicles.keys())
+        w = self._min_task_costs()
+        slack = self._return_slack()
+        # remaining_w[k]: 第 k 个及之后任务的 w 之和
+        remaining_w = [0.0] * (len(order) + 1)
+        for k in range(len(order) - 1, -1, -1):
+            remaining_w[k] = remaining_w[k + 1] + w[order[k]]
+
+        best_total_time = upper_bound
+        best_solution = None
+        stats = {'nodes': 0, 'pruned': 0, 'optimal': True}
+        frontier = []
+
+        # 每辆车的当前状态: 序列、数值评估结果 (ok, depot, time, energy, max_p, trips)、任务 w 之和
+        # 搜索中只保存数值与切分指针，timeline 只为最终方案构建一次
+        seqs = {v: () for v in vehicle_ids}
+        results = {v: (True, None, 0.0, 0.0, 0.0, ()) for v in vehicle_ids}
+        w_sums = {v: 0.0 for v in vehicle_ids}
+        assignment = list(prefix)
+        for k, v in enumerate(prefix):
+            seqs[v] = seqs[v] + (order[k],)
+            results[v] = self.sequence_cost(seqs[v], v)
+            w_sums[v] += w[order[k]]
+
+        def discount(last, cost, w_sum):
+            """
+            车辆追加后续任务时，成本增量可能低于这些任务 w 之和的部分:
+            最多为末任务的 slack (见 _return_slack)，且车辆最终成本不低于其全部任务的 w 之和
+            """
+            if last is None:
+                return 0.0
+            return max(0.0, min(slack[last], cost - w_sum))
+
+        def lower_bound(k, costs, discounts):
+            """
+            分配完前 k 个任务后的可采纳下界:
+            sum(c_v) + sum(剩余任务 w) - 最大的 min(剩余任务数, 车辆数) 个 discount
+            """
+            n_rest = len(order) - k
+            lb = sum(costs) + remaining_w[k]
+            if n_rest:
+                lb -= sum(sorted(discounts, reverse=True)[:n_rest])
+            return lb
+
+        def pruned(lb):
+            return lb >= best_total_time - 1e-9 or (bound is not None and lb > bound.get() + 1e-9)
+
+        def dfs(k):
+            nonlocal best_total_time, best_solution
+            stats['nodes'] += 1
+            if frontier_depth is not None and k == frontier_depth:
+                frontier.append(tuple(assignment))
+                return
+            if k == len(order):
+                total = sum(results[v][2] for v in vehicle_ids)
+                if total < best_total_time - 1e-9 or best_solution is None:
+                    best_total_time = total
+                    best_solution = {
+                        v: {"seq": seqs[v], "depot": results[v][1], "time": results[v][2],
+                            "energy": results[v][3], "trips": results[v][5]}
+                        for v in vehicle_ids
+                    }
+                    if bound is not None:
+                        bound.offer(total)
+                    if on_incumbent:
+                        on_incumbent(best_total_time, best_solution)
+                    logging.info(f"New Best Solution found: {best_total_time:.2f}h")
+                return
+            if self.expired(deadline):
+                stats['optimal'] = False
+                return
+
+            t = order[k]
+            costs = {v: results[v][2] for v in vehicle_ids}
+            discounts = {v: discount(seqs[v][-1] if seqs[v] else None, costs[v], w_sums[v])
+                         for v in vehicle_ids}
+            children = []
+            tried_empty = set()
+            for v in vehicle_ids:
+                # 对称性: 能力相同的空闲车辆是等价的，只展开第一辆
+                if not seqs[v]:
+                    capability = (self.vehicles[v]['P'], self.vehicles[v]['E'])
+                    if capability in tried_empty:
+                        continue
+                    tried_empty.add(capability)
+                elif t not in succ[seqs[v][-1]]:
+                    # 只沿 DAG 边追加任务
+                    continue
+                res = self.sequence_cost(seqs[v] + (t,), v)
+                if not res[0]:
+                    continue
+                child_costs = [res[2] if u == v else costs[u] for u in vehicle_ids]
+                child_discount = discount(t, res[2], w_sums[v] + w[t])
+                child_discounts = [child_discount if u == v else discounts[u] for u in vehicle_ids]
+                lb = lower_bound(k + 1, child_costs, child_discounts)
+                if pruned(lb):
+                    stats['pruned'] += 1
+                    continue
+                children.append((lb, len(children), v, res))
+
+            # best-first: 下界小的子节点先展开
+            children.sort(key=lambda c: (c[0], c[1]))
+            for lb, _, v, res in children:
+                if pruned(lb):
+                    stats['pruned'] += 1
+                    continue
+                saved = (seqs[v], results[v], w_sums[v])
+                seqs[v] = seqs[v] + (t,)
+                results[v] = res
+                w_sums[v] += w[t]
+                assignment.append(v)
+                dfs(k + 1)
+                assignment.pop()
+                seqs[v], results[v], w_sums[v] = saved
+
+        dfs(len(prefix))
+        if frontier_depth is not None:
+            return frontier
+        return best_total_time, best_solution, stats
+
+    def _parallel_branch_and_bound(self, upper_bound, deadline, workers, on_incumbent=None):
+        """
+        多进程 Branch & Bound:
+        1. 按前 d 个任务分配给哪辆车划分子树，d 取使子树数不少于 workers * SUBTREES_PER_WORKER 的最小深度
+        2. 子树按串行搜索的展开顺序提交到进程池，各进程通过共享内存中的上界 (SharedBound) 互相剪枝
+        3. 合并时取成本最小的解，成本相同 (1e-9 内) 取序号最小的子树
+        剪枝只针对下界严格大于共享上界的节点，每个子树总能找到自己在深度优先顺序中第一个最优解，
+        因此在时间限制内完成时，结果与进程数和调度时序无关 (确定性)
+        on_incumbent 在主进程中按子树完成的先后回调 (只影响中间结果，不影响最终合并)
+        Returns: (best_total_time, best_solution 或 None, stats)
+        """
+        frontier = [()]
+        for depth in range(1, len(self.tasks) + 1):
+            frontier = self._branch_and_bound((), upper_bound, deadline, frontier_depth=depth)
+            if len(frontier) >= workers * SUBTREES_PER_WORKER:
+                break
+        # 划分子树时已超时或被取消: 前缀列表可能不完整，不能再声明最优
+        stats = {'nodes': 0, 'pruned': 0, 'optimal': not self.expired(deadline), 'workers': workers,
+                 'subtrees': len(frontier)}
+        if not frontier:
+            return upper_bound, None, stats
+
+        with parallel.SharedBound(upper_bound) as bound:
+            with ProcessPoolExecutor(max_workers=min(workers, len(frontier)), initializer=_init_search_worker,
+                                     initargs=(self, bound)) as pool:
+                futures = [pool.submit(_search_subtree, prefix, upper_bound, deadline) for prefix in frontier]
+                streamed = upper_bound
+                pending = set(futures)
+                cancelled = False
+                while pending:
+                    done, pending = wait(pending, timeout=CANCEL_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                    if not cancelled and self.expired():
+                        # 取消: 把共享上界降到 -inf，工作进程在下一个节点把剩余子树全部剪掉
+                        bound.offer(float('-inf'))
+                        cancelled = True
+                    for future in done:
+                        total, solution, _ = future.result()
+                        if on_incumbent and solution is not None and total < streamed - 1e-9:
+                            streamed = total
+                            on_incumbent(total, solution)
+                outcomes = [f.result() for f in futures]
+                if cancelled:
+                    stats['optimal'] = False
+
+        best_total_time, best_solution = upper_bound, None
+        for total, solution, sub_stats in outcomes:
+            stats['nodes'] += sub_stats['nodes']
+            stats['pruned'] += sub_stats['pruned']
+            stats['optimal'] = stats['optimal'] and sub_stats['optimal']
+            if solution is not None and (best_solution is None or total < best_total_time - 1e-9):
+                best_total_time, best_solution = total, solution
+        return best_total_time, best_solution, stats
+
+    def _solve_columns(self, time_limit=SOLVE_LIMIT_SECONDS, on_incumbent=None, max_trip_tasks=None):
+        """
+        趟次列池 + 集合划分局部搜索 (近似，不保证最优):
+        1. 每个车库把所有不超过 max_trip_tasks 个任务的可行趟次生成一次 (TripPool)，
+           后续只在列上组合，不再重复切分序列；更长的趟次只能来自初始解
+           列池生成最多占用时间上限的 POOL_TIME_SHARE，超时截断 (poolTruncated)
+        2. 以贪心解的趟次 (及其车辆装配) 为初始划分，在剩余时间内逐列尝试换入改进 (set_partition_search)
+        3. 每辆车的趟次按时间拼接为任务序列，用 sequence_cost 重新评估得到精确成本
+        """
+        start_time = time.time()
+        deadline = start_time + time_limit
+        dag = self.build_precedence_dag()
+        max_trip_tasks = MAX_TRIP_TASKS if max_trip_tasks is None else int(max_trip_tasks)
+        greedy_total, greedy = self._greedy_solve()
+        with metrics.phase('trip_pool'):
+            pool = TripPool(self, max_tasks=max_trip_tasks, deadline=start_time + time_limit * POOL_TIME_SHARE)
+
+        initial_plan = None
+        if greedy:
+            initial_plan = {v: [pool.trip(info['depot'], info['seq'][i:j + 1]) for i, j in info['trips']]
+                            for v, info in greedy.items() if info['seq']}
+            initial = [trip for trips in initial_plan.values() for trip in trips]
+        else:
+            # 贪心失败时逐个任务构造: 取能与已选趟次一起装配的最便宜单任务趟次
+            initial = []
+            for t in self._task_order():
+                singles = sorted((c for c in pool.by_task[t] if len(c.tasks) == 1), key=lambda c: c.cost)
+                trip = next((c for c in singles if pack(self, initial + [c]) is not None), None)
+                if trip is None:
+                    initial = None
+                    break
+                initial.append(trip)
+
+        def on_plan(plan):
+            solution = self._plan_solution(plan)
+            if solution:
+                on_incumbent(sum(info['time'] for info in solution.values()), solution)
+
+        plan, search = (None, {'moves': 0, 'passes': 0, 'converged': False}) if initial is None else \
+            set_partition_search(self, pool, initial, deadline, on_plan if on_incumbent else None, initial_plan)
+        solution = self._plan_solution(plan)
+
+        self.search_stats = dict(
+            search, method='columns', optimal=False, dagEdges=dag['edges'],
+            columns=len(pool.columns), poolTruncated=pool.truncated, maxTripTasks=pool.max_tasks,
+            greedyTotalTime=greedy_total if greedy else None,
+            elapsed=time.time() - start_time,
+            bestTotalTime=sum(info['time'] for info in solution.values()) if solution else None,
+            sequenceCache=dict(self.sequence_cache_stats, entries=len(self._sequence_cache)))
+        return self.materialize(solution)
+
+    def _solve_alns(self, time_limit=SOLVE_LIMIT_SECONDS, on_incumbent=None, iterations=None, seed=None):
+        """自适应大邻域搜索 (近似，适合任务数较多的实例，见 backend/alns.py)"""
+        start_time = time.time()
+        dag = self.build_precedence_dag()
+        search = ALNS(self, seed=0 if seed is None else seed,
+                      max_iterations=DEFAULT_ITERATIONS if iterations is None else iterations,
+                      deadline=start_time + time_limit, on_incumbent=on_incumbent)
+        total, solution, stats = search.run()
+        self.search_stats = dict(
+            stats, method='alns', optimal=False, dagEdges=dag['edges'],
+            elapsed=time.time() - start_time,
+            bestTotalTime=total if solution else None,
+            sequenceCache=dict(self.sequence_cache_stats, entries=len(self._sequence_cache)))
+        return self.materialize(solution)
+
+    def _plan_solution(self, plan):
+        """把装配方案 {车辆ID: [Trip, ...]} 转为解: 各车辆的趟次按时间拼接后用 sequence_cost 精确评估"""
+        if plan is None:
+            return None
+        solution = {}
+        for v in self.vehicles:
+            seq = tuple(t for trip in plan.get(v, ()) for t in trip.tasks)
+            ok, depot, ttime, energy, _, trips = self.sequence_cost(seq, v)
+            if not ok:
+                return None
+            solution[v] = {"seq": seq, "depot": depot, "time": ttime, "energy": energy, "trips": trips}
+        return solution
 
-def run_schedule(data):
+    @metrics.timed('schedule_timeline')
+    def materialize(self, solution):
+        """为方案构建各车辆的 timeline (travel/idle/work 事件与 polyline)，返回新的方案字典"""
+        if not solution:
+            return solution
+        return {
+            v: dict({k: val for k, val in info.items() if k != 'trips'},
+                    timeline=self.build_timeline(info['seq'], info['depot'], info['trips']))
+            for v, info in solution.items()
+        }
+
+
+def format_routes(solution):
+    """把 (已构建 timeline 的) 方案格式化为前端渲染用的 routes 列表"""
+    routes_output = []
+    for v_id, info in solution.items():
+        # 提取用于画线的完整坐标点
+        full_path = []
+        timeline = info['timeline']
+
+        for event in timeline:
+            if event['type'] == 'travel':
+                poly_str = event.get('polyline', '')
+                if poly_str:
+                    # 高德 polyline 格式: "lng,lat;lng,lat"
+                    coords_str = poly_str.split(';')
+                    for c in coords_str:
+                        if ',' in c:
+                            lng, lat = map(float, c.split(','))
+                            full_path.append([lng, lat])
+
+        routes_output.append({
+            "vehicle_id": v_id,
+            "depot": info['depot'],
+            "tasks": info['seq'],
+            "timeline": timeline,
+            "path": full_path, # [[lng,lat], ...]
+            "stats": {
+                "total_time": info['time'],
+                "total_energy": info['energy']
+            }
+        })
+    return routes_output
+
+
+def _is_positive_int(value):
+    """请求参数是否为正整数 (JSON 中的 true/false 不算)"""
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 1
+
+
+def run_schedule(data, on_incumbent=None, cancel=None):
     """
     API 入口函数
-    data = { "tasks": [], "vehicles": [], "depots": [] }
+    data = { "tasks": [], "vehicles": [], "depots": [], "solver": "bnb" | "columns" | "alns" (可选), "workers": 进程数 (可选),
+             "timeLimit": 求解时间上限秒数 (可选，默认 SOLVE_LIMIT_SECONDS),
+             "iterations": ALNS 迭代上限 (可选), "seed": ALNS 随机种子 (可选),
+             "maxTripTasks": 列池单趟最多任务数 (可选，默认 MAX_TRIP_TASKS) }
+    参数在调用高德 API 构建矩阵之前校验
+    on_incumbent(event): 可选，每找到更优的解时回调 {"objective", "elapsed", "routes"} (anytime 模式)
+    cancel: 可选的 threading.Event，被设置后求解提前结束 (如流式请求的客户端已断开)
     """
     try:
+        time_limit = data.get('timeLimit', SOLVE_LIMIT_SECONDS)
+        if (isinstance(time_limit, bool) or not isinstance(time_limit, (int, float))
+                or not 0 < time_limit <= MAX_SOLVE_LIMIT_SECONDS):
+            return {"status": "error", "message": f"timeLimit 必须在 (0, {MAX_SOLVE_LIMIT_SECONDS:g}] 秒之间"}
+        time_limit = float(time_limit)
+        iterations = data.get('iterations')
+        if iterations is not None and not _is_positive_int(iterations):
+            return {"status": "error", "message": "iterations 必须是正整数"}
+        solver = data.get('solver', 'bnb')
+        if solver not in SOLVERS:
+            return {"status": "error", "message": f"solver 必须是 {' / '.join(SOLVERS)} 之一"}
+        workers = data.get('workers')
+        if workers is not None and not _is_positive_int(workers):
+            return {"status": "error", "message": "workers 必须是正整数"}
+        max_trip_tasks = data.get('maxTripTasks')
+        if max_trip_tasks is not None and not _is_positive_int(max_trip_tasks):
+            return {"status": "error", "message": "maxTripTasks 必须是正整数"}
+
         # 1. 初始化调度器
         scheduler = Scheduler(data['depots'], data['tasks'], data['vehicles'])
+        scheduler.cancel = cancel
         
         # 2. 构建路网矩阵 (高耗时操作，已并发优化)
         logging.info("Building travel matrix via Gaode API...")
@@ -360,43 +829,24 @@ def run_schedule(data):
         
         # 3. 运行算法
         logging.info("Solving schedule...")
-        solution = scheduler.solve()
+        incumbent_callback = None
+        if on_incumbent:
+            solve_start = time.time()
+
+            def incumbent_callback(total_time, solution):
+                on_incumbent({"objective": total_time, "elapsed": time.time() - solve_start,
+                              "routes": format_routes(scheduler.materialize(solution))})
+
+        solution = scheduler.solve(solver, workers=workers,
+                                   time_limit=time_limit, on_incumbent=incumbent_callback,
+                                   iterations=iterations, seed=data.get('seed'), max_trip_tasks=max_trip_tasks)
         
         if not solution:
             return {"status": "error", "message": "无法找到满足所有时间窗和电量约束的调度方案。请尝试增加车辆或调整任务时间。"}
         
         # 4. 格式化输出供前端渲染
-        routes_output = []
-        for v_id, info in solution.items():
-            # 提取用于画线的完整坐标点
-            full_path = []
-            timeline = info['timeline']
-            
-            for event in timeline:
-                if event['type'] == 'travel':
-                    poly_str = event.get('polyline', '')
-                    if poly_str:
-                        # 高德 polyline 格式: "lng,lat;lng,lat"
-                        coords_str = poly_str.split(';')
-                        for c in coords_str:
-                            if ',' in c:
-                                lng, lat = map(float, c.split(','))
-                                full_path.append([lng, lat])
-            
-            routes_output.append({
-                "vehicle_id": v_id,
-                "depot": info['depot'],
-                "tasks": info['seq'],
-                "timeline": timeline,
-                "path": full_path, # [[lng,lat], ...]
-                "stats": {
-                    "total_time": info['time'],
-                    "total_energy": info['energy']
-                }
-            })
-            
-        return {"status": "success", "routes": routes_output}
+        return {"status": "success", "routes": format_routes(solution), "search": scheduler.search_stats}
 
     except Exception as e:
         logging.exception("Scheduling failed")
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        return {"status": "error", "message": str(e)}
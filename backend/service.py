@@ -5,11 +5,16 @@ import time
 # 石家庄中心坐标
 CITY_CENTER = [114.5149, 38.0428]
 
-def get_outage_heatmap():
+# 模拟热力点数量的上限，防止单次请求生成过多数据
+MAX_SIMULATED_POINTS = 500000
+
+def get_outage_heatmap(point_count=120):
     """
     模拟获取断电概率热力图数据
     (从原前端 MockApiService 移植)
+    :param point_count: 模拟的断电事件数量，默认 120
     """
+    point_count = max(0, min(int(point_count), MAX_SIMULATED_POINTS))
     # 模拟网络延迟
     time.sleep(0.2)
     
@@ -21,7 +26,7 @@ def get_outage_heatmap():
         {'x': 0.02, 'y': -0.08}
     ]
 
-    for _ in range(120):
+    for _ in range(point_count):
         # 围绕几个中心点随机分布
         center = random.choice(centers)
         lng = CITY_CENTER[0] + center['x'] + (random.random() - 0.5) * 0.1
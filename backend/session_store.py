@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import OrderedDict
+from backend.algorithm import DispatchAlgorithm
+
+# 默认会话 ID (未携带会话标识的请求共享该会话)
+DEFAULT_SESSION_ID = 'default'
+# 同时保留的会话数量上限与空闲过期时间 (秒)
+MAX_SESSIONS = 256
+SESSION_TTL_SECONDS = 3600
+
+
+class AlgorithmSession:
+    """
+    单个会话的调度状态
+    algorithm 持有该会话的断电/支援网格；lock 保证同一会话内 "映射 -> 计算 -> 导出" 的读改写序列不被并发请求打断
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.algorithm = DispatchAlgorithm()
+        self.lock = threading.RLock()
+        self.last_access = time.time()
+
+
+class SessionStore:
+    """
+    会话注册表 (LRU + 空闲过期)，替代原先的全局 dispatch_algorithm 单例
+    不同会话之间互不影响，可以在多线程 Flask 中并行处理
+    注意: 会话状态保存在当前进程内，多进程部署时需要按会话粘性路由，
+    或者在请求中直接携带断电数据 (无状态请求，见 app.py)
+    """
+
+    def __init__(self, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id=None):
+        session_id = session_id or DEFAULT_SESSION_ID
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = AlgorithmSession(session_id)
+                self._sessions[session_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_access = now
+            return session
+
+    def _expire(self, now):
+        # OrderedDict 按最近访问排序，从最旧的开始清理
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_access <= self.ttl:
+                break
+            del self._sessions[session_id]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+# 全局会话注册表 (进程级)
+session_store = SessionStore()
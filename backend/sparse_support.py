@@ -0,0 +1,246 @@
+import math
+import numpy as np
+
+# 稀疏路径中单块处理的最大非零元数量
+SPARSE_CHUNK_NNZ = 4_000_000
+
+
+def truncation_radius(epsilon=None, radius_km=None):
+    """
+    将截断参数统一为 (epsilon, radius_km)
+    支援模型 exp(-dist) < epsilon 等价于 dist > -ln(epsilon)
+    两者都未给出时返回 None，表示使用稠密模型
+    """
+    if radius_km is not None:
+        radius_km = float(radius_km)
+        if radius_km <= 0:
+            raise ValueError('radius_km must be positive')
+        return math.exp(-radius_km), radius_km
+    if epsilon is not None:
+        epsilon = float(epsilon)
+        if not 0 < epsilon < 1:
+            raise ValueError('epsilon must be in (0, 1)')
+        return epsilon, -math.log(epsilon)
+    return None
+
+
+class SparseDecay:
+    """
+    CSR 形式的衰减矩阵: 第 k 行是第 k 个停车点的截断足迹
+    indices 为网格下标 (int32, 行内升序)，data 为 exp(-dist) (float32)
+    """
+
+    def __init__(self, rows, n_cols):
+        self.n_cols = n_cols
+        lengths = np.array([len(idx) for idx, _ in rows], dtype=np.int64)
+        self.indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.indptr[1:])
+        if rows:
+            self.indices = np.concatenate([idx for idx, _ in rows])
+            self.data = np.concatenate([val for _, val in rows])
+        else:
+            self.indices = np.zeros(0, dtype=np.int32)
+            self.data = np.zeros(0, dtype=np.float32)
+        # 与当前状态无关的逐行统计量: sum(f), sum(f ** 2)
+        self.row_sum = self.row_dot(None)
+        self.row_sq_sum = self._reduce_rows(self.data.astype(float) ** 2)
+
+    @property
+    def n_rows(self):
+        return self.indptr.size - 1
+
+    @property
+    def nnz(self):
+        return int(self.indptr[-1])
+
+    def row(self, k):
+        lo, hi = self.indptr[k], self.indptr[k + 1]
+        return self.indices[lo:hi], self.data[lo:hi]
+
+    def _reduce_rows(self, values):
+        """按行求和 (空行为 0)"""
+        out = np.zeros(self.n_rows)
+        counts = np.diff(self.indptr)
+        rows = np.nonzero(counts)[0]
+        if rows.size:
+            out[rows] = np.add.reduceat(values, self.indptr[rows])
+        return out
+
+    def row_dot(self, vec):
+        """每一行与稠密向量的点积 sum(f * vec[idx])，vec 为 None 时即行和"""
+        values = self.data.astype(float)
+        if vec is not None:
+            values *= vec[self.indices]
+        return self._reduce_rows(values)
+
+    def row_chunks(self, max_nnz=SPARSE_CHUNK_NNZ):
+        """按非零元数量切分行区间，控制单块临时内存"""
+        start = 0
+        while start < self.n_rows:
+            limit = self.indptr[start] + max_nnz
+            stop = int(np.searchsorted(self.indptr, limit, side='right')) - 1
+            stop = min(max(stop, start + 1), self.n_rows)
+            yield start, stop
+            start = stop
+
+
+def _loss_from_stats(o2, o_sum, n, s1, s2, so, mn, mx):
+    """
+    由充分统计量计算 sum((o - (t - mn) / rng) ** 2)
+    s1 = sum(t), s2 = sum(t ** 2), so = sum(o * t)
+    """
+    rng = np.where(mx != mn, mx - mn, 1)
+    st2 = s2 - 2 * mn * s1 + n * mn ** 2
+    sot = so - mn * o_sum
+    return o2 - 2 * sot / rng + st2 / rng ** 2
+
+
+def candidate_losses(outage, base_support, decay, load, outage_dot=None):
+    """
+    稀疏版批量候选评估：每个候选点只改动其足迹内的网格，
+    因此总损失可以由基准状态的统计量加上足迹内的增量在 O(nnz) 内得到
+    outage: 归一化后的断电概率 (网格数,)
+    base_support: 当前累积支援值 (未归一化, 网格数,)
+    decay: SparseDecay
+    outage_dot: 可选的 decay.row_dot(outage)，同一次优化中 outage 不变，可预先计算复用
+    Returns: 每个候选点对应的总损失 (候选点数,)
+    """
+    n = base_support.size
+    load = np.float64(load)
+    if outage_dot is None:
+        outage_dot = decay.row_dot(outage)
+    # 平移到以当前最小值为零点，减少充分统计量中的舍入抵消
+    shift = base_support.min()
+    base = base_support - shift
+    o_sum = outage.sum()
+    o2 = np.dot(outage, outage)
+
+    s1, s2, so = base.sum(), np.dot(base, base), np.dot(outage, base)
+    mn, mx = 0.0, base.max()
+    n_at_min = int(np.count_nonzero(base == mn))
+    max_row_nnz = int(np.diff(decay.indptr).max()) if decay.n_rows else 0
+
+    # 足迹内的增量: t = old + L * f
+    # sum(t) 与 sum(o * t) 的增量只依赖逐行预计算量; sum(t ** 2) 额外需要 sum(old * f)
+    d_s1 = load * decay.row_sum
+    d_so = load * outage_dot
+    d_s2 = load * load * decay.row_sq_sum
+    touched_max = np.full(decay.n_rows, -np.inf)
+    touched_min = np.full(decay.n_rows, np.inf)
+    untouched_min = np.full(decay.n_rows, mn)
+
+    for start, stop in decay.row_chunks():
+        lo, hi = decay.indptr[start], decay.indptr[stop]
+        if lo == hi:
+            continue
+        idx = decay.indices[lo:hi]
+        old = base[idx]
+        new = load * decay.data[lo:hi]
+        cross = old * new
+        new += old
+
+        # reduceat 只对非空行取起点，空行保持基准状态
+        counts = np.diff(decay.indptr[start:stop + 1])
+        rows = np.nonzero(counts)[0] + start
+        seg = decay.indptr[rows] - lo
+
+        d_s2[rows] += 2 * np.add.reduceat(cross, seg)
+        touched_max[rows] = np.maximum.reduceat(new, seg)
+        touched_min[rows] = np.minimum.reduceat(new, seg)
+
+        # 贡献非负: 最大值只可能来自足迹内；足迹外的最小值仍是 mn，
+        # 除非所有取到最小值的网格都落在足迹内，此时单独计算足迹外的最小值
+        if n_at_min > max_row_nnz:
+            continue
+        touched_at_min = np.add.reduceat((old == mn).astype(np.int64), seg)
+        for k in np.nonzero(touched_at_min >= n_at_min)[0]:
+            row_idx, _ = decay.row(rows[k])
+            if row_idx.size >= n:
+                untouched_min[rows[k]] = np.inf
+            else:
+                mask = np.ones(n, dtype=bool)
+                mask[row_idx] = False
+                untouched_min[rows[k]] = base[mask].min()
+
+    return _loss_from_stats(
+        o2, o_sum, n,
+        s1 + d_s1, s2 + d_s2, so + d_so,
+        np.minimum(untouched_min, touched_min),
+        np.maximum(mx, touched_max)
+    )
+
+
+def swap_losses(outage, base_support, decay, spot, others, coefs, outage_dot=None):
+    """
+    稀疏版交换试算: 第 k 个候选的支援值为 t = base + coefs[k] * (f[others[k]] - f[spot])
+    只改动两个足迹的并集，sum(t) / sum(o * t) 的增量来自逐行预计算量，
+    sum(t ** 2) 与并集内的 min/max 在 O(nnz) 内得到
+    贡献可能为负，并集外的 min/max 从基准状态最大/最小的若干网格中排除并集后取第一个
+    Returns: 每个候选交换对应的总损失 (候选数,)
+    """
+    n = base_support.size
+    if outage_dot is None:
+        outage_dot = decay.row_dot(outage)
+    shift = base_support.min()
+    base = base_support - shift
+    o_sum = outage.sum()
+    o2 = np.dot(outage, outage)
+    s1, s2, so = base.sum(), np.dot(base, base), np.dot(outage, base)
+
+    idx_a, val_a = decay.row(spot)
+    val_a = val_a.astype(float)
+    in_a = np.zeros(n, dtype=bool)
+    in_a[idx_a] = True
+    # 并集不超过 |足迹 a| + 最大足迹，多取一个保证并集外的极值一定在其中
+    max_row_nnz = int(np.diff(decay.indptr).max()) if decay.n_rows else 0
+    m = min(n, idx_a.size + max_row_nnz + 1)
+    top = np.argpartition(-base, m - 1)[:m]
+    top = top[np.argsort(-base[top], kind='stable')]
+    bottom = np.argpartition(base, m - 1)[:m]
+    bottom = bottom[np.argsort(base[bottom], kind='stable')]
+
+    count = len(others)
+    d_s1 = np.empty(count)
+    d_s2 = np.empty(count)
+    d_so = np.empty(count)
+    mn = np.empty(count)
+    mx = np.empty(count)
+    scratch = np.zeros(n)
+    in_union = in_a.copy()
+    for k, (other, c) in enumerate(zip(others, coefs)):
+        idx_b, val_b = decay.row(other)
+        union = np.concatenate([idx_a, idx_b[~in_a[idx_b]]])
+        scratch[idx_a] -= c * val_a
+        scratch[idx_b] += c * val_b
+        old = base[union]
+        new = old + scratch[union]
+        scratch[union] = 0.0
+
+        in_union[idx_b] = True
+        rest_top = top[~in_union[top]]
+        rest_bottom = bottom[~in_union[bottom]]
+        in_union[idx_b] = in_a[idx_b]
+
+        d_s1[k] = c * (decay.row_sum[other] - decay.row_sum[spot])
+        d_so[k] = c * (outage_dot[other] - outage_dot[spot])
+        d_s2[k] = np.dot(new, new) - np.dot(old, old)
+        mx[k] = max(new.max() if new.size else -np.inf, base[rest_top[0]] if rest_top.size else -np.inf)
+        mn[k] = min(new.min() if new.size else np.inf, base[rest_bottom[0]] if rest_bottom.size else np.inf)
+
+    return _loss_from_stats(o2, o_sum, n, s1 + d_s1, s2 + d_s2, so + d_so, mn, mx)
+
+
+def error_bound(total_load, epsilon, support):
+    """
+    截断误差上界：每辆车在每个网格上被丢弃的贡献都小于 load * epsilon，
+    因此未归一化支援值的逐网格误差不超过 epsilon * sum(load)
+    relativeToRange 为该上界相对支援值跨度的比例，近似归一化后的误差
+    """
+    max_abs = float(epsilon * total_load)
+    spread = float(support.max() - support.min()) if support.size else 0.0
+    return {
+        'epsilon': float(epsilon),
+        'radiusKm': float(-math.log(epsilon)),
+        'maxAbsError': max_abs,
+        'relativeToRange': max_abs / spread if spread > 0 else None
+    }
@@ -0,0 +1,120 @@
+import math
+from collections import OrderedDict
+import numpy as np
+
+# 该缩放级别及以上返回原始分辨率网格，每低一级池化倍数翻倍
+TILE_DETAIL_ZOOM = 14
+# 每个瓦片包含的 (池化后) 网格数: TILE_CELLS x TILE_CELLS
+TILE_CELLS = 16
+# 每个会话缓存的瓦片数量上限
+MAX_CACHED_TILES = 1024
+# 与 get_*_heat_points 一致: 过滤掉太小的值
+MIN_VALUE = 0.001
+
+
+def pool_max(values, factor):
+    """
+    对 (res, res) 网格做 factor x factor 的最大值池化，保证低缩放级别下高风险区域不被平均掉
+    边缘不足一块的部分按 0 补齐 (归一化值非负)
+    """
+    if factor == 1:
+        return values
+    res = values.shape[0]
+    size = int(math.ceil(res / factor)) * factor
+    padded = np.zeros((size, size))
+    padded[:res, :res] = values
+    return padded.reshape(size // factor, factor, size // factor, factor).max(axis=(1, 3))
+
+
+class TileCache:
+    """
+    单个会话的视口瓦片缓存
+    - 池化金字塔按 (图层, 状态版本) 构建，只保留每个图层最新版本
+    - 瓦片热力点按 (图层, 状态版本, 层级, 瓦片行列) 缓存 (LRU)，状态版本变化后旧条目自然失效
+    """
+
+    def __init__(self, max_tiles=MAX_CACHED_TILES):
+        self.max_tiles = max_tiles
+        self._pyramids = {}
+        self._tiles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def level_for_zoom(zoom, resolution):
+        """缩放级别 -> 金字塔层级 (池化倍数 2^level)，不超过把网格池化到单个网格所需的层级"""
+        max_level = max(0, int(math.ceil(math.log2(resolution)))) if resolution > 1 else 0
+        return min(max(0, TILE_DETAIL_ZOOM - int(zoom)), max_level)
+
+    def _pyramid(self, layer, version, values, resolution, level):
+        cached = self._pyramids.get(layer)
+        if cached is None or cached[0] != version:
+            cached = (version, {0: values.reshape(resolution, resolution)})
+            self._pyramids[layer] = cached
+        levels = cached[1]
+        if level not in levels:
+            # 从已有的最接近的更细层级逐级池化
+            base = max(l for l in levels if l < level)
+            levels[level] = pool_max(levels[base], 2 ** (level - base))
+        return levels[level]
+
+    def _tile_points(self, grid, geometry, factor, ti, tj):
+        i0, j0 = ti * TILE_CELLS, tj * TILE_CELLS
+        block = grid[i0:i0 + TILE_CELLS, j0:j0 + TILE_CELLS]
+        ii, jj = np.nonzero(block > MIN_VALUE)
+        # 池化网格的坐标取其覆盖的原始网格块的中心
+        offset = (factor - 1) / 2
+        lng = geometry.lng_axis[0] + ((i0 + ii) * factor + offset) * geometry.step
+        lat = geometry.lat_axis[0] + ((j0 + jj) * factor + offset) * geometry.step
+        return [
+            {'lng': x, 'lat': y, 'count': c}
+            for x, y, c in zip(lng.tolist(), lat.tolist(), (block[ii, jj] * 100).tolist())
+        ]
+
+    def query(self, layer, version, values, geometry, bbox, zoom):
+        """
+        返回视口 bbox = (min_lng, min_lat, max_lng, max_lat) 覆盖的瓦片热力点
+        """
+        resolution = geometry.resolution
+        level = self.level_for_zoom(zoom, resolution)
+        factor = 2 ** level
+        grid = self._pyramid(layer, version, values, resolution, level)
+        pooled_step = geometry.step * factor
+
+        # 视口 -> 池化网格下标范围 -> 瓦片范围
+        min_lng, min_lat, max_lng, max_lat = bbox
+        n = grid.shape[0]
+        i_lo = max(0, int(math.floor((min_lng - geometry.lng_axis[0]) / pooled_step)))
+        i_hi = min(n - 1, int(math.floor((max_lng - geometry.lng_axis[0]) / pooled_step)))
+        j_lo = max(0, int(math.floor((min_lat - geometry.lat_axis[0]) / pooled_step)))
+        j_hi = min(n - 1, int(math.floor((max_lat - geometry.lat_axis[0]) / pooled_step)))
+
+        tiles = []
+        points = []
+        if i_lo <= i_hi and j_lo <= j_hi:
+            for ti in range(i_lo // TILE_CELLS, i_hi // TILE_CELLS + 1):
+                for tj in range(j_lo // TILE_CELLS, j_hi // TILE_CELLS + 1):
+                    key = (layer, version, level, ti, tj)
+                    tile = self._tiles.get(key)
+                    if tile is None:
+                        self.misses += 1
+                        tile = self._tile_points(grid, geometry, factor, ti, tj)
+                        self._tiles[key] = tile
+                        while len(self._tiles) > self.max_tiles:
+                            self._tiles.popitem(last=False)
+                    else:
+                        self.hits += 1
+                        self._tiles.move_to_end(key)
+                    tiles.append([ti, tj])
+                    points.extend(tile)
+
+        return {
+            'layer': layer,
+            'version': version,
+            'zoom': zoom,
+            'level': level,
+            'poolFactor': factor,
+            'tileCells': TILE_CELLS,
+            'tiles': tiles,
+            'points': points
+        }
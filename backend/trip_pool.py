@@ -0,0 +1,227 @@
+from collections import namedtuple
+
+# 单趟最多包含的任务数的默认值 (列池按趟内任务数呈组合增长)，更长的趟次不会进入列池
+MAX_TRIP_TASKS = 4
+# 列池条目上限，超过时停止生成 (TripPool.truncated = True)
+# 每列 (含趟次缓存) 约 400-450 B，5 万列约占 20 MB (40 个任务 / 3 个车库 / 24 小时的合成实例完整列池约 8.7 万列)
+MAX_POOL_COLUMNS = 50000
+# 单次装配 (趟次 -> 车辆) 回溯搜索的节点上限
+PACK_NODE_LIMIT = 2000
+
+# 一趟往返 (车库 -> 连续若干任务 -> 车库)，准时出发
+# lead: 车库到第一个任务的行驶时间; r_start: 第一个任务的开始时间
+# depart: 最早 (准时) 出发时间; ret: 返回车库时间; cost = ret - depart
+Trip = namedtuple('Trip', 'depot tasks cost energy max_p lead r_start depart ret')
+
+
+class TripPool:
+    """
+    可行趟次的列池: 每个车库把所有可行趟次 (沿 chain 边的任务路径，满足时间窗、
+    车队中最大的功率 P 与电量 E) 生成一次，按任务建立索引
+    趟次本身与车辆无关，某辆车能否执行只取决于 max_p / energy 是否不超过其 P / E
+    max_tasks: 单趟最多包含的任务数; max_columns: 列池条目上限
+    deadline: 可选的截止时间 (time.time())，超过 (或求解被取消) 后不再扩展更长的趟次 (单任务趟次总是完整生成)
+    达到 max_columns 或 deadline 时 truncated = True
+    """
+
+    def __init__(self, scheduler, max_tasks=MAX_TRIP_TASKS, max_columns=MAX_POOL_COLUMNS, deadline=None):
+        if max_tasks < 1:
+            raise ValueError('max_tasks must be >= 1')
+        self.scheduler = scheduler
+        self.max_tasks = max_tasks
+        self.columns = []
+        self.by_task = {t: [] for t in scheduler.tasks}
+        self.truncated = False
+        self._trips = {}
+
+        max_power = max((v['P'] for v in scheduler.vehicles.values()), default=0.0)
+        max_energy = max((v['E'] for v in scheduler.vehicles.values()), default=0.0)
+        chain_succ = scheduler._dag()['chain_succ']
+        tasks = scheduler.tasks
+        order = scheduler._task_order()
+        # chain 后继按任务顺序排列，保证列的生成顺序确定
+        successors = {t: [u for u in order if u in chain_succ[t]] for t in order}
+
+        # 按趟内任务数逐层生成 (先生成全部单任务趟次)，达到上限时截断的是最长的趟次
+        level = []
+        for d_id in scheduler.depots:
+            for first in order:
+                task = tasks[first]
+                energy = task['p'] * task['duration']
+                if task['p'] > max_power + 1e-5 or energy > max_energy + 1e-5:
+                    continue
+                trip = self.trip(d_id, (first,))
+                if trip is not None:
+                    level.append(trip)
+
+        while level:
+            if len(self.columns) + len(level) > max_columns:
+                level = level[:max_columns - len(self.columns)]
+                self.truncated = True
+            # 下一层最多生成到列池上限为止，避免先构造完整层级再截断
+            room = max_columns - len(self.columns) - len(level)
+            for trip in level:
+                self.columns.append(trip)
+                for t in trip.tasks:
+                    self.by_task[t].append(trip)
+            if self.truncated or len(level[0].tasks) >= max_tasks:
+                break
+            next_level = []
+            for trip in level:
+                if len(next_level) > room or scheduler.expired(deadline):
+                    # 已生成的部分层级照常加入列池 (超过上限的部分在下一轮截掉)，然后停止
+                    self.truncated = True
+                    break
+                for nxt in successors[trip.tasks[-1]]:
+                    if (max(trip.max_p, tasks[nxt]['p']) > max_power + 1e-5
+                            or trip.energy + tasks[nxt]['p'] * tasks[nxt]['duration'] > max_energy + 1e-5):
+                        continue
+                    next_level.append(self.trip(trip.depot, trip.tasks + (nxt,)))
+            level = next_level
+
+    def trip(self, depot, tasks):
+        """
+        构造 (并缓存) 一趟往返的列，时间窗不可行时返回 None
+        tasks 中相邻任务必须是 chain 边 (同一趟内可直接赶到)
+        """
+        key = (depot, tasks)
+        if key in self._trips:
+            return self._trips[key]
+        s = self.scheduler
+        chain_succ = s._dag()['chain_succ']
+        first = s.tasks[tasks[0]]
+        lead = s._get_travel_time(depot, tasks[0])
+        depart = max(0.0, first['r_start'] - lead)
+        trip = None
+        if (depart + lead - first['r_start'] <= 1e-5
+                and all(b in chain_succ[a] for a, b in zip(tasks, tasks[1:]))):
+            ret = s.tasks[tasks[-1]]['r_end'] + s._get_travel_time(tasks[-1], depot)
+            trip = Trip(depot, tasks, ret - depart,
+                        sum(s.tasks[t]['p'] * s.tasks[t]['duration'] for t in tasks),
+                        max(s.tasks[t]['p'] for t in tasks), lead, first['r_start'], depart, ret)
+        self._trips[key] = trip
+        return trip
+
+    def split(self, depot, tasks):
+        """把按时间排序的任务拆成最少的连续 chain 段，每段作为一趟；有段不可行时返回 None"""
+        chain_succ = self.scheduler._dag()['chain_succ']
+        trips = []
+        start = 0
+        for k in range(1, len(tasks) + 1):
+            if k == len(tasks) or tasks[k] not in chain_succ[tasks[k - 1]]:
+                trip = self.trip(depot, tuple(tasks[start:k]))
+                if trip is None:
+                    return None
+                trips.append(trip)
+                start = k
+        return trips
+
+
+def pack(scheduler, trips, node_limit=PACK_NODE_LIMIT):
+    """
+    把选中的趟次装配到车辆上 (每辆车只用一个车库，趟次按时间先后衔接)
+    按出发时间依次处理，回溯搜索每趟的车辆: 先尝试同车库、能力满足的已用车辆 (最晚空闲的优先)，
+    再尝试每种能力 (P, E) 中的第一辆空闲车辆 (能力小的优先，同能力的空闲车辆等价)
+    第一条分支就是贪心装配，回溯最多展开 node_limit 个节点
+    Returns: {车辆ID: [Trip, ...]}，找不到装配时返回 None
+    """
+    vehicles = scheduler.vehicles
+    free = sorted(vehicles, key=lambda v: (vehicles[v]['P'], vehicles[v]['E']))
+    ordered = sorted(trips, key=lambda c: (c.depart, c.ret, c.tasks))
+    used = {}  # 车辆ID -> (车库, 最后返回时间)
+    plan = {}
+    nodes = [0]
+
+    def fits(v, trip):
+        return trip.max_p <= vehicles[v]['P'] + 1e-5 and trip.energy <= vehicles[v]['E'] + 1e-5
+
+    def place(k):
+        if k == len(ordered):
+            return True
+        nodes[0] += 1
+        if nodes[0] > node_limit:
+            return False
+        trip = ordered[k]
+        candidates = sorted(
+            (v for v, (depot, last_ret) in used.items()
+             if depot == trip.depot and last_ret + trip.lead - trip.r_start <= 1e-5 and fits(v, trip)),
+            key=lambda v: -used[v][1])
+        seen = set()
+        for v in free:
+            capability = (vehicles[v]['P'], vehicles[v]['E'])
+            if v not in used and capability not in seen and fits(v, trip):
+                seen.add(capability)
+                candidates.append(v)
+
+        for v in candidates:
+            saved = used.get(v)
+            used[v] = (trip.depot, trip.ret)
+            plan.setdefault(v, []).append(trip)
+            if place(k + 1):
+                return True
+            plan[v].pop()
+            if saved is None:
+                del used[v]
+                del plan[v]
+            else:
+                used[v] = saved
+        return False
+
+    return plan if place(0) else None
+
+
+def set_partition_search(scheduler, pool, initial, deadline, on_improve=None, initial_plan=None):
+    """
+    集合划分局部搜索: 当前解是覆盖每个任务恰好一次的一组趟次
+    邻域: 把列池中的一趟换入，与之重叠的已选趟次去掉这些任务 (剩余任务拆成 chain 段)，
+    趟次成本之和下降且仍能装配到车辆上时接受 (first improvement)，直到一轮无改进 (局部最优) 或超时
+    on_improve(plan): 初始方案与每次接受改进后回调
+    initial_plan: 可选的初始解的已知装配 (如贪心解)，给出时不再对初始解调用 pack
+    Returns: (装配方案 {车辆ID: [Trip, ...]}，无法装配初始解时为 None, 统计)
+    """
+    selected = set(initial)
+    plan = initial_plan if initial_plan is not None else pack(scheduler, selected)
+    stats = {'moves': 0, 'passes': 0, 'converged': False}
+    if plan is None:
+        return None, stats
+    if on_improve:
+        on_improve(plan)
+
+    owner = {t: trip for trip in selected for t in trip.tasks}
+    improved = True
+    while improved:
+        improved = False
+        stats['passes'] += 1
+        for column in pool.columns:
+            if scheduler.expired(deadline):
+                return plan, stats
+            if column in selected:
+                continue
+            affected = {owner[t] for t in column.tasks}
+            covered = set(column.tasks)
+            added = [column]
+            for trip in affected:
+                rest = [t for t in trip.tasks if t not in covered]
+                if rest:
+                    pieces = pool.split(trip.depot, rest)
+                    if pieces is None:
+                        break
+                    added.extend(pieces)
+            else:
+                delta = sum(c.cost for c in added) - sum(c.cost for c in affected)
+                if delta >= -1e-9:
+                    continue
+                candidate = (selected - affected) | set(added)
+                new_plan = pack(scheduler, candidate)
+                if new_plan is None:
+                    continue
+                selected, plan = candidate, new_plan
+                for trip in added:
+                    for t in trip.tasks:
+                        owner[t] = trip
+                stats['moves'] += 1
+                improved = True
+                if on_improve:
+                    on_improve(plan)
+    stats['converged'] = True
+    return plan, stats
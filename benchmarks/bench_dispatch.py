@@ -0,0 +1,204 @@
+"""
+调度热力图优化器的离线基准测试
+
+用固定随机种子生成合成场景 (网格分辨率 / 停车点数 / 车队规模 / 断电事件数)，
+逐阶段测量耗时与峰值内存，结果可保存为基线 JSON，并与之前版本的基线对比
+
+用法 (在仓库根目录):
+    python -m benchmarks.bench_dispatch                       # quick 套件，打印结果
+    python -m benchmarks.bench_dispatch --suite full --output benchmarks/baseline.json
+    python -m benchmarks.bench_dispatch --baseline benchmarks/baseline.json --tolerance 0.2
+
+不访问网络: 断电事件、停车点与车辆均在本地生成，不调用高德 API
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from backend.algorithm import CITY_CENTER, GRID_RANGE, DispatchAlgorithm
+from backend.decay_cache import decay_cache
+
+SEED = 20240601
+PHASES = ('map_outage', 'total_support', 'find_best_spots', 'export_heat_points')
+
+# 场景: 名称, 网格分辨率, 停车点数, 车辆数, 断电事件数, 可选的支援核截断 epsilon
+SUITES = {
+    'quick': [
+        ('res50_s100_v20_o1k', 50, 100, 20, 1_000, None),
+        ('res100_s200_v50_o10k', 100, 200, 50, 10_000, None),
+        ('res200_s200_v50_o50k_eps', 200, 200, 50, 50_000, 1e-3),
+    ],
+    'full': [
+        ('res50_s100_v50_o1k', 50, 100, 50, 1_000, None),
+        ('res50_s1000_v2000_o10k', 50, 1_000, 2_000, 10_000, None),
+        ('res50_s1000_v10000_o10k', 50, 1_000, 10_000, 10_000, None),
+        ('res200_s500_v100_o100k', 200, 500, 100, 100_000, None),
+        ('res500_s1000_v200_o500k_eps', 500, 1_000, 200, 500_000, 1e-3),
+        ('res1000_s1000_v100_o500k_eps', 1_000, 1_000, 100, 500_000, 1e-3),
+    ],
+}
+
+
+def make_scenario(index, resolution, n_spots, n_vehicles, n_points):
+    """按场景序号生成可复现的合成数据 (断电事件围绕几个高风险中心聚集，同 service.get_outage_heatmap)"""
+    rng = np.random.default_rng(SEED + index)
+    centers = np.array([[0.05, 0.05], [-0.08, -0.02], [0.02, -0.08]])
+    which = rng.integers(0, len(centers), n_points)
+    offset = centers[which] + rng.normal(0, 0.03, (n_points, 2))
+    outage = [
+        {'lng': CITY_CENTER[0] + x, 'lat': CITY_CENTER[1] + y, 'count': c}
+        for (x, y), c in zip(offset.tolist(), rng.integers(1, 11, n_points).tolist())
+    ]
+
+    spot_xy = rng.uniform(-GRID_RANGE, GRID_RANGE, (n_spots, 2))
+    spots = [{'id': f'P{k + 1}', 'lng': CITY_CENTER[0] + x, 'lat': CITY_CENTER[1] + y}
+             for k, (x, y) in enumerate(spot_xy.tolist())]
+
+    vehicle_xy = rng.uniform(-GRID_RANGE, GRID_RANGE, (n_vehicles, 2))
+    loads = rng.choice([50, 100, 200], n_vehicles)
+    vehicles = [{'id': k + 1, 'load': int(load), 'lng': CITY_CENTER[0] + x, 'lat': CITY_CENTER[1] + y}
+                for k, ((x, y), load) in enumerate(zip(vehicle_xy.tolist(), loads.tolist()))]
+    return outage, spots, vehicles
+
+
+def run_pipeline(resolution, outage, spots, vehicles, epsilon, measure_memory=False):
+    """
+    依次运行各阶段，返回 ({阶段: 秒}, {阶段: 峰值字节}, 最终 loss)
+    每次运行前清空进程级衰减缓存，测量的是冷启动耗时
+    """
+    decay_cache.clear()
+    algorithm = DispatchAlgorithm(resolution=resolution)
+    phases = [
+        ('map_outage', lambda: algorithm.map_outage_to_grid(outage)),
+        ('total_support', lambda: algorithm.calculate_total_support(vehicles, epsilon=epsilon)),
+        ('find_best_spots', lambda: algorithm.find_best_spots(vehicles, spots, epsilon=epsilon,
+                                                              with_heatmap=False)),
+        ('export_heat_points', lambda: (algorithm.get_outage_heat_points(),
+                                        algorithm.get_support_heat_points())),
+    ]
+    seconds = {}
+    peaks = {}
+    if measure_memory:
+        tracemalloc.start()
+    try:
+        for name, fn in phases:
+            if measure_memory:
+                tracemalloc.reset_peak()
+                base, _ = tracemalloc.get_traced_memory()
+            start = time.perf_counter()
+            fn()
+            seconds[name] = time.perf_counter() - start
+            if measure_memory:
+                peaks[name] = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        if measure_memory:
+            tracemalloc.stop()
+    return seconds, peaks, algorithm.calculate_loss()
+
+
+def run_suite(suite, repeat=3, only=None):
+    """
+    运行一个套件: 耗时取 repeat 次中的最小值 (不开启 tracemalloc)，
+    峰值内存在额外的一次 tracemalloc 运行中测量
+    """
+    results = {}
+    for index, (name, resolution, n_spots, n_vehicles, n_points, epsilon) in enumerate(SUITES[suite]):
+        if only and name not in only:
+            continue
+        outage, spots, vehicles = make_scenario(index, resolution, n_spots, n_vehicles, n_points)
+
+        best = None
+        for _ in range(repeat):
+            seconds, _, loss = run_pipeline(resolution, outage, spots, vehicles, epsilon)
+            best = seconds if best is None else {k: min(best[k], v) for k, v in seconds.items()}
+        _, peaks, _ = run_pipeline(resolution, outage, spots, vehicles, epsilon, measure_memory=True)
+
+        results[name] = {
+            'params': {'resolution': resolution, 'spots': n_spots, 'vehicles': n_vehicles,
+                       'outagePoints': n_points, 'supportEpsilon': epsilon},
+            'loss': loss,
+            'phases': {phase: {'seconds': best[phase], 'peakBytes': peaks[phase]} for phase in PHASES}
+        }
+        print_scenario(name, results[name])
+    return results
+
+
+def print_scenario(name, result):
+    print(f'\n{name}  (loss = {result["loss"]:.6g})')
+    for phase in PHASES:
+        stats = result['phases'][phase]
+        print(f'  {phase:<20} {stats["seconds"] * 1000:>10.1f} ms  {stats["peakBytes"] / 2 ** 20:>9.1f} MiB')
+
+
+def compare(current, baseline, tolerance):
+    """
+    与基线逐场景/逐阶段对比，耗时或峰值内存超过基线 (1 + tolerance) 倍的记为回归
+    Returns: 回归条目列表
+    """
+    regressions = []
+    print(f'\n对比基线 (容差 {tolerance:.0%}):')
+    for name, result in current['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(name)
+        if old is None:
+            print(f'  {name}: 基线中不存在，跳过')
+            continue
+        for phase in PHASES:
+            for metric in ('seconds', 'peakBytes'):
+                new_val = result['phases'][phase][metric]
+                old_val = old['phases'].get(phase, {}).get(metric)
+                if not old_val:
+                    continue
+                ratio = new_val / old_val
+                flag = ''
+                if ratio > 1 + tolerance:
+                    flag = '  <-- 回归'
+                    regressions.append({'scenario': name, 'phase': phase, 'metric': metric, 'ratio': ratio})
+                print(f'  {name:<32} {phase:<20} {metric:<10} x{ratio:6.2f}{flag}')
+        if abs(result['loss'] - old['loss']) > 1e-6 * max(1.0, abs(old['loss'])):
+            print(f'  {name}: loss 变化 {old["loss"]:.6g} -> {result["loss"]:.6g}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='调度热力图优化器离线基准测试')
+    parser.add_argument('--suite', choices=sorted(SUITES), default='quick')
+    parser.add_argument('--scenario', action='append', help='只运行指定名称的场景 (可重复)')
+    parser.add_argument('--repeat', type=int, default=3, help='耗时取多次运行的最小值')
+    parser.add_argument('--output', help='把结果保存为基线 JSON')
+    parser.add_argument('--baseline', help='与之前保存的基线 JSON 对比')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='回归判定容差 (相对比例)')
+    args = parser.parse_args(argv)
+
+    report = {
+        'meta': {
+            'suite': args.suite,
+            'seed': SEED,
+            'repeat': args.repeat,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+        },
+        'scenarios': run_suite(args.suite, max(1, args.repeat), args.scenario)
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f'\n结果已保存到 {args.output}')
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f'\n发现 {len(regressions)} 项回归')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,310 @@
+"""
+停车点调度算法 (DispatchAlgorithm) 的离线测试: 合成断电事件与停车点，不调用高德 API
+
+用法 (在仓库根目录): python -m pytest tests 或 python -m unittest discover tests
+"""
+import base64
+import math
+import random
+import unittest
+from unittest import mock
+import numpy as np
+from backend import heatmap_codec, parallel, sparse_support
+from backend.algorithm import (BIN_SIZE, CITY_CENTER, MAX_PYRAMID_LEVELS, OUTAGE_KERNEL_RADIUS,
+                               OUTAGE_KERNEL_SCALE, DispatchAlgorithm, dense_candidate_losses)
+from backend.decay_cache import point_key
+from backend.tiles import MIN_VALUE, TILE_CELLS, TILE_DETAIL_ZOOM, pool_max
+
+
+def make_points(n, seed=0, spread=0.12):
+    """城市中心附近固定随机种子的断电事件 [{lng, lat, count}]"""
+    rnd = random.Random(seed)
+    return [{'lng': CITY_CENTER[0] + rnd.uniform(-spread, spread),
+             'lat': CITY_CENTER[1] + rnd.uniform(-spread, spread),
+             'count': float(rnd.randint(20, 100))}
+            for _ in range(n)]
+
+
+def make_spots(n, seed=0, spread=0.12):
+    """城市中心附近固定随机种子的候选停车点 [{lng, lat}]"""
+    rnd = random.Random(seed)
+    return [{'lng': CITY_CENTER[0] + rnd.uniform(-spread, spread),
+             'lat': CITY_CENTER[1] + rnd.uniform(-spread, spread)}
+            for _ in range(n)]
+
+
+def make_vehicles(n, seed=0):
+    """载荷取 50 / 100 / 200 的车辆 (未停放)"""
+    rnd = random.Random(seed)
+    return [{'id': f'V{i}', 'load': float(rnd.choice([50, 100, 200]))} for i in range(n)]
+
+
+def direct_loss(outage, support):
+    """按定义计算损失: support 做 min-max 归一化后与 outage 的差的平方和"""
+    rng = support.max() - support.min()
+    normalized = (support - support.min()) / (rng if rng else 1)
+    return float(np.sum((outage - normalized) ** 2))
+
+
+class OutageMappingTest(unittest.TestCase):
+    def test_binned_within_snapping_bound(self):
+        """
+        分箱 + FFT 与精确映射的差异不超过吸附误差上界:
+        热力点吸附到最近格点 (每轴不超过半个箱宽)，距离变化 h <= 箱宽 / sqrt(2)，
+        单个 (热力点, 网格) 对的误差不超过 count * exp(-k * max(0, d - h)) * (1 - exp(-k * h))，
+        距离落在截断半径 R 两侧 h 内时另加 count * exp(-k * (R - h))
+        """
+        points = make_points(400, seed=11)
+        k, radius = OUTAGE_KERNEL_SCALE, OUTAGE_KERNEL_RADIUS
+        for resolution in (50, 120):
+            algorithm = DispatchAlgorithm(resolution=resolution)
+            algorithm.map_outage_to_grid(points, method='exact')
+            exact = algorithm._outage_raw.copy()
+            algorithm.map_outage_to_grid(points, method='binned')
+            binned = algorithm._outage_raw
+
+            h = algorithm.step / math.ceil(algorithm.step / BIN_SIZE) / math.sqrt(2)
+            p_lng, p_lat, p_count = algorithm.heat_points
+            d = np.hypot(algorithm.lng[:, None] - p_lng[None, :], algorithm.lat[:, None] - p_lat[None, :])
+            pair = np.where(d < radius + h, np.exp(-k * np.maximum(d - h, 0)) * (1 - math.exp(-k * h)), 0.0)
+            pair += np.where(np.abs(d - radius) <= h, math.exp(-k * (radius - h)), 0.0)
+            bound = pair @ p_count + 1e-9 * exact.max()
+
+            self.assertTrue(np.all(np.abs(binned - exact) <= bound), resolution)
+            # 归一化后的差异在满量程的 2% 以内
+            self.assertLess(np.abs(algorithm.outage - DispatchAlgorithm._normalize(exact)).max(), 0.02)
+
+
+class OutageEventsTest(unittest.TestCase):
+    def test_incremental_matches_remap(self):
+        """增量新增/删除事件后的 outage 与对剩余事件完整重新映射的结果一致"""
+        first, second = make_points(300, seed=1), make_points(200, seed=2)
+        incremental = DispatchAlgorithm()
+        incremental.map_outage_to_grid(first)
+        incremental.update_outage_events(added=second)
+        incremental.update_outage_events(removed=first[::3] + second[1::4])
+
+        remaining = [p for k, p in enumerate(first) if k % 3] + [p for k, p in enumerate(second) if k % 4 != 1]
+        remap = DispatchAlgorithm()
+        remap.map_outage_to_grid(remaining, method='exact')
+        np.testing.assert_allclose(incremental.outage, remap.outage, atol=1e-9)
+        np.testing.assert_allclose(incremental._outage_raw, remap._outage_raw, rtol=1e-9, atol=1e-9)
+
+    def test_removing_everything_leaves_no_residue(self):
+        """两批重叠事件全部删除后与空集映射相同 (全为 0)，不留下被归一化放大的舍入残差"""
+        first, second = make_points(150, seed=3, spread=0.03), make_points(150, seed=4, spread=0.03)
+        algorithm = DispatchAlgorithm()
+        algorithm.update_outage_events(added=first)
+        algorithm.update_outage_events(added=second)
+        algorithm.update_outage_events(removed=second + first)
+        self.assertEqual(np.count_nonzero(algorithm._outage_raw), 0)
+        self.assertEqual(np.count_nonzero(algorithm.outage), 0)
+        self.assertEqual(algorithm.get_outage_heat_points(), [])
+
+        algorithm.update_outage_events(added=first)
+        algorithm.update_outage_events(removed=first[:100])
+        remap = DispatchAlgorithm()
+        remap.map_outage_to_grid(first[100:], method='exact')
+        np.testing.assert_allclose(algorithm.outage, remap.outage, atol=1e-9)
+
+
+class CandidateLossTest(unittest.TestCase):
+    """稀疏 / 统计量 / 交换等快速试算路径与按定义计算的损失一致"""
+    RADIUS_KM = 3.0
+
+    def setUp(self):
+        self.algorithm = DispatchAlgorithm(resolution=60)
+        self.algorithm.map_outage_to_grid(make_points(300, seed=12))
+        self.outage = self.algorithm.outage
+        spots = make_spots(50, seed=13)
+        keys = [point_key(s['lng'], s['lat']) for s in spots]
+        self.sparse = self.algorithm._cached_sparse_rows(keys, self.RADIUS_KM)
+        # 与稀疏足迹完全相同的稠密矩阵 (截断外为 0)
+        self.dense = np.zeros((self.sparse.n_rows, self.algorithm.cell_count))
+        for r in range(self.sparse.n_rows):
+            idx, val = self.sparse.row(r)
+            self.dense[r, idx] = val
+        rng = np.random.default_rng(14)
+        # 基准支援值: 空网格 / 几个足迹叠加 (大片网格取最小值) / 处处为正且唯一最小值落在足迹内
+        spread = rng.uniform(1.0, 2.0, self.algorithm.cell_count)
+        spread[self.sparse.row(0)[0][0]] = 0.5
+        self.bases = [np.zeros(self.algorithm.cell_count),
+                      rng.uniform(20, 80, 5) @ self.dense[rng.choice(50, 5, replace=False)],
+                      spread]
+
+    def expected(self, base, rows):
+        return np.array([direct_loss(self.outage, base + row) for row in rows])
+
+    def test_candidate_losses(self):
+        load = 75.0
+        for base in self.bases:
+            expected = self.expected(base, load * self.dense)
+            np.testing.assert_allclose(dense_candidate_losses(self.outage, base, self.dense, load), expected,
+                                       rtol=1e-9, atol=1e-9)
+            np.testing.assert_allclose(sparse_support.candidate_losses(self.outage, base, self.sparse, load),
+                                       expected, rtol=1e-7, atol=1e-7)
+            stats = self.algorithm._dense_loss_stats(self.dense)
+            np.testing.assert_allclose(self.algorithm._stats_candidate_losses(base, self.dense, load, stats),
+                                       expected, rtol=1e-7, atol=1e-7)
+
+    def test_swap_losses(self):
+        spot, others = 3, [0, 7, 12, 25, 49]
+        coefs = [50.0, -100.0, 150.0, -50.0, 100.0]
+        for base in self.bases[1:]:
+            expected = self.expected(base, [c * (self.dense[o] - self.dense[spot]) for o, c in zip(others, coefs)])
+            np.testing.assert_allclose(self.algorithm._swap_losses(base, self.dense, spot, others, coefs),
+                                       expected, rtol=1e-9, atol=1e-9)
+            np.testing.assert_allclose(
+                sparse_support.swap_losses(self.outage, base, self.sparse, spot, others, coefs),
+                expected, rtol=1e-7, atol=1e-7)
+
+    def test_sparse_and_dense_placement_agree(self):
+        """同一截断足迹下稀疏与稠密路径的贪心 + 局部搜索给出相同放置"""
+        vehicles = make_vehicles(10, seed=15)
+        spots = make_spots(50, seed=13)
+        placements = []
+        for decay in (self.sparse, self.dense):
+            loads = sorted((v['load'] for v in vehicles), reverse=True)
+            if decay is self.sparse:
+                decay.outage_dot = decay.row_dot(self.outage)
+            chosen, _, support = self.algorithm._greedy_assign(loads, decay)
+            self.algorithm._local_search(loads, chosen, decay, support, time_limit=10)
+            placements.append(chosen)
+        self.assertEqual(placements[0], placements[1])
+        self.assertEqual(len(spots), self.sparse.n_rows)
+
+    def test_grouped_greedy_with_one_vehicle_per_step(self):
+        """分组贪心在每一步只放一辆车时与逐辆贪心相同"""
+        loads = sorted((v['load'] for v in make_vehicles(12, seed=16)), reverse=True)
+        for decay in (self.sparse, self.dense):
+            if decay is self.sparse:
+                decay.outage_dot = decay.row_dot(self.outage)
+            greedy, _, _ = self.algorithm._greedy_assign(loads, decay)
+            grouped, _, _ = self.algorithm._grouped_greedy_assign(loads, decay, steps=len(loads))
+            self.assertEqual(grouped, greedy)
+
+
+class MultiresTest(unittest.TestCase):
+    def setUp(self):
+        self.algorithm = DispatchAlgorithm()
+        self.algorithm.map_outage_to_grid(make_points(200, seed=5))
+        self.spots = make_spots(40, seed=6)
+        self.vehicles = make_vehicles(6, seed=7)
+
+    def test_rejects_out_of_range_levels_and_top_k(self):
+        for kwargs in ({'levels': 0}, {'levels': MAX_PYRAMID_LEVELS + 1}, {'levels': 10 ** 9},
+                       {'top_k': 0}, {'top_k': len(self.spots) + 1}):
+            with self.assertRaises(ValueError, msg=kwargs):
+                self.algorithm.find_best_spots_multires(self.vehicles, self.spots, resolution=32, **kwargs)
+
+    def test_collapsed_levels_are_deduplicated(self):
+        """resolution=16 时 5 层金字塔截到最小分辨率后只剩 8 / 16 两层"""
+        _, _, _, pyramid, _ = self.algorithm.find_best_spots_multires(
+            self.vehicles, self.spots, resolution=16, levels=5)
+        self.assertEqual([level['resolution'] for level in pyramid], [8, 16])
+
+    def test_session_support_follows_final_grid(self):
+        """最细层级与会话网格不同时，会话网格的支援值按最终放置重新计算"""
+        version = self.algorithm.support_version
+        placed, _, _, _, final = self.algorithm.find_best_spots_multires(
+            self.vehicles, self.spots, resolution=80, levels=3)
+        self.assertIsNot(final, self.algorithm)
+        self.assertGreater(self.algorithm.support_version, version)
+        expected = DispatchAlgorithm()
+        expected.calculate_total_support(placed)
+        np.testing.assert_allclose(self.algorithm.support, expected.support)
+
+
+class ShardedEvaluationTest(unittest.TestCase):
+    def test_matches_serial_and_reuses_pool(self):
+        """进程池分片试算与单进程结果完全相同 (含 argmin 的并列处理)，进程池在多次优化间复用"""
+        algorithm = DispatchAlgorithm()
+        algorithm.map_outage_to_grid(make_points(200, seed=8))
+        spots, vehicles = make_spots(2 * parallel.MIN_ROWS_PER_WORKER + 10, seed=9), make_vehicles(12, seed=10)
+        serial, serial_loss, _ = algorithm.find_best_spots(vehicles, spots, with_heatmap=False)
+        with mock.patch.object(parallel, 'max_workers', return_value=2):
+            sharded, sharded_loss, _ = algorithm.find_best_spots(vehicles, spots, with_heatmap=False, workers=2)
+            pool = parallel._shared_pool()
+            algorithm.find_best_spots(vehicles, spots, with_heatmap=False, workers=2)
+            self.assertIs(parallel._shared_pool(), pool)
+        self.assertEqual(sharded, serial)
+        self.assertEqual(sharded_loss, serial_loss)
+
+
+
+class HeatmapCodecTest(unittest.TestCase):
+    def test_quantization_error(self):
+        values = np.random.default_rng(17).uniform(0, 1, 1000)
+        for dtype, (_, max_q) in heatmap_codec.QUANT_DTYPES.items():
+            quantized = heatmap_codec.quantize(values, dtype)
+            self.assertLessEqual(np.abs(quantized / max_q - values).max(), 0.5 / max_q + 1e-12)
+
+    def test_delta_round_trip(self):
+        """客户端按 (base + delta) mod 2^bits 还原出完整量化数组 (二进制与 base64 负载)"""
+        algorithm = DispatchAlgorithm()
+        algorithm.map_outage_to_grid(make_points(200, seed=18))
+        for dtype in heatmap_codec.QUANT_DTYPES:
+            base_meta, base, _ = algorithm.encode_heatmap('outage', dtype)
+            algorithm.update_outage_events(added=make_points(50, seed=19), removed=make_points(200, seed=18)[:80])
+            meta, quantized, delta_base = algorithm.encode_heatmap('outage', dtype, base_meta['version'])
+            self.assertTrue(meta['delta'])
+            self.assertEqual(meta['baseVersion'], base_meta['version'])
+            np.testing.assert_array_equal(delta_base, base)
+            np.testing.assert_array_equal(quantized, heatmap_codec.quantize(algorithm.outage, dtype))
+
+            wire_type = np.dtype(dtype).newbyteorder('<')
+            payload = heatmap_codec.to_json(meta, quantized, delta_base)
+            for raw in (heatmap_codec.to_bytes(quantized, delta_base), base64.b64decode(payload['data'])):
+                delta = np.frombuffer(raw, dtype=wire_type)
+                np.testing.assert_array_equal((base + delta).astype(dtype), quantized)
+
+    def test_unknown_base_falls_back_to_full(self):
+        algorithm = DispatchAlgorithm()
+        algorithm.map_outage_to_grid(make_points(50, seed=20))
+        meta, quantized, base = algorithm.encode_heatmap('outage', base_version=10 ** 6)
+        self.assertFalse(meta['delta'])
+        self.assertIsNone(base)
+
+
+class TileTest(unittest.TestCase):
+    def test_pool_max_matches_blocks(self):
+        values = np.random.default_rng(21).uniform(0, 1, (50, 50))
+        for factor in (1, 2, 4, 8, 64):
+            pooled = pool_max(values, factor)
+            self.assertEqual(pooled.shape, (math.ceil(50 / factor),) * 2)
+            for i, j in np.ndindex(*pooled.shape):
+                block = values[i * factor:(i + 1) * factor, j * factor:(j + 1) * factor]
+                self.assertEqual(pooled[i, j], block.max())
+
+    def test_tiles_cover_grid_and_pool(self):
+        """全视口瓦片: 细节级别与逐网格热力点相同；低缩放级别的每个点是对应网格块的最大值"""
+        algorithm = DispatchAlgorithm(resolution=70)
+        algorithm.map_outage_to_grid(make_points(300, seed=22))
+        bbox = (CITY_CENTER[0] - 1, CITY_CENTER[1] - 1, CITY_CENTER[0] + 1, CITY_CENTER[1] + 1)
+
+        detail = algorithm.get_heatmap_tiles('outage', bbox, TILE_DETAIL_ZOOM)
+        self.assertEqual(detail['poolFactor'], 1)
+        key = lambda p: (round(p['lng'], 9), round(p['lat'], 9))
+        expected = {key(p): p['count'] for p in algorithm.get_outage_heat_points()}
+        self.assertEqual({key(p): p['count'] for p in detail['points']}, expected)
+        self.assertEqual(len(detail['tiles']), math.ceil(70 / TILE_CELLS) ** 2)
+
+        coarse = algorithm.get_heatmap_tiles('outage', bbox, TILE_DETAIL_ZOOM - 2)
+        factor = coarse['poolFactor']
+        self.assertEqual(factor, 4)
+        grid = algorithm.outage.reshape(70, 70)
+        step = algorithm.step
+        for p in coarse['points']:
+            i = int(round((p['lng'] - algorithm.geometry.lng_axis[0]) / step - (factor - 1) / 2)) // factor
+            j = int(round((p['lat'] - algorithm.geometry.lat_axis[0]) / step - (factor - 1) / 2)) // factor
+            block = grid[i * factor:(i + 1) * factor, j * factor:(j + 1) * factor]
+            self.assertAlmostEqual(p['count'], block.max() * 100)
+        self.assertEqual(len(coarse['points']), int(np.count_nonzero(pool_max(grid, factor) > MIN_VALUE)))
+
+        misses = algorithm.tile_cache.misses
+        self.assertEqual(algorithm.get_heatmap_tiles('outage', bbox, TILE_DETAIL_ZOOM - 2), coarse)
+        self.assertEqual(algorithm.tile_cache.misses, misses)
+
+
+if __name__ == '__main__':
+    unittest.main()
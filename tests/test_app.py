@@ -0,0 +1,76 @@
+"""
+Flask 路由的参数校验测试 (Flask test client，不调用高德 API)
+
+用法 (在仓库根目录): python -m pytest tests 或 python -m unittest discover tests
+"""
+import threading
+import unittest
+from unittest import mock
+import app as app_module
+from app import app
+
+
+class OutageEventsRouteTest(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        self.headers = {'X-Session-Id': 'test-outage-events'}
+
+    def test_rejects_non_numeric_fields(self):
+        """lng / lat / count 不是有限数值 (含 bool、字符串、NaN) 时返回 400 而不是 500"""
+        good = {'lng': 114.5, 'lat': 38.0, 'count': 10}
+        for field, value in (('lng', 'a'), ('lat', True), ('count', '5'), ('count', float('nan')),
+                             ('lng', None)):
+            event = dict(good, **{field: value})
+            response = self.client.post('/api/outage-events', json={'add': [event]}, headers=self.headers)
+            self.assertEqual(response.status_code, 400, (field, value))
+            response = self.client.post('/api/outage-events', json={'remove': [event]}, headers=self.headers)
+            self.assertEqual(response.status_code, 400, (field, value))
+
+    def test_accepts_numeric_events(self):
+        event = {'lng': 114.5, 'lat': 38.0, 'count': 10}
+        response = self.client.post('/api/outage-events', json={'add': [event]}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['added'], 1)
+        response = self.client.post('/api/outage-events', json={'remove': [event]}, headers=self.headers)
+        self.assertEqual(response.get_json()['removed'], 1)
+
+
+class ScheduleStreamTest(unittest.TestCase):
+    def test_disconnect_cancels_solver(self):
+        """流式调度的客户端断开 (响应生成器被关闭) 后，求解线程收到取消标志"""
+        received = {}
+
+        def fake_run_schedule(data, on_incumbent=None, cancel=None):
+            received['cancel'] = cancel
+            on_incumbent({'objective': 1.0, 'elapsed': 0.0, 'routes': []})
+            cancel.wait(5)
+            return {'status': 'error', 'message': 'cancelled'}
+
+        with mock.patch.object(app_module, 'run_schedule', side_effect=fake_run_schedule):
+            response = app.test_client().post('/api/schedule-deterministic?stream=1', json={'tasks': []},
+                                              buffered=False)
+            first = next(response.response)
+            self.assertIn(b'event: incumbent', first if isinstance(first, bytes) else first.encode())
+            response.close()
+        self.assertIsInstance(received['cancel'], threading.Event)
+        self.assertTrue(received['cancel'].wait(5))
+
+
+class HeatmapTileRouteTest(unittest.TestCase):
+    def test_fractional_zoom(self):
+        """AMap 的小数缩放级别 (如 11.5) 向下取整后查询，与整数级别结果相同"""
+        client = app.test_client()
+        headers = {'X-Session-Id': 'test-heatmap-tile'}
+        client.post('/api/outage-events', json={'add': [{'lng': 114.51, 'lat': 38.04, 'count': 50}]},
+                    headers=headers)
+        args = 'layer=outage&bbox=114.3,37.9,114.7,38.2'
+        fractional = client.get(f'/api/heatmap-tile?{args}&zoom=11.5', headers=headers)
+        self.assertEqual(fractional.status_code, 200)
+        integer = client.get(f'/api/heatmap-tile?{args}&zoom=11', headers=headers)
+        self.assertEqual(fractional.get_json(), integer.get_json())
+        for zoom in ('abc', 'nan', 'inf', ''):
+            self.assertEqual(client.get(f'/api/heatmap-tile?{args}&zoom={zoom}', headers=headers).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
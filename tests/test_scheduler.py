@@ -0,0 +1,254 @@
+"""
+确定性调度器的离线测试: 合成任务与车辆，tau 由平面欧氏距离按固定车速换算，不调用高德 API
+
+用法 (在仓库根目录): python -m pytest tests 或 python -m unittest discover tests
+"""
+import itertools
+import math
+import random
+import threading
+import time
+import unittest
+from unittest import mock
+from backend import gaode_api, parallel
+from backend.scheduler import Scheduler, run_schedule
+from backend.trip_pool import TripPool
+
+# 合成路网的车速 (km/h) 与 1 度对应的公里数
+SPEED_KMH = 30.0
+KM_PER_DEGREE = 111.0
+
+
+def make_scheduler(n_tasks, n_vehicles, n_depots=2, seed=0, horizon=24.0):
+    """生成固定随机种子的合成实例，tau / polyline 直接写入，无需 build_travel_matrix"""
+    rnd = random.Random(seed)
+    depots = [{'id': f'D{i}', 'lat': 38 + rnd.uniform(-0.1, 0.1), 'lng': 114.5 + rnd.uniform(-0.1, 0.1)}
+              for i in range(n_depots)]
+    tasks = [{'id': f'T{i}', 'lat': 38 + rnd.uniform(-0.1, 0.1), 'lng': 114.5 + rnd.uniform(-0.1, 0.1),
+              'start': rnd.uniform(0, horizon), 'duration': rnd.uniform(0.5, 2.0),
+              'power': rnd.choice([50, 100, 150])}
+             for i in range(n_tasks)]
+    vehicles = [{'id': f'V{i}', 'power': rnd.choice([100, 200]), 'energy': rnd.choice([300, 600])}
+                for i in range(n_vehicles)]
+    scheduler = Scheduler(depots, tasks, vehicles)
+    for a in scheduler.all_locations:
+        for b in scheduler.all_locations:
+            km = math.hypot(a['lat'] - b['lat'], a['lng'] - b['lng']) * KM_PER_DEGREE
+            scheduler.tau[(a['id'], b['id'])] = km / SPEED_KMH
+            scheduler.polylines[(a['id'], b['id'])] = f"{a['lng']},{a['lat']};{b['lng']},{b['lat']}"
+    return scheduler
+
+
+def brute_sequence_cost(scheduler, seq, v_id):
+    """
+    暴力评估: 枚举车库与序列的全部切分 (每段一趟)，逐趟按时间模拟
+    不依赖 DAG / 区间 DP，用于校验 sequence_cost；不可行时返回 None
+    """
+    vehicle = scheduler.vehicles[v_id]
+    tasks = scheduler.tasks
+    tau = scheduler._get_travel_time
+    if not seq:
+        return 0.0
+    best = None
+    for depot in scheduler.depots:
+        for cuts in itertools.product((False, True), repeat=len(seq) - 1):
+            trips, start = [], 0
+            for k, cut in enumerate(cuts, 1):
+                if cut:
+                    trips.append(seq[start:k])
+                    start = k
+            trips.append(seq[start:])
+
+            total, now, feasible = 0.0, 0.0, True
+            for trip in trips:
+                energy = sum(tasks[t]['p'] * tasks[t]['duration'] for t in trip)
+                if max(tasks[t]['p'] for t in trip) > vehicle['P'] + 1e-5 or energy > vehicle['E'] + 1e-5:
+                    feasible = False
+                    break
+                depart = max(now, tasks[trip[0]]['r_start'] - tau(depot, trip[0]), 0.0)
+                prev, clock = depot, depart
+                for t in trip:
+                    if clock + tau(prev, t) > tasks[t]['r_start'] + 1e-5:
+                        feasible = False
+                        break
+                    prev, clock = t, tasks[t]['r_end']
+                if not feasible:
+                    break
+                now = clock + tau(prev, depot)
+                total += now - depart
+            if feasible and (best is None or total < best):
+                best = total
+    return best
+
+
+def brute_optimum(scheduler):
+    """暴力求解: 枚举每个任务分给哪辆车 (车辆内按 _task_order 执行)，返回最小总耗时，无可行解时为 None"""
+    order = scheduler._task_order()
+    vehicle_ids = list(scheduler.vehicles)
+    best = None
+    for assign in itertools.product(range(len(vehicle_ids)), repeat=len(order)):
+        total = 0.0
+        for i, v in enumerate(vehicle_ids):
+            cost = brute_sequence_cost(scheduler, tuple(t for t, a in zip(order, assign) if a == i), v)
+            if cost is None:
+                break
+            total += cost
+        else:
+            if best is None or total < best:
+                best = total
+    return best
+
+
+def solution_total(scheduler, solution):
+    """用暴力评估重新计算解中各车辆序列的成本之和，并检查每个任务恰好出现一次"""
+    seen = sorted(t for info in solution.values() for t in info['seq'])
+    assert seen == sorted(scheduler.tasks), 'every task must be assigned exactly once'
+    total = 0.0
+    for v, info in solution.items():
+        cost = brute_sequence_cost(scheduler, tuple(info['seq']), v)
+        assert cost is not None, f'infeasible sequence for {v}'
+        assert abs(cost - info['time']) < 1e-6
+        total += cost
+    return total
+
+
+class SequenceCostTest(unittest.TestCase):
+    def test_matches_brute_force(self):
+        """sequence_cost 与暴力切分在可行性与成本上一致，且覆盖了一趟内含多个任务的序列"""
+        feasible = chained = 0
+        for seed, horizon in itertools.product(range(4), (5.0, 8.0)):
+            scheduler = make_scheduler(7, 2, seed=seed, horizon=horizon)
+            order = scheduler._task_order()
+            for v in scheduler.vehicles:
+                for r in range(1, 5):
+                    for seq in itertools.combinations(order, r):
+                        expected = brute_sequence_cost(scheduler, seq, v)
+                        ok, _, total, _, _, trips = scheduler.sequence_cost(seq, v)
+                        self.assertEqual(ok, expected is not None, (seed, seq, v))
+                        if ok:
+                            self.assertAlmostEqual(total, expected, places=6)
+                            feasible += 1
+                            chained += len(trips) < len(seq)
+        self.assertGreater(feasible, 0)
+        self.assertGreater(chained, 0)
+
+
+class SolverTest(unittest.TestCase):
+    # (种子, 时间范围): 第一个实例无可行解，其余均可行
+    INSTANCES = [(0, 6.0), (1, 8.0), (5, 8.0), (6, 12.0), (7, 12.0), (4, 24.0), (9, 24.0)]
+
+    def test_bnb_is_optimal(self):
+        for seed, horizon in self.INSTANCES:
+            scheduler = make_scheduler(6, 3, seed=seed, horizon=horizon)
+            expected = brute_optimum(scheduler)
+            solution = scheduler.solve('bnb')
+            self.assertTrue(scheduler.search_stats['optimal'])
+            if expected is None:
+                self.assertFalse(solution)
+            else:
+                self.assertAlmostEqual(solution_total(scheduler, solution), expected, places=6)
+
+    def test_parallel_bnb_is_optimal(self):
+        with mock.patch.object(parallel, 'max_workers', return_value=2):
+            for seed, horizon in self.INSTANCES:
+                scheduler = make_scheduler(6, 3, seed=seed, horizon=horizon)
+                expected = brute_optimum(scheduler)
+                solution = scheduler.solve('bnb', workers=2)
+                if expected is None:
+                    self.assertFalse(solution)
+                else:
+                    self.assertAlmostEqual(solution_total(scheduler, solution), expected, places=6)
+
+    def test_heuristics_are_feasible(self):
+        """columns / alns 不保证最优: 返回的解必须可行、成本与暴力评估一致且不低于最优值"""
+        for method in ('columns', 'alns'):
+            for seed, horizon in self.INSTANCES:
+                scheduler = make_scheduler(6, 3, seed=seed, horizon=horizon)
+                expected = brute_optimum(scheduler)
+                solution = scheduler.solve(method, time_limit=5, iterations=200)
+                if not solution:
+                    continue
+                total = solution_total(scheduler, solution)
+                self.assertAlmostEqual(total, scheduler.search_stats['bestTotalTime'], places=6)
+                self.assertGreaterEqual(total, expected - 1e-6)
+
+    def test_columns_reports_trip_limit(self):
+        """列池按 max_trip_tasks 限制趟次长度，并在 search_stats 中报告"""
+        scheduler = make_scheduler(7, 2, seed=1, horizon=5.0)
+        scheduler.solve('columns', max_trip_tasks=1)
+        self.assertEqual(scheduler.search_stats['maxTripTasks'], 1)
+        self.assertEqual(scheduler.search_stats['columns'], len(TripPool(scheduler, max_tasks=1).columns))
+        self.assertGreater(len(TripPool(scheduler).columns), scheduler.search_stats['columns'])
+
+    def test_trip_pool_stops_at_limits(self):
+        """列池达到条目上限或截止时间时截断: 截止时间已过时只保留单任务趟次"""
+        scheduler = make_scheduler(7, 2, seed=1, horizon=5.0)
+        full = TripPool(scheduler)
+        singles = TripPool(scheduler, max_tasks=1)
+        self.assertFalse(full.truncated)
+
+        late = TripPool(scheduler, deadline=0.0)
+        self.assertTrue(late.truncated)
+        self.assertEqual(late.columns, singles.columns)
+
+        capped = TripPool(scheduler, max_columns=len(singles.columns) + 1)
+        self.assertTrue(capped.truncated)
+        self.assertEqual(capped.columns, full.columns[:len(singles.columns) + 1])
+
+
+class RunScheduleTest(unittest.TestCase):
+    def test_rejects_bad_parameters_before_matrix(self):
+        """solver / workers / maxTripTasks / iterations / timeLimit 非法时直接返回错误，不调用高德 API"""
+        base = {'tasks': [], 'vehicles': [], 'depots': []}
+        with mock.patch.object(gaode_api, 'get_matrix_async') as matrix:
+            for extra in ({'solver': 'simplex'}, {'workers': 0}, {'workers': True}, {'maxTripTasks': '3'},
+                          {'iterations': True}, {'timeLimit': True}, {'timeLimit': '5'}, {'timeLimit': 0},
+                          {'timeLimit': float('nan')}):
+                result = run_schedule(dict(base, **extra))
+                self.assertEqual(result['status'], 'error', extra)
+            matrix.assert_not_called()
+
+
+class BranchAndBoundTest(unittest.TestCase):
+    def test_fifteen_tasks_proved_optimal(self):
+        """15 任务 / 4 车 / 2 车库 / 24 小时: 下界应足够紧，在时间上限内证明最优"""
+        for seed in range(5):
+            scheduler = make_scheduler(15, 4, seed=seed)
+            scheduler.solve(time_limit=30)
+            self.assertTrue(scheduler.search_stats['optimal'], f'seed {seed}')
+
+
+class CancelTest(unittest.TestCase):
+    def test_cancelled_solvers_return_promptly(self):
+        """取消标志已设置时各求解器不等到时间上限，立即返回 (至少是贪心的) 可行解"""
+        with mock.patch.object(parallel, 'max_workers', return_value=2):
+            for method, workers in (('bnb', None), ('bnb', 2), ('columns', None), ('alns', None)):
+                scheduler = make_scheduler(40, 8, seed=0)
+                scheduler.cancel = threading.Event()
+                scheduler.cancel.set()
+                start = time.time()
+                solution = scheduler.solve(method, workers=workers, time_limit=60, iterations=10 ** 6)
+                self.assertLess(time.time() - start, 10, (method, workers))
+                self.assertTrue(solution, (method, workers))
+                self.assertFalse(scheduler.search_stats['optimal'])
+
+
+class SequenceCacheTest(unittest.TestCase):
+    def test_rebuilding_matrix_resets_cache(self):
+        """build_travel_matrix 之后不能复用旧 tau 下的序列评估结果"""
+        scheduler = make_scheduler(6, 2, seed=1)
+        seq = tuple(scheduler._task_order()[:1])
+        scheduler.sequence_cost(seq, 'V0')
+        self.assertTrue(scheduler._sequence_cache)
+
+        slower = {key: {'duration': value * 2 * 3600, 'polyline': ''} for key, value in scheduler.tau.items()}
+        with mock.patch.object(gaode_api, 'get_matrix_async', return_value=slower):
+            scheduler.build_travel_matrix()
+        self.assertFalse(scheduler._sequence_cache)
+        self.assertEqual(scheduler.sequence_cache_stats['misses'], 0)
+        expected = scheduler._evaluate_sequence(seq, scheduler.vehicles['V0']['P'], scheduler.vehicles['V0']['E'])
+        self.assertEqual(scheduler.sequence_cost(seq, 'V0'), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()